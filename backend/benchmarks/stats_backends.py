@@ -0,0 +1,69 @@
+"""
+Compare reading the usage of every running container from the cgroup files
+with asking the Docker stats API (`stream=false`, as a one-shot fallback does).
+
+Run from the backend directory, with the daemon reachable and, for the cgroup
+side, the host cgroups visible (see `CGROUP_ROOT`):
+
+    python -m benchmarks.stats_backends [rounds]
+"""
+
+import sys
+import time
+from asyncio import gather, run
+from typing import Any, Awaitable, Callable, List
+
+from lib.cgroup import CgroupReader
+from lib.docker import engine, inventory
+from lib.env import CGROUP_ROOT, PROC_ROOT
+from lib.stats import parse_stats
+
+
+async def measure(name: str, rounds: int, func: Callable[[], Awaitable[Any]]):
+    timings: List[float] = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(
+        f"{name:<12} median {timings[len(timings) // 2] * 1000:10.3f} ms"
+        + f"   max {timings[-1] * 1000:10.3f} ms"
+    )
+
+
+async def main(rounds: int):
+    ids = [container.id or "" for container in await inventory.list(all=False)]
+    print(f"{len(ids)} running containers, {rounds} rounds")
+
+    reader = CgroupReader(CGROUP_ROOT, PROC_ROOT)
+    located = [id for id in ids if reader.locate(id)]
+    if located:
+        print(f"cgroup v{reader.version}: {len(located)} containers located")
+
+        async def read_cgroups():
+            for id in located:
+                reader.read(id)
+
+        await measure("cgroup", rounds, read_cgroups)
+    else:
+        print(f"cgroup: nothing readable under {CGROUP_ROOT!r}")
+
+    # Same containers on both sides when some were located
+    targets = located or ids
+
+    async def read_api():
+        for frame in await gather(
+            *(
+                engine.get(f"/containers/{id}/stats", {"stream": False})
+                for id in targets
+            )
+        ):
+            parse_stats(frame)
+
+    await measure("docker api", rounds, read_api)
+    await engine.close()
+
+
+if __name__ == "__main__":
+    run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
@@ -0,0 +1,322 @@
+import fnmatch
+import time
+from asyncio import (
+    AbstractEventLoop,
+    Queue,
+    QueueFull,
+    TimerHandle,
+    get_running_loop,
+)
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Literal, Set, Tuple
+
+from docker.models.containers import Container
+from pydantic import BaseModel
+
+from lib.db import DBAlertRule
+from lib.enums import AlertMetric
+from lib.events import DockerEvent, DockerEventWatcher
+from lib.inventory import ContainerInventory, container_labels, container_name
+from lib.stats import ContainerStats, ContainerStatsCollector
+
+
+class Alert(BaseModel):
+    rule: str
+    rule_name: str
+    container: str
+    container_name: str
+    state: Literal["firing", "resolved"]
+    value: float
+    threshold: float
+    # time.time() of when the value crossed the threshold, and of the resolution
+    since: float
+    resolved_at: float | None = None
+
+
+class AlertMessage(BaseModel):
+    # "snapshot" carries every alert, "alert" one that fired or resolved
+    type: Literal["snapshot", "alert"]
+    alert: Alert | None = None
+    alerts: List[Alert] | None = None
+
+
+class _RuleState:
+    __slots__ = ("above_since", "alert", "starts", "expiry")
+
+    def __init__(self):
+        # When the value went above the threshold, None while below
+        self.above_since: float | None = None
+        self.alert: Alert | None = None
+        # time.time() of the starts still within the rule duration
+        self.starts: Deque[float] = deque()
+        # Checks a firing restart alert once its oldest start leaves the window
+        self.expiry: TimerHandle | None = None
+
+
+def _value(metric: AlertMetric, stats: ContainerStats) -> float:
+    if metric == AlertMetric.CpuPercent:
+        return stats.cpu_percent
+    if metric == AlertMetric.MemoryUsage:
+        return float(stats.memory_usage)
+    if stats.memory_limit <= 0:
+        return 0.0
+    return stats.memory_usage / stats.memory_limit * 100.0
+
+
+class AlertEngine:
+    """
+    Evaluate alert rules on each container reading as the stats collector gets
+    it, and restart rules on each start event, with a small state per rule and
+    per container: a sample costs O(1) per rule in scope, nothing is polled.
+
+    A rule fires once its value stayed above the threshold for its duration,
+    restart rules once the container started more than the threshold times
+    within the duration, and resolves when that is no longer true: on a reading
+    below the threshold or the container stopping, and for restart rules on a
+    timer set for when the oldest start leaves the window. Firing and
+    resolved alerts are pushed to subscribers; a subscriber that falls `buffer`
+    alerts behind gets `None` instead and should reload the alert list.
+    """
+
+    def __init__(
+        self,
+        inventory: ContainerInventory,
+        containers: ContainerStatsCollector,
+        watcher: DockerEventWatcher,
+        history: int = 100,
+        buffer: int = 256,
+    ):
+        self.inventory = inventory
+        self.buffer = buffer
+
+        self._loop: AbstractEventLoop | None = None
+        self._rules: Dict[str, DBAlertRule] = {}
+        # (rule ID, container ID) -> state, and whether the container is in scope
+        self._states: Dict[Tuple[str, str], _RuleState] = {}
+        self._scopes: Dict[Tuple[str, str], bool] = {}
+        self._resolved: Deque[Alert] = deque(maxlen=history)
+        self._subscribers: Set[Queue[Alert | None]] = set()
+
+        containers.on_sample(self._evaluate)
+        watcher.on("container", self._apply)
+
+    def start(self, rules: List[DBAlertRule]):
+        self._loop = get_running_loop()
+        self.set_rules(rules)
+
+    def stop(self):
+        self._loop = None
+        for state in self._states.values():
+            if state.expiry is not None:
+                state.expiry.cancel()
+                state.expiry = None
+
+    def set_rules(self, rules: List[DBAlertRule]):
+        """Replace the rules, the state of the ones kept is kept too."""
+        self._rules = {rule.id: rule for rule in rules}
+        for key in [key for key in self._states if key[0] not in self._rules]:
+            state = self._states.pop(key)
+            if state.alert is not None:
+                self._resolve(state, time.time())
+        self._scopes = {}
+
+    def alerts(self) -> List[Alert]:
+        """Firing alerts, then the latest resolved ones, most recent first."""
+        self._expire_restarts(time.time())
+        firing = [
+            state.alert for state in self._states.values() if state.alert is not None
+        ]
+        return sorted(firing, key=lambda alert: -alert.since) + list(
+            reversed(self._resolved)
+        )
+
+    @asynccontextmanager
+    async def subscription(self) -> AsyncIterator["Queue[Alert | None]"]:
+        queue: Queue[Alert | None] = Queue(maxsize=self.buffer)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+
+        finally:
+            self._subscribers.discard(queue)
+
+    def _in_scope(self, rule: DBAlertRule, id: str) -> bool:
+        key = (rule.id, id)
+        scoped = self._scopes.get(key)
+        if scoped is None:
+            container = self.inventory.peek(id)
+            if container is None:
+                # Not known yet, decided on a later sample
+                return False
+            scoped = self._scopes[key] = self._matches(rule, id, container)
+        return scoped
+
+    @staticmethod
+    def _matches(rule: DBAlertRule, id: str, container: Container) -> bool:
+        if rule.container and not (
+            id.startswith(rule.container)
+            or fnmatch.fnmatchcase(container_name(container), rule.container)
+        ):
+            return False
+        if rule.label:
+            key, separator, value = rule.label.partition("=")
+            labels = container_labels(container)
+            if key not in labels or (separator and labels[key] != value):
+                return False
+        return True
+
+    def _evaluate(self, id: str, stats: ContainerStats):
+        now = time.time()
+        for rule in self._rules.values():
+            if rule.metric == AlertMetric.Restarts.value or not self._in_scope(
+                rule, id
+            ):
+                continue
+
+            value = _value(AlertMetric(rule.metric), stats)
+            state = self._states.get((rule.id, id))
+            if value <= rule.threshold:
+                if state is not None:
+                    state.above_since = None
+                    if state.alert is not None:
+                        self._resolve(state, now)
+                continue
+
+            if state is None:
+                state = self._states[(rule.id, id)] = _RuleState()
+            if state.above_since is None:
+                state.above_since = now
+            if state.alert is None:
+                if now - state.above_since >= rule.duration:
+                    self._fire(rule, id, state, value, state.above_since)
+            else:
+                state.alert.value = round(value, 4)
+
+    def _apply(self, event: DockerEvent):
+        # Called from the watcher thread
+        loop = self._loop
+        action: str = event.get("Action", "")
+        id: str = event.get("Actor", {}).get("ID", "") or event.get("id", "")
+        if loop is None or not id:
+            return
+
+        if action == "start":
+            loop.call_soon_threadsafe(self._started, id, time.time())
+        elif action == "die":
+            loop.call_soon_threadsafe(self._stopped, id)
+        elif action == "destroy":
+            loop.call_soon_threadsafe(self._forget, id)
+        elif action == "rename":
+            loop.call_soon_threadsafe(self._rescope, id)
+
+    def _started(self, id: str, at: float):
+        for rule in self._rules.values():
+            if rule.metric != AlertMetric.Restarts.value or not self._in_scope(
+                rule, id
+            ):
+                continue
+
+            state = self._states.get((rule.id, id))
+            if state is None:
+                state = self._states[(rule.id, id)] = _RuleState()
+            state.starts.append(at)
+            while state.starts and state.starts[0] < at - rule.duration:
+                state.starts.popleft()
+
+            if len(state.starts) > rule.threshold:
+                if state.alert is None:
+                    self._fire(rule, id, state, len(state.starts), state.starts[0])
+                    self._schedule_expiry(rule, state)
+                else:
+                    state.alert.value = len(state.starts)
+
+    def _stopped(self, id: str):
+        # No more readings: usage alerts would stay as they are until a start
+        now = time.time()
+        for (rule_id, state_id), state in self._states.items():
+            rule = self._rules.get(rule_id)
+            if (
+                state_id != id
+                or rule is None
+                or rule.metric == AlertMetric.Restarts.value
+            ):
+                continue
+            state.above_since = None
+            if state.alert is not None:
+                self._resolve(state, now)
+
+    def _schedule_expiry(self, rule: DBAlertRule, state: _RuleState):
+        loop = self._loop
+        if loop is None or not state.starts:
+            return
+        if state.expiry is not None:
+            state.expiry.cancel()
+        state.expiry = loop.call_later(
+            max(state.starts[0] + rule.duration - time.time(), 0),
+            self._expire_restarts,
+        )
+
+    def _expire_restarts(self, now: float | None = None):
+        # Restart alerts resolve with time alone
+        now = now if now is not None else time.time()
+        for (rule_id, _), state in self._states.items():
+            rule = self._rules.get(rule_id)
+            if state.alert is None or rule is None or not state.starts:
+                continue
+            while state.starts and state.starts[0] < now - rule.duration:
+                state.starts.popleft()
+            if len(state.starts) <= rule.threshold:
+                self._resolve(state, now)
+            else:
+                self._schedule_expiry(rule, state)
+
+    def _forget(self, id: str):
+        now = time.time()
+        for key in [key for key in self._states if key[1] == id]:
+            state = self._states.pop(key)
+            if state.alert is not None:
+                self._resolve(state, now)
+        self._rescope(id)
+
+    def _rescope(self, id: str):
+        for key in [key for key in self._scopes if key[1] == id]:
+            del self._scopes[key]
+
+    def _fire(
+        self, rule: DBAlertRule, id: str, state: _RuleState, value: float, since: float
+    ):
+        container = self.inventory.peek(id)
+        state.alert = Alert(
+            rule=rule.id,
+            rule_name=rule.name,
+            container=id,
+            container_name=container_name(container) if container else "",
+            state="firing",
+            value=round(value, 4),
+            threshold=rule.threshold,
+            since=since,
+        )
+        self._broadcast(state.alert)
+
+    def _resolve(self, state: _RuleState, now: float):
+        assert state.alert is not None
+        alert = state.alert.model_copy(update={"state": "resolved", "resolved_at": now})
+        state.alert = None
+        state.above_since = None
+        if state.expiry is not None:
+            state.expiry.cancel()
+            state.expiry = None
+        self._resolved.append(alert)
+        self._broadcast(alert)
+
+    def _broadcast(self, alert: Alert):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(alert)
+
+            except QueueFull:
+                # Too far behind, the subscriber should reload the alert list
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
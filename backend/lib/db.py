@@ -3,12 +3,13 @@ from typing import List, Set
 from uuid import uuid4
 
 from argon2.exceptions import VerifyMismatchError
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from sqlmodel import JSON, Column, Field, Session, SQLModel, create_engine, select
 
-from lib.enums import Permission, default_permission
+from lib.enums import AlertMetric, Permission, default_permission
 from lib.env import DB_URL
 from lib.errors import (
+    AlertRuleNotFound,
     InvalidPassword,
     InvalidRoleHex,
     InvalidRoleName,
@@ -64,6 +65,41 @@ class APIRole(BaseModel):
     hex: str
 
 
+class APIAlertRule(BaseModel):
+    name: str
+    metric: AlertMetric
+    threshold: float = Field(ge=0)
+    # Seconds the value must stay above `threshold` (restarts: counting window)
+    duration: float = Field(default=0, ge=0)
+    # Scope, all containers when both are unset
+    container: str | None = None
+    # "key" or "key=value"
+    label: str | None = None
+
+    @field_validator("container", "label")
+    @classmethod
+    def _pattern(cls, value: str | None) -> str | None:
+        if value is None:
+            return None
+        value = value.strip()
+        if not value:
+            raise ValueError("must not be empty")
+        if value.startswith("="):
+            raise ValueError("label key must not be empty")
+        return value
+
+
+class DBAlertRule(SQLModel, table=True):
+    __tablename__ = "alert_rule"  # type: ignore
+    id: str = Field(default_factory=lambda: uuid4().__str__(), primary_key=True)
+    name: str
+    metric: str
+    threshold: float
+    duration: float = 0
+    container: str | None = None
+    label: str | None = None
+
+
 engine = create_engine(DB_URL)
 SQLModel.metadata.create_all(engine)
 
@@ -471,3 +507,32 @@ def update_roles(user: User, roles: List[DBRole]):
         session.commit()
 
         return get_user_db(id=user.id, session=session)
+
+
+"""
+ALERT RULES
+"""
+
+
+def get_alert_rules() -> List[DBAlertRule]:
+    with Session(engine) as session:
+        return list(session.exec(select(DBAlertRule)).all())
+
+
+def new_alert_rule(rule: APIAlertRule) -> DBAlertRule:
+    with Session(engine) as session:
+        db_rule = DBAlertRule(**{**rule.model_dump(), "metric": rule.metric.value})
+        session.add(db_rule)
+        session.commit()
+        session.refresh(db_rule)
+        return db_rule
+
+
+def delete_alert_rule(id: str):
+    with Session(engine) as session:
+        rule = session.get(DBAlertRule, id)
+        if not rule:
+            raise AlertRuleNotFound()
+
+        session.delete(rule)
+        session.commit()
@@ -4,6 +4,7 @@ from fastapi import HTTPException, Query, status
 
 from lib.db import DBRole, get_role, get_user
 from lib.errors import MissingError, RoleNotFound, UserNotFound
+from lib.query import ListQuery
 
 
 def get_user_deps(require: bool = False):
@@ -87,3 +88,15 @@ def get_role_deps(require: bool = False):
                 return None
 
     return wrapper
+
+
+def list_query_deps(
+    sort: Annotated[str | None, Query()] = None,
+    cursor: Annotated[str | None, Query()] = None,
+    limit: Annotated[int | None, Query(ge=1)] = None,
+    name: Annotated[str | None, Query()] = None,
+    label: Annotated[List[str] | None, Query()] = None,
+):
+    return ListQuery(
+        sort=sort, cursor=cursor, limit=limit, name=name, label=label or []
+    )
@@ -1,23 +1,77 @@
+import heapq
+import json
 import os
+import shlex
 import shutil
 import tarfile
-from asyncio import Task, create_task, gather, to_thread
+import time
+from asyncio import (
+    Queue as AsyncQueue,
+    Semaphore,
+    Task,
+    as_completed,
+    create_task,
+    gather,
+    to_thread,
+)
+from datetime import datetime, timezone
 from queue import Empty, Queue
 from socket import socket as _socket
-from threading import Event, Thread
-from typing import Any, Dict, Generator, List, Literal, Tuple, cast
+from threading import Event
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Tuple,
+    cast,
+)
 from uuid import uuid4
 
 import docker
-import psutil
+import numpy as np
 from docker.constants import STREAM_HEADER_SIZE_BYTES
-from docker.errors import ImageNotFound, NotFound
+from docker.errors import APIError, NotFound
 from docker.models.containers import Container
 from docker.models.images import Image
 from docker.models.networks import Network
 from docker.models.volumes import Volume
+from docker.utils import parse_repository_tag
 from pydantic import BaseModel
 
+from lib import prometheus
+from lib.alerts import Alert, AlertEngine, AlertMessage
+from lib.cgroup import CgroupReader
+from lib.db import (
+    APIAlertRule,
+    DBAlertRule,
+    delete_alert_rule,
+    get_alert_rules,
+    new_alert_rule,
+)
+from lib.engine import NO_TIMEOUT, AsyncDockerClient
+from lib.enums import ContainerAction, Operation
+from lib.env import (
+    CGROUP_ROOT,
+    DOCKER_FAST_READ_LIMIT,
+    DOCKER_HELPER_LIMIT,
+    DOCKER_SLOW_MUTATION_LIMIT,
+    DOCKER_SLOW_READ_LIMIT,
+    DOCKER_THREADS,
+    HOST_SAMPLE_INTERVAL,
+    INVENTORY_MAX_AGE,
+    LOG_HISTORY,
+    METRICS_DIR,
+    METRICS_RESOLUTION,
+    METRICS_RETENTION,
+    METRICS_TIERS,
+    PROC_ROOT,
+    SINGLE_FLIGHT_TTL,
+)
 from lib.errors import (
     CommandNotFound,
     ContainerNotFound,
@@ -27,9 +81,90 @@ from lib.errors import (
     TerminalNotFound,
     VolumeNotFound,
 )
+from lib.events import DockerEvent, DockerEventWatcher
+from lib.feed import ChangeFeed, Delta, FeedResource
+from lib.inventory import (
+    IGNORED_ACTIONS,
+    ContainerInventory,
+    ImageTagIndex,
+    container_name,
+)
+from lib.loghub import LogHub
+from lib.metrics import HOST, MetricsHistory, MetricsStore
+from lib.query import ListQuery, Page, SortKeys, paginate
+from lib.sampler import HostSampler
+from lib.scheduler import DockerScheduler
+from lib.singleflight import SingleFlight
+from lib.stats import ContainerStats, ContainerStatsCollector, parse_stats
 from lib.utils import expect_type
 
 client = docker.from_env()
+scheduler = DockerScheduler(
+    limits={
+        Operation.FastRead: DOCKER_FAST_READ_LIMIT,
+        Operation.SlowRead: DOCKER_SLOW_READ_LIMIT,
+        Operation.SlowMutation: DOCKER_SLOW_MUTATION_LIMIT,
+        Operation.Helper: DOCKER_HELPER_LIMIT,
+    },
+    threads=DOCKER_THREADS,
+)
+# Request-path calls go through the asyncio client, docker-py is kept for what
+# it does better: the events thread, exec sockets and image pulls
+engine = AsyncDockerClient(
+    version=cast(str, client.api._version),  # type: ignore
+    scheduler=scheduler,
+    # For the hosts aiohttp cannot reach (ssh, ...)
+    api=client.api,
+)
+watcher = DockerEventWatcher(client)
+flights = SingleFlight(ttls=SINGLE_FLIGHT_TTL)
+inventory = ContainerInventory(
+    client, engine, watcher, flights, max_age=INVENTORY_MAX_AGE
+)
+image_tags = ImageTagIndex(engine, watcher, flights, max_age=INVENTORY_MAX_AGE)
+host = HostSampler(interval=HOST_SAMPLE_INTERVAL)
+container_stats = ContainerStatsCollector(
+    engine,
+    inventory,
+    watcher,
+    cgroups=CgroupReader(CGROUP_ROOT, PROC_ROOT) if CGROUP_ROOT else None,
+    interval=METRICS_RESOLUTION,
+)
+metrics = MetricsStore(
+    host,
+    container_stats,
+    resolution=METRICS_RESOLUTION,
+    retention=METRICS_RETENTION,
+    tiers=METRICS_TIERS,
+    directory=METRICS_DIR or None,
+)
+# Longest history kept, coarser steps would only read more of it per point
+METRICS_SPAN = metrics.span
+logs = LogHub(engine, history=LOG_HISTORY)
+
+
+def _forget_on(type: str, operation: str):
+    """Drop the results kept for `operation` on every event of `type`."""
+    watcher.on(type, lambda _: flights.forget_threadsafe(operation))
+
+
+_forget_on("container", "containers")
+_forget_on("image", "images")
+_forget_on("volume", "volumes")
+_forget_on("network", "networks")
+
+
+def _forget_metrics(event: DockerEvent):
+    if event.get("Action") == "destroy":
+        metrics.forget_threadsafe(
+            event.get("Actor", {}).get("ID", "") or event.get("id", "")
+        )
+
+
+watcher.on("container", _forget_metrics)
+
+# Versions below restart from zero with the process, this keeps them apart
+_BOOT_ID = uuid4().hex[:8]
 
 
 class DirEntry(BaseModel):
@@ -67,102 +202,249 @@ class ContainerPruneResponse(PruneResponse):
     ContainersDeleted: list[str] | None
 
 
-def _format_container(container: Container) -> FormattedContainer:
+class BulkContainerAction(BaseModel):
+    # ID, Short ID or Name of each container
+    ids: List[str]
+    action: ContainerAction
+
+
+class BulkActionResult(BaseModel):
+    id: str
+    ok: bool
+    message: str | None = None
+
+
+def _format_container(
+    container: Container, image_tags: Dict[str, List[str]]
+) -> FormattedContainer:
+    """
+    Format a container from its list summary, so no per-container inspect is
+    needed. `container.image` would also fetch the image from the daemon for
+    every container, the tags come from the shared image index instead.
+    """
+    tags = image_tags.get(container.attrs.get("ImageID") or "", [])
     return FormattedContainer(
         id=container.id or container.short_id,
         short_id=container.short_id,
-        name=container.name,
-        image=container.image.tags[0]
-        if container.image and len(container.image.tags)
-        else "None",
-        created=container.attrs["Created"],
+        name=container_name(container),
+        image=tags[0] if len(tags) else "None",
+        created=datetime.fromtimestamp(container.attrs["Created"], timezone.utc)
+        .isoformat()
+        .replace("+00:00", "Z"),
         status=container.status,
-        ports=_format_port_mapping(container.attrs["NetworkSettings"]["Ports"]),
+        ports=_format_port_mapping(container.attrs.get("Ports") or []),
     )
 
 
 def _format_port_mapping(
-    port_mapping: Dict[
-        str, List[Dict[Literal["HostIp"] | Literal["HostPort"], str]] | None
+    port_mapping: List[
+        Dict[
+            Literal["IP"]
+            | Literal["PrivatePort"]
+            | Literal["PublicPort"]
+            | Literal["Type"],
+            str | int,
+        ]
     ],
 ) -> List[str]:
     maps: List[str] = []
 
-    for private_port, configs in port_mapping.items():
-        if configs is None:
+    for config in port_mapping:
+        if "PublicPort" not in config:
             continue
 
-        for config in configs:
-            ip = config["HostIp"] if config["HostIp"] != "::" else "[::]"
-            port = config["HostPort"]
-            maps.append(f"{ip}:{port}->{private_port}")
+        ip = config.get("IP", "0.0.0.0")
+        ip = ip if ip != "::" else "[::]"
+        maps.append(
+            f"{ip}:{config['PublicPort']}->{config['PrivatePort']}/{config['Type']}"
+        )
 
     return maps
 
 
-async def get_containers_raw(all: bool = True):
-    return sorted(
-        cast(
-            List[Container],
-            await to_thread(client.containers.list, all),  # type: ignore
-        ),
-        key=lambda container: container.id or container.short_id,
+CONTAINER_SORT_KEYS: SortKeys[Container] = {
+    "id": lambda container: container.id or container.short_id,
+    "name": container_name,
+    "created": lambda container: container.attrs.get("Created") or 0,
+    "status": lambda container: container.status,
+    "image": lambda container: container.attrs.get("Image") or "",
+}
+
+
+def _container_matches(
+    container: Container, query: ListQuery, image_tags: Dict[str, List[str]]
+) -> bool:
+    if query.name and not container_name(container).startswith(query.name):
+        return False
+    if query.status and container.status not in query.status:
+        return False
+    if query.image:
+        image_id: str = container.attrs.get("ImageID") or ""
+        if (
+            query.image != container.attrs.get("Image")
+            and query.image not in image_tags.get(image_id, [])
+            and not image_id.removeprefix("sha256:").startswith(
+                query.image.removeprefix("sha256:")
+            )
+        ):
+            return False
+    return True
+
+
+async def _list_containers(
+    all: bool, refresh: bool, query: ListQuery
+) -> Page[Container]:
+    # Containers are served from the inventory, labels go through its index
+    tags = await image_tags.get() if query.image else {}
+    containers = [
+        container
+        for container in await inventory.list(all, refresh=refresh, labels=query.label)
+        if _container_matches(container, query, tags)
+    ]
+    return paginate(
+        containers,
+        query,
+        CONTAINER_SORT_KEYS,
+        "id",
+        lambda container: container.id or container.short_id,
     )
 
 
-async def get_containers(all: bool = True):
-    return [_format_container(container) for container in await get_containers_raw(all)]
+async def get_containers_raw(
+    all: bool = True, refresh: bool = False, query: ListQuery = ListQuery()
+) -> Page[Dict[str, Any]]:
+    page = await _list_containers(all, refresh, query)
+    return Page[Dict[str, Any]](
+        items=await inventory.inspect_all(page.items),
+        total=page.total,
+        next_cursor=page.next_cursor,
+    )
 
 
-async def _get_container(id: str):
+async def get_containers(
+    all: bool = True, refresh: bool = False, query: ListQuery = ListQuery()
+) -> Page[FormattedContainer]:
+    page = await _list_containers(all, refresh, query)
+    tags = await image_tags.get()
+    return Page[FormattedContainer](
+        items=[_format_container(container, tags) for container in page.items],
+        total=page.total,
+        next_cursor=page.next_cursor,
+    )
+
+
+async def containers_version(refresh: bool = False) -> str:
+    """
+    Version of everything the container list endpoints are built from, bumped
+    by every container and image event.
+    """
+    await inventory.ensure_fresh(refresh)
+    await image_tags.get()
+    return f"{_BOOT_ID}-{inventory.version}-{image_tags.version}"
+
+
+async def container_version(id: str, refresh: bool = False) -> str:
+    container = await _get_container(id, refresh=refresh)
+    version = inventory.container_version(container.id or container.short_id)
+    return f"{_BOOT_ID}-{container.id}-{version}"
+
+
+async def _get_container(id: str, refresh: bool = False):
     try:
-        return await to_thread(client.containers.get, id)  # type: ignore
+        return await inventory.get(id, refresh=refresh)
 
     except NotFound:
         raise ContainerNotFound()
 
 
-async def get_container(id: str):
-    return _format_container(await _get_container(id))
+async def get_container(id: str, refresh: bool = False):
+    container = await _get_container(id, refresh=refresh)
+    return _format_container(container, await image_tags.get())
 
 
-async def get_container_raw(id: str):
-    return (await _get_container(id)).attrs
+async def get_container_raw(id: str, refresh: bool = False):
+    try:
+        return await inventory.inspect(id, refresh=refresh)
+
+    except NotFound:
+        raise ContainerNotFound()
 
 
 async def rename_container(id: str, new_name: str):
     container = await _get_container(id)
-    await to_thread(container.rename, new_name)  # type: ignore
+    await engine.post(f"/containers/{container.id}/rename", {"name": new_name})
 
 
 async def start_container(id: str):
     container = await _get_container(id)
-    await to_thread(container.start)
+    await engine.post(f"/containers/{container.id}/start")
 
 
 async def restart_container(id: str):
     container = await _get_container(id)
-    await to_thread(container.restart)  # type: ignore
+    await engine.post(f"/containers/{container.id}/restart", timeout=NO_TIMEOUT)
 
 
 async def kill_container(id: str):
     container = await _get_container(id)
-    await to_thread(container.kill)  # type: ignore
+    await engine.post(f"/containers/{container.id}/kill")
 
 
 async def stop_container(id: str):
     container = await _get_container(id)
-    await to_thread(container.stop)
+    await engine.post(f"/containers/{container.id}/stop", timeout=NO_TIMEOUT)
 
 
 async def remove_container(id: str):
     container = await _get_container(id)
-    await to_thread(container.remove)
+    await engine.delete(f"/containers/{container.id}")
 
 
-async def inspect_container(id: str) -> dict[str, Any]:
-    container = await _get_container(id)
-    return container.attrs
+CONTAINER_ACTIONS: Dict[ContainerAction, Callable[[str], Awaitable[None]]] = {
+    ContainerAction.Start: start_container,
+    ContainerAction.Stop: stop_container,
+    ContainerAction.Restart: restart_container,
+    ContainerAction.Kill: kill_container,
+    ContainerAction.Remove: remove_container,
+}
+
+
+async def bulk_container_action(
+    ids: List[str], action: ContainerAction, parallelism: int
+) -> AsyncIterator[BulkActionResult]:
+    """
+    Run `action` on every container of `ids`, at most `parallelism` at once.
+    Results are yielded as soon as they are known, not in the order of `ids`.
+    A failure only fails its own container.
+    """
+    semaphore = Semaphore(parallelism)
+    run = CONTAINER_ACTIONS[action]
+
+    async def apply(id: str) -> BulkActionResult:
+        async with semaphore:
+            try:
+                await run(id)
+
+            except ContainerNotFound:
+                return BulkActionResult(id=id, ok=False, message="container not found")
+
+            except APIError as api_error:
+                return BulkActionResult(
+                    id=id, ok=False, message=api_error.explanation or str(api_error)
+                )
+
+            except Exception as e:
+                # e.g. the daemon went away: the other containers still get theirs
+                return BulkActionResult(id=id, ok=False, message=str(e) or repr(e))
+
+        return BulkActionResult(id=id, ok=True)
+
+    for result in as_completed([apply(id) for id in dict.fromkeys(ids)]):
+        yield await result
+
+
+async def inspect_container(id: str, refresh: bool = False) -> dict[str, Any]:
+    return await get_container_raw(id, refresh=refresh)
 
 
 async def top_container(id: str) -> List[Dict[str, str]] | None:
@@ -172,7 +454,8 @@ async def top_container(id: str) -> List[Dict[str, str]] | None:
         return
 
     raw_top = cast(
-        Dict[Literal["Processes"] | Literal["Titles"], List[Any]], container.top()
+        Dict[Literal["Processes"] | Literal["Titles"], List[Any]],
+        await engine.get(f"/containers/{container.id}/top"),
     )
     output: List[Dict[str, str]] = []
     for processInfos in raw_top["Processes"]:
@@ -185,46 +468,33 @@ async def top_container(id: str) -> List[Dict[str, str]] | None:
 
 
 async def prune_container(filter: dict[str, Any] = {}) -> ContainerPruneResponse:
-    return ContainerPruneResponse(**(await to_thread(client.containers.prune, filter)))  # type: ignore
-
-
-def _stream_logs(log_queue: Queue[str], log_stream: Generator[bytes]):
-    try:
-        for log_line in log_stream:
-            log_queue.put(log_line.decode("utf-8"))
-
-    except Exception as e:
-        log_queue.put(f"Error streaming logs: {str(e)}")
-
-    finally:
-        log_queue.put("SimpleDockerDashboard_EOL")
+    return ContainerPruneResponse(
+        **(await engine.post("/containers/prune", {"filters": filter or None}))
+    )
 
 
 async def docker_logs_stream(
     id: str, tail: int | None
-) -> Tuple[Queue[str], Generator[bytes]]:
+) -> AsyncContextManager["AsyncQueue[str | None]"]:
+    """
+    Subscription to the logs of a container (ID, Short ID or Name), shared
+    with its other viewers: an asyncio queue of lines, starting with the last
+    `tail` ones (without, all of them or all those kept if another viewer
+    opened the stream already), None at the end.
+    """
     try:
-        log_queue: Queue[str] = Queue()
-
         container = await _get_container(id)
-        log_stream = cast(
-            Generator[bytes],
-            container.logs(
-                stream=True, follow=True, stdout=True, stderr=True, tail=tail or "all"
-            ),
+        tty = bool(
+            (await inventory.inspect(cast(str, container.id)))
+            .get("Config", {})
+            .get("Tty")
         )
 
-        thread = Thread(
-            target=lambda: _stream_logs(log_queue=log_queue, log_stream=log_stream),
-            daemon=True,
-        )
-        thread.start()
-
-        return (log_queue, log_stream)
-
     except NotFound:
         raise ContainerNotFound()
 
+    return logs.subscription(cast(str, container.id), tty, tail)
+
 
 class ExecResponse(BaseModel):
     command: str
@@ -239,14 +509,19 @@ async def get_docker_exec(
     try:
         container = await _get_container(id)
 
-        exit_code, _ = cast(
-            tuple[int, bytes],
-            container.exec_run(cmd='/bin/sh -c "echo Hello"'),  # type: ignore
+        exit_code, _ = await _exec_run(
+            cast(str, container.id), '/bin/sh -c "echo Hello"'
         )
         if exit_code != 0:
             raise TerminalNotFound()
 
-        _, raw_socket = container.exec_run(cmd="/bin/sh", stdin=True, socket=True)  # type: ignore
+        _, raw_socket = await scheduler.run(
+            Operation.SlowRead,
+            container.exec_run,  # type: ignore
+            cmd="/bin/sh",
+            stdin=True,
+            socket=True,
+        )
         socket = expect_type(raw_socket._sock, _socket)  # type: ignore
 
         event = Event()
@@ -307,16 +582,44 @@ def _send_command(sock: _socket, command: bytes) -> bytes:
     return data
 
 
+async def _exec_run(id: str, cmd: str) -> Tuple[int, bytes]:
+    """
+    `container.exec_run` over the asyncio client: run `cmd` to completion and
+    return its exit code and output.
+    """
+    async with scheduler.slot(Operation.SlowRead):
+        return await _exec_run_unscheduled(id, cmd)
+
+
+async def _exec_run_unscheduled(id: str, cmd: str) -> Tuple[int, bytes]:
+    exec_id = cast(
+        str,
+        (
+            await engine.post(
+                f"/containers/{id}/exec",
+                body={
+                    "Cmd": shlex.split(cmd),
+                    "AttachStdout": True,
+                    "AttachStderr": True,
+                },
+            )
+        )["Id"],
+    )
+    output = b"".join(
+        [
+            frame
+            async for frame in engine.stream_frames(
+                "POST", f"/exec/{exec_id}/start", body={"Detach": False, "Tty": False}
+            )
+        ]
+    )
+    exit_code = cast(int, (await engine.get(f"/exec/{exec_id}/json"))["ExitCode"])
+    return exit_code, output
+
+
 async def container_ls(id: str, path: str = "/") -> list[DirEntry]:
     container = await _get_container(id)
-    exit_code, ls = cast(
-        tuple[int, bytes],
-        await to_thread(
-            container.exec_run,  # type: ignore
-            cmd=f"ls -F -1 {path}",
-            stdout=True,
-        ),
-    )
+    exit_code, ls = await _exec_run(cast(str, container.id), f"ls -F -1 {path}")
     if exit_code != 0:
         raise CommandNotFound()
     entries = ls.decode().splitlines()
@@ -345,14 +648,7 @@ async def container_ls(id: str, path: str = "/") -> list[DirEntry]:
 
 async def container_cat(id: str, path: str) -> str:
     container = await _get_container(id)
-    exit_code, cat = cast(
-        tuple[int, bytes],
-        await to_thread(
-            container.exec_run,  # type: ignore
-            cmd=f"cat {path}",
-            stdout=True,
-        ),
-    )
+    exit_code, cat = await _exec_run(cast(str, container.id), f"cat {path}")
     if exit_code != 0:
         raise CommandNotFound()
     content = cat.decode()
@@ -368,13 +664,15 @@ async def container_download(id: str, path: str) -> bytes:
     target = dir_frag[-1]
     entry = [entry for entry in await container_ls(id, dir) if entry.name == target][0]
 
-    stream, _ = cast(
-        tuple[Generator[bytes], dict[str, Any]],
-        client.api.get_archive(container.id or container.short_id, path),  # type: ignore
-    )
-    data = b""
-    for piece in stream:
-        data += piece
+    async with scheduler.slot(Operation.SlowRead):
+        data = b"".join(
+            [
+                piece
+                async for piece in engine.stream(
+                    "GET", f"/containers/{container.id}/archive", {"path": path}
+                )
+            ]
+        )
 
     base_path = os.path.join(".", "temp")
     archive_id = uuid4().__str__()
@@ -459,25 +757,69 @@ async def _format_image(image: Image) -> FormattedImage:
     )
 
 
-async def get_images():
-    return sorted(
-        [await _format_image(image) for image in await to_thread(client.images.list)],
-        key=lambda image: image.id,
+IMAGE_SORT_KEYS: SortKeys[Image] = {
+    "id": lambda image: image.id or image.short_id,
+    "tag": lambda image: image.tags[0] if len(image.tags) else "",
+    "created": lambda image: image.attrs.get("Created") or 0,
+    "size": lambda image: image.attrs.get("Size") or 0,
+}
+
+
+def images_version() -> str | None:
+    """
+    Version of the image list, bumped by every image event. None while the
+    events stream is down, as changes could then go unnoticed.
+    """
+    if not watcher.connected:
+        return None
+    return f"{_BOOT_ID}-{image_tags.version}"
+
+
+def _filters_key(filters: Dict[str, Any]) -> str:
+    return json.dumps(filters, sort_keys=True)
+
+
+async def get_images(query: ListQuery = ListQuery()) -> Page[FormattedImage]:
+    # `client.images.list` inspects every image again, the summaries are enough
+    filters = query.docker_filters()
+    summaries = cast(
+        List[Dict[str, Any]],
+        await flights.do(
+            "images",
+            _filters_key(filters),
+            lambda: engine.get("/images/json", {"filters": filters or None}),
+        ),
+    )
+    images = [
+        image
+        for image in map(client.images.prepare_model, summaries)
+        if not query.name or any(tag.startswith(query.name) for tag in image.tags)
+    ]
+    page = paginate(
+        images, query, IMAGE_SORT_KEYS, "id", lambda image: image.id or image.short_id
+    )
+    return Page[FormattedImage](
+        items=[await _format_image(image) for image in page.items],
+        total=page.total,
+        next_cursor=page.next_cursor,
     )
 
 
 async def get_image(id: str):
     try:
-        return await _format_image(await to_thread(client.images.get, id))
+        return await _format_image(
+            client.images.prepare_model(await engine.get(f"/images/{id}/json"))
+        )
 
-    except ImageNotFound:
+    # Any 404 here is about the image, whatever the daemon's wording
+    except NotFound:
         raise _ImageNotFound()
 
 
 async def remove_image(id: str):
     try:
-        await to_thread(client.images.remove, id)  # type: ignore
-    except ImageNotFound:
+        await engine.delete(f"/images/{id}")
+    except NotFound:
         raise _ImageNotFound()
 
 
@@ -485,7 +827,11 @@ async def prune_images(
     dangling: bool = True, filter: dict[str, Any] = {}
 ) -> ImagePruneResponse:
     return ImagePruneResponse(
-        **(await to_thread(client.images.prune, {"dangling": dangling, **filter}))  # type: ignore
+        **(
+            await engine.post(
+                "/images/prune", {"filters": {"dangling": dangling, **filter}}
+            )
+        )
     )
 
 
@@ -510,66 +856,54 @@ class ResourceUsage(BaseModel):
     memory: float
 
 
+ConsumerMetric = Literal["cpu", "memory", "network", "block"]
+# Recorded fields summed into each metric
+CONSUMER_FIELDS: Dict[ConsumerMetric, Tuple[str, ...]] = {
+    "cpu": ("cpu_percent",),
+    "memory": ("memory_usage",),
+    "network": ("network_rx", "network_tx"),
+    "block": ("block_read", "block_write"),
+}
+
+
+class ResourceConsumer(BaseModel):
+    id: str
+    name: str
+    # CPU percent or memory bytes, network or block IO bytes per second
+    # (bytes since start without a window)
+    value: float
+
+
 async def _measure_container_resources(container: Container) -> Tuple[float, float]:
     """
-    Measure resource usage for a single container.
+    Measure resource usage for a single container, from its stats collector or,
+    until that has a first reading, with a one-shot stats request.
 
     Returns:
         Tuple of (memory_usage_gb, cpu_usage_percent)
     """
-    try:
-        stats = cast(Dict[str, Any], await to_thread(container.stats, stream=False))  # type: ignore
-
-        memory_usage_gb = 0.0
-        cpu_usage_percent = 0.0
-
-        if (
-            "memory_stats" in stats
-            and isinstance(stats["memory_stats"], dict)
-            and "usage" in stats["memory_stats"]
-        ):
-            memory_usage_gb = float(stats["memory_stats"]["usage"]) / (1024**3)  # type: ignore
-
-        if (
-            "cpu_stats" in stats
-            and "precpu_stats" in stats
-            and isinstance(stats["cpu_stats"], dict)
-            and isinstance(stats["precpu_stats"], dict)
-        ):
-            cpu_stats = stats["cpu_stats"]  # type: ignore
-            precpu_stats = stats["precpu_stats"]  # type: ignore
-
-            if (
-                isinstance(cpu_stats.get("cpu_usage"), dict)  # type: ignore
-                and isinstance(precpu_stats.get("cpu_usage"), dict)  # type: ignore
-                and "total_usage" in cpu_stats["cpu_usage"]
-                and "total_usage" in precpu_stats["cpu_usage"]
-                and "system_cpu_usage" in cpu_stats
-                and "system_cpu_usage" in precpu_stats
-            ):
-                cpu_delta = float(cpu_stats["cpu_usage"]["total_usage"]) - float(  # type: ignore
-                    precpu_stats["cpu_usage"]["total_usage"]  # type: ignore
-                )
-                system_delta = float(cpu_stats["system_cpu_usage"]) - float(  # type: ignore
-                    precpu_stats["system_cpu_usage"]  # type: ignore
-                )
-                online_cpus = float(
-                    cpu_stats.get("online_cpus", psutil.cpu_count() or 1)  # type: ignore
+    stats = container_stats.get(container.id or "")
+    if stats is None:
+        try:
+            stats = parse_stats(
+                await engine.get(
+                    f"/containers/{container.id}/stats",
+                    {"stream": False},
+                    operation=Operation.SlowRead,
                 )
+            )
 
-                if system_delta > 0 and cpu_delta >= 0:
-                    cpu_usage_percent = (cpu_delta / system_delta) * online_cpus * 100.0
-
-        return memory_usage_gb, cpu_usage_percent
+        except Exception:
+            # Return 0 values if container stats can't be retrieved
+            return 0.0, 0.0
 
-    except Exception:
-        # Return 0 values if container stats can't be retrieved
-        return 0.0, 0.0
+    return stats.memory_usage / (1024**3), stats.cpu_percent
 
 
 async def get_resource_usages() -> ResourceUsages:
     """
-    Calculate Docker and System resource usage.
+    Calculate Docker and System resource usage. Concurrent callers share one
+    measurement.
 
     Returns:
         ResourceUsage model containing memory and cpu usage information:
@@ -586,35 +920,21 @@ async def get_resource_usages() -> ResourceUsages:
             }
         }
     """
-    memory = psutil.virtual_memory()
-    total_memory_gb = memory.total / (1024**3)
-    system_memory_used_gb = memory.used / (1024**3)
+    return await flights.do("resources", None, _get_resource_usages)
 
-    # Get system CPU info
-    cpu_count = psutil.cpu_count() or 1
-    system_cpu_percent = psutil.cpu_percent(interval=1)
 
-    try:
-        containers = cast(List[Container], await to_thread(client.containers.list))  # type: ignore
-
-        measurement_tasks = [
-            _measure_container_resources(container) for container in containers
-        ]
-
-        measurement_results = await gather(*measurement_tasks, return_exceptions=True)
-
-        docker_memory_usage = 0.0
-        docker_cpu_usage = 0.0
+async def _get_resource_usages() -> ResourceUsages:
+    # Host usage comes from the background sampler, it never blocks the loop
+    sample = host.latest()
+    total_memory_gb = sample.memory_total / (1024**3)
+    system_memory_used_gb = sample.memory_used / (1024**3)
+    cpu_count = sample.cpu_count
+    system_cpu_percent = sample.cpu_percent
 
-        for result in measurement_results:
-            if isinstance(result, tuple) and len(result) == 2:
-                memory_gb, cpu_percent = result
-                docker_memory_usage += memory_gb
-                docker_cpu_usage += cpu_percent
-
-    except Exception:
-        docker_memory_usage = 0.0
-        docker_cpu_usage = 0.0
+    # Containers usage comes from their stats collectors, no daemon call
+    readings = container_stats.all().values()
+    docker_memory_usage = sum(stats.memory_usage for stats in readings) / (1024**3)
+    docker_cpu_usage = sum(stats.cpu_percent for stats in readings)
 
     return ResourceUsages(
         memory=ResourceMetrics(
@@ -636,6 +956,283 @@ async def get_resource_usage(id: str):
     return ResourceUsage(cpu=cpu, memory=memory)
 
 
+class LiveResourceUsage(BaseModel):
+    # time.time() of the update
+    at: float
+    # Docker and system usage, only when following every container
+    overview: ResourceUsages | None = None
+    # Full container ID -> usage, containers without a reading yet left out
+    containers: Dict[str, ResourceUsage]
+
+
+async def resolve_container_ids(ids: List[str]) -> List[str]:
+    """Full IDs of those of `ids` (IDs, Short IDs or Names) that exist."""
+    resolved: List[str] = []
+    for id in ids:
+        try:
+            resolved.append(cast(str, (await inventory.get(id)).id))
+
+        except NotFound:
+            continue
+
+    return resolved
+
+
+async def live_resource_usage(ids: List[str] | None = None) -> LiveResourceUsage:
+    """
+    Usage of the containers `ids` (full IDs) or, without `ids`, of every running
+    container and overall. Read from the collectors' latest readings: any
+    number of viewers share the same sampling and never call the daemon.
+    """
+    readings = container_stats.all()
+    if ids is not None:
+        readings = {id: readings[id] for id in ids if id in readings}
+
+    return LiveResourceUsage(
+        at=time.time(),
+        overview=await get_resource_usages() if ids is None else None,
+        containers={
+            id: ResourceUsage(
+                cpu=stats.cpu_percent, memory=stats.memory_usage / (1024**3)
+            )
+            for id, stats in readings.items()
+        },
+    )
+
+
+# Shorthands for the label keys of Docker Compose
+GROUP_ALIASES = {
+    "project": "com.docker.compose.project",
+    "service": "com.docker.compose.service",
+}
+
+
+class ResourceGroup(BaseModel):
+    # Label value, None for the containers without that label
+    value: str | None
+    containers: int
+    # Percent and GB, like `ResourceUsage`
+    cpu: float
+    memory: float
+
+
+def group_resource_usage(by: str) -> List[ResourceGroup]:
+    """
+    Usage of the running containers summed per value of their `by` label (or
+    one of `GROUP_ALIASES`), largest CPU first. Values come from the label
+    index and the sums are done in one vectorized pass, however many groups.
+    """
+    key = GROUP_ALIASES.get(by, by)
+    readings = container_stats.all()
+    if not readings:
+        return []
+
+    values = inventory.label_values(key)
+    ids = list(readings)
+    # Empty string for containers without the label, no label value is empty
+    groups, inverse = np.unique(
+        np.array([values.get(id, "") for id in ids]), return_inverse=True
+    )
+    cpu = np.bincount(
+        inverse, weights=[readings[id].cpu_percent for id in ids], minlength=len(groups)
+    )
+    memory = np.bincount(
+        inverse,
+        weights=[readings[id].memory_usage for id in ids],
+        minlength=len(groups),
+    )
+    counts = np.bincount(inverse, minlength=len(groups))
+
+    result = [
+        ResourceGroup(
+            value=value or None,
+            containers=count,
+            cpu=round(cpu_sum, 2),
+            memory=round(memory_sum / (1024**3), 2),
+        )
+        for value, count, cpu_sum, memory_sum in zip(
+            groups.tolist(), counts.tolist(), cpu.tolist(), memory.tolist()
+        )
+    ]
+    return sorted(result, key=lambda group: -group.cpu)
+
+
+async def start_metrics():
+    """Start recording, dropping the history of containers removed meanwhile."""
+    containers = await inventory.list()
+    metrics.start(
+        keep={HOST, *(container.id or container.short_id for container in containers)}
+    )
+
+
+async def get_resource_history(
+    id: str | None = None, since: float | None = None, step: int | None = None
+) -> MetricsHistory:
+    """
+    Recorded usage of a container (ID, Short ID or Name) or, without `id`, of
+    the host, from `since` (epoch seconds, default one hour ago) until now.
+    `step` defaults to the finest one still covering that window.
+    """
+    key = cast(str, (await _get_container(id)).id) if id else HOST
+    now = time.time()
+    since = min(since, now) if since is not None else now - 3600
+    # By default, the finest tier that still covers the whole window
+    step = step or metrics.step_covering(now - since)
+    return metrics.history(key, since, now, step) or MetricsHistory(
+        id=key, start=int(now), step=step, timestamps=[], series={}
+    )
+
+
+def top_consumers(
+    by: ConsumerMetric, limit: int, window: int
+) -> List[ResourceConsumer]:
+    """
+    The `limit` containers using the most of `by`, averaged over the last
+    `window` seconds of history, or from the latest readings with a 0 window.
+    Picked with a heap, there is no full sort of the containers.
+    """
+    fields = CONSUMER_FIELDS[by]
+    if window:
+        now = time.time()
+        values = metrics.usage(
+            now - window, now, fields, counters=by in ("network", "block")
+        )
+    else:
+        values = (
+            (id, float(sum(getattr(stats, field) for field in fields)))
+            for id, stats in container_stats.all().items()
+        )
+
+    top = heapq.nlargest(limit, ((value, id) for id, value in values))
+    containers = {container.id: container for container in inventory.snapshot()}
+    return [
+        ResourceConsumer(
+            id=id,
+            name=container_name(containers[id]) if id in containers else "",
+            value=round(value, 4),
+        )
+        for value, id in top
+    ]
+
+
+def render_metrics() -> str:
+    """
+    Usage, container states and latencies in the Prometheus text format, from
+    the collectors' latest readings and the inventory as it is: a scrape never
+    calls the daemon.
+    """
+    containers = inventory.snapshot()
+    names = {container.id: container_name(container) for container in containers}
+    readings = container_stats.all()
+
+    def per_container(value: Callable[[ContainerStats], float]):
+        return [
+            ({"id": id, "name": names.get(id, "")}, value(stats))
+            for id, stats in sorted(readings.items())
+        ]
+
+    states: Dict[str, int] = {}
+    for container in containers:
+        state = container.status or "unknown"
+        states[state] = states.get(state, 0) + 1
+
+    sample = host.latest()
+    operations = scheduler.stats()
+
+    lines = [
+        *prometheus.render(
+            "sdd_container_cpu_percent",
+            "CPU usage of a running container, 100 per core.",
+            "gauge",
+            per_container(lambda stats: stats.cpu_percent),
+        ),
+        *prometheus.render(
+            "sdd_container_memory_usage_bytes",
+            "Memory usage of a running container.",
+            "gauge",
+            per_container(lambda stats: stats.memory_usage),
+        ),
+        *prometheus.render(
+            "sdd_container_memory_limit_bytes",
+            "Memory limit of a running container.",
+            "gauge",
+            per_container(lambda stats: stats.memory_limit),
+        ),
+        *prometheus.render(
+            "sdd_container_network_receive_bytes_total",
+            "Bytes received by a running container.",
+            "counter",
+            per_container(lambda stats: stats.network_rx),
+        ),
+        *prometheus.render(
+            "sdd_container_network_transmit_bytes_total",
+            "Bytes sent by a running container.",
+            "counter",
+            per_container(lambda stats: stats.network_tx),
+        ),
+        *prometheus.render(
+            "sdd_container_block_read_bytes_total",
+            "Bytes read from block devices by a running container.",
+            "counter",
+            per_container(lambda stats: stats.block_read),
+        ),
+        *prometheus.render(
+            "sdd_container_block_write_bytes_total",
+            "Bytes written to block devices by a running container.",
+            "counter",
+            per_container(lambda stats: stats.block_write),
+        ),
+        *prometheus.render(
+            "sdd_containers",
+            "Number of containers by state.",
+            "gauge",
+            [({"state": state}, count) for state, count in sorted(states.items())],
+        ),
+        *prometheus.render(
+            "sdd_host_cpu_percent",
+            "CPU usage of the host, 100 for all cores.",
+            "gauge",
+            [({}, sample.cpu_percent)],
+        ),
+        *prometheus.render(
+            "sdd_host_cpu_count",
+            "Number of CPUs of the host.",
+            "gauge",
+            [({}, sample.cpu_count)],
+        ),
+        *prometheus.render(
+            "sdd_host_memory_used_bytes",
+            "Memory used on the host.",
+            "gauge",
+            [({}, sample.memory_used)],
+        ),
+        *prometheus.render(
+            "sdd_host_memory_total_bytes",
+            "Memory of the host.",
+            "gauge",
+            [({}, sample.memory_total)],
+        ),
+        *prometheus.render(
+            "sdd_docker_in_flight",
+            "Docker calls running, by operation class.",
+            "gauge",
+            [
+                ({"operation": name}, stats.in_flight)
+                for name, stats in operations.items()
+            ],
+        ),
+        *prometheus.render(
+            "sdd_docker_queued",
+            "Docker calls waiting for a slot, by operation class.",
+            "gauge",
+            [({"operation": name}, stats.queued) for name, stats in operations.items()],
+        ),
+        *prometheus.REQUEST_LATENCY.render(),
+        *prometheus.DOCKER_LATENCY.render(),
+    ]
+    return "\n".join(lines) + "\n"
+
+
 """
 VOLUMES
 """
@@ -657,46 +1254,130 @@ def format_volume(volume: Volume) -> FormattedVolume:
     )
 
 
-async def get_volumes() -> list[FormattedVolume]:
-    return sorted(
-        [format_volume(volume) for volume in await to_thread(client.volumes.list)],  # type: ignore
-        key=lambda volume: volume.name,
+VOLUME_SORT_KEYS: SortKeys[Volume] = {
+    "name": lambda volume: volume.name,
+    "created": lambda volume: volume.attrs.get("CreatedAt") or "",
+    "driver": lambda volume: volume.attrs.get("Driver") or "",
+}
+
+
+async def get_volumes(query: ListQuery = ListQuery()) -> Page[FormattedVolume]:
+    filters = query.docker_filters(name=True)
+    response = cast(
+        Dict[str, Any],
+        await flights.do(
+            "volumes",
+            _filters_key(filters),
+            lambda: engine.get("/volumes", {"filters": filters or None}),
+        ),
+    )
+    volumes = [
+        volume
+        for volume in map(client.volumes.prepare_model, response["Volumes"] or [])
+        if not query.name or volume.name.startswith(query.name)
+    ]
+    page = paginate(
+        volumes, query, VOLUME_SORT_KEYS, "name", lambda volume: volume.name
+    )
+    return Page[FormattedVolume](
+        items=[format_volume(volume) for volume in page.items],
+        total=page.total,
+        next_cursor=page.next_cursor,
     )
 
 
 async def get_volume(id: str) -> FormattedVolume:
+    return format_volume(await _get_volume(id))
+
+
+async def _get_volume(id: str) -> Volume:
     try:
-        return format_volume(await to_thread(client.volumes.get, id))
+        return client.volumes.prepare_model(await engine.get(f"/volumes/{id}"))
 
     except NotFound:
         raise VolumeNotFound()
 
 
-async def _get_volume(id: str) -> Volume:
+async def _run_helper(
+    image: str, command: str, volumes: List[str], working_dir: str
+) -> Tuple[int, bytes]:
+    """
+    `client.containers.run` over the asyncio client: run a throwaway container
+    to completion, then return its exit code and output.
+    """
+    async with scheduler.slot(Operation.Helper):
+        return await _run_helper_unscheduled(image, command, volumes, working_dir)
+
+
+async def _pull_image(image: str):
+    """`client.images.pull`: errors come in the progress stream, not the status."""
+    repository, tag = parse_repository_tag(image)
+    progress = b"".join(
+        [
+            chunk
+            async for chunk in engine.stream(
+                "POST",
+                "/images/create",
+                {"fromImage": repository, "tag": tag or "latest"},
+            )
+        ]
+    )
+    for line in progress.splitlines():
+        if line.strip():
+            status = json.loads(line)
+            if "error" in status:
+                raise APIError(status["error"])
+
+
+async def _run_helper_unscheduled(
+    image: str, command: str, volumes: List[str], working_dir: str
+) -> Tuple[int, bytes]:
+    config = {
+        "Image": image,
+        "Cmd": shlex.split(command),
+        "WorkingDir": working_dir,
+        "HostConfig": {"Binds": volumes},
+    }
     try:
-        return await to_thread(client.volumes.get, id)
+        created = await engine.post("/containers/create", body=config)
 
-    except NotFound:
-        raise VolumeNotFound()
+    except docker.errors.ImageNotFound:
+        # Pruned, or the pull at startup failed: pulled like `containers.run` does
+        await _pull_image(image)
+        created = await engine.post("/containers/create", body=config)
+
+    id = cast(str, created["Id"])
+    try:
+        await engine.post(f"/containers/{id}/start")
+        result = cast(
+            Dict[str, Any],
+            await engine.post(f"/containers/{id}/wait", timeout=NO_TIMEOUT),
+        )
+        output = b"".join(
+            [
+                frame
+                async for frame in engine.stream_frames(
+                    "GET", f"/containers/{id}/logs", {"stdout": True, "stderr": True}
+                )
+            ]
+        )
+        return cast(int, result["StatusCode"]), output
+
+    finally:
+        await engine.delete(f"/containers/{id}", {"force": True})
 
 
 async def volume_ls(id: str, path: str = "") -> list[DirEntry]:
     await get_volume(id)
-    container = await to_thread(
-        client.containers.run,
+    exit_code, ls = await _run_helper(
         image="busybox",
         command=f"ls -F -1 {path}",
-        stdout=True,
-        detach=True,
         volumes=[f"{id}:/inspect:ro"],
         working_dir="/inspect",
     )
-    await to_thread(container.wait)
-    if container.attrs["State"]["ExitCode"] != 0:
+    if exit_code != 0:
         raise InvalidPath()
-    ls = container.logs().decode()
-    await to_thread(container.remove, force=True)
-    entries = ls.splitlines()
+    entries = ls.decode().splitlines()
     formatted_entries: list[DirEntry] = []
     for entry in entries:
         entry_type = (
@@ -722,22 +1403,15 @@ async def volume_ls(id: str, path: str = "") -> list[DirEntry]:
 
 async def volume_cat(id: str, path: str) -> str:
     await get_volume(id)
-    container = await to_thread(
-        client.containers.run,
+    exit_code, content = await _run_helper(
         image="busybox",
         command=f"cat {path}",
-        stdout=True,
-        detach=True,
         volumes=[f"{id}:/inspect:ro"],
         working_dir="/inspect",
     )
-    await to_thread(container.wait)
-    if container.attrs["State"]["ExitCode"] != 0:
-        await to_thread(container.remove)
+    if exit_code != 0:
         raise InvalidPath()
-    content = container.logs().decode()
-    await to_thread(container.remove, force=True)
-    return content
+    return content.decode()
 
 
 async def volume_download(id: str, path: str):
@@ -750,8 +1424,7 @@ async def volume_download(id: str, path: str):
 
     entry_id = uuid4()
     if entry.type == "directory":
-        await to_thread(
-            client.containers.run,
+        exit_code, _ = await _run_helper(
             image="javieraviles/zip",
             command=f"zip -r /output/{entry_id}.zip {path}",
             volumes=[
@@ -759,11 +1432,9 @@ async def volume_download(id: str, path: str):
                 f"{os.path.join(os.getcwd(), 'temp')}:/output",
             ],
             working_dir="/inspect",
-            remove=True,
         )
     else:
-        await to_thread(
-            client.containers.run,
+        exit_code, _ = await _run_helper(
             image="busybox",
             command=f"cp {path} /output/{entry_id}",
             volumes=[
@@ -771,17 +1442,16 @@ async def volume_download(id: str, path: str):
                 f"{os.path.join(os.getcwd(), 'temp')}:/output",
             ],
             working_dir="/inspect",
-            remove=True,
         )
+    if exit_code != 0:
+        raise InvalidPath()
     uid = os.getuid()
     ext = ".zip" if entry.type == "directory" else ""
-    await to_thread(
-        client.containers.run,
+    await _run_helper(
         image="busybox",
         command=f"chown {uid}:{uid} /output/{entry_id}{ext}",
         volumes=[f"{os.path.join(os.getcwd(), 'temp')}:/output"],
         working_dir="/output",
-        remove=True,
     )
     entry_path = os.path.join(".", "temp", f"{entry_id}{ext}")
     output = open(entry_path, "rb").read()
@@ -791,11 +1461,13 @@ async def volume_download(id: str, path: str):
 
 async def remove_volume(id: str):
     volume = await _get_volume(id)
-    await to_thread(volume.remove)
+    await engine.delete(f"/volumes/{volume.id}")
 
 
 async def prune_volumes(filter: dict[str, Any] = {}):
-    return VolumePruneResponse(**(await to_thread(client.volumes.prune, filter)))
+    return VolumePruneResponse(
+        **(await engine.post("/volumes/prune", {"filters": filter or None}))
+    )
 
 
 """
@@ -814,30 +1486,73 @@ class NetworkPruneResponse(BaseModel):
     NetworksDeleted: list[str] | None
 
 
-def format_network(network: Network):
+def format_network(network: Network, containers: List[str] | None = None):
+    """
+    `containers` defaults to the names in the `Containers` map of the network
+    inspect payload, `network.containers` would fetch every container instead.
+    """
+    if containers is None:
+        containers = [
+            attached.get("Name") or container_id[:12]
+            for container_id, attached in cast(
+                Dict[str, Dict[str, str]], network.attrs.get("Containers") or {}
+            ).items()
+        ]
+
     return FormattedNetwork(
         id=network.id or network.short_id,
         short_id=network.short_id,
         name=network.name or network.short_id,
-        containers=[
-            container.name or container.short_id for container in network.containers
-        ],
+        containers=containers,
     )
 
 
-async def get_networks():
-    return sorted(
-        [
-            format_network(network)
-            for network in await to_thread(client.networks.list)  # type: ignore
+NETWORK_SORT_KEYS: SortKeys[Network] = {
+    "id": lambda network: network.id or network.short_id,
+    "name": lambda network: network.name or network.short_id,
+    "created": lambda network: network.attrs.get("Created") or "",
+    "driver": lambda network: network.attrs.get("Driver") or "",
+}
+
+
+async def get_networks(query: ListQuery = ListQuery()) -> Page[FormattedNetwork]:
+    filters = query.docker_filters(name=True)
+    summaries = cast(
+        List[Dict[str, Any]],
+        await flights.do(
+            "networks",
+            _filters_key(filters),
+            lambda: engine.get("/networks", {"filters": filters or None}),
+        ),
+    )
+    networks = [
+        network
+        for network in map(client.networks.prepare_model, summaries)
+        if not query.name or (network.name or "").startswith(query.name)
+    ]
+    page = paginate(
+        networks,
+        query,
+        NETWORK_SORT_KEYS,
+        "id",
+        lambda network: network.id or network.short_id,
+    )
+    # The network list does not carry its containers, so they are taken from
+    # the container inventory instead of inspecting every network
+    members = await inventory.network_members()
+    return Page[FormattedNetwork](
+        items=[
+            format_network(network, members.get(network.id or "", []))
+            for network in page.items
         ],
-        key=lambda network: network.id,
+        total=page.total,
+        next_cursor=page.next_cursor,
     )
 
 
 async def _get_network(id: str):
     try:
-        return await to_thread(client.networks.get, id)
+        return client.networks.prepare_model(await engine.get(f"/networks/{id}"))
 
     except NotFound:
         raise NetworkNotFound()
@@ -849,18 +1564,220 @@ async def get_network(id: str):
 async def connect_container(network_id: str, container_id: str):
     network = await _get_network(network_id)
     await _get_container(container_id)
-    await to_thread(network.connect, container_id) # type: ignore
+    await engine.post(
+        f"/networks/{network.id}/connect", body={"Container": container_id}
+    )
 
 async def disconnect_container(network_id: str, container_id: str, force: bool = False):
     network = await _get_network(network_id)
     await _get_container(container_id)
-    await to_thread(network.disconnect, container_id, force)
+    await engine.post(
+        f"/networks/{network.id}/disconnect",
+        body={"Container": container_id, "Force": force},
+    )
 
 
 async def remove_network(id: str):
     network = await _get_network(id)
-    await to_thread(network.remove)
+    await engine.delete(f"/networks/{network.id}")
 
 
 async def prune_network():
-    return NetworkPruneResponse(**(await to_thread(client.networks.prune)))
+    return NetworkPruneResponse(**(await engine.post("/networks/prune")))
+
+
+"""
+CHANGES
+"""
+
+
+async def _container_deltas(action: str, id: str) -> List[Delta]:
+    if action.startswith(IGNORED_ACTIONS):
+        return []
+    if action == "destroy":
+        return [Delta(type="remove", resource="containers", id=id)]
+
+    try:
+        container = await inventory.get(id)
+    except NotFound:
+        return [Delta(type="remove", resource="containers", id=id)]
+
+    deltas = [
+        Delta(
+            type="add" if action == "create" else "update",
+            resource="containers",
+            id=container.id,
+            item=_format_container(container, await image_tags.get()),
+        )
+    ]
+    # Starting or stopping a container changes the members of its networks
+    if action != "create":
+        networks = cast(
+            Dict[str, Dict[str, Any]],
+            (container.attrs.get("NetworkSettings") or {}).get("Networks") or {},
+        )
+        for network in networks.values():
+            if network.get("NetworkID"):
+                deltas += await _network_deltas("update", network["NetworkID"])
+    return deltas
+
+
+async def _image_deltas(action: str, id: str) -> List[Delta]:
+    if action == "delete":
+        return [Delta(type="remove", resource="images", id=id)]
+
+    try:
+        image = await get_image(id)
+    except _ImageNotFound:
+        # Untagged then removed meanwhile
+        return [Delta(type="remove", resource="images", id=id)]
+    return [
+        Delta(
+            type="add" if action in ("pull", "load", "import") else "update",
+            resource="images",
+            id=image.id,
+            item=image,
+        )
+    ]
+
+
+async def _volume_deltas(action: str, id: str) -> List[Delta]:
+    if action in ("mount", "unmount"):
+        return []
+    if action == "destroy":
+        return [Delta(type="remove", resource="volumes", id=id)]
+
+    try:
+        volume = await get_volume(id)
+    except VolumeNotFound:
+        return [Delta(type="remove", resource="volumes", id=id)]
+    return [
+        Delta(
+            type="add" if action == "create" else "update",
+            resource="volumes",
+            id=volume.id,
+            item=volume,
+        )
+    ]
+
+
+async def _network_deltas(action: str, id: str) -> List[Delta]:
+    if action == "destroy":
+        return [Delta(type="remove", resource="networks", id=id)]
+
+    try:
+        network = await _get_network(id)
+    except NetworkNotFound:
+        return [Delta(type="remove", resource="networks", id=id)]
+
+    members = await inventory.network_members()
+    return [
+        Delta(
+            type="add" if action == "create" else "update",
+            resource="networks",
+            id=network.id,
+            item=format_network(network, members.get(network.id or "", [])),
+        )
+    ]
+
+
+async def _resolve_event(event: DockerEvent) -> List[Delta]:
+    """Turn a Docker event into deltas, once the inventory has applied it."""
+    type: str = event.get("Type", "")
+    action: str = event.get("Action", "")
+    actor: Dict[str, Any] = event.get("Actor", {})
+    id: str = actor.get("ID", "") or event.get("id", "")
+    if not id:
+        return []
+
+    if type == "container":
+        return await _container_deltas(action, id)
+    if type == "image":
+        return await _image_deltas(action, id)
+    if type == "volume":
+        return await _volume_deltas(action, id)
+    if type == "network":
+        deltas = await _network_deltas(action, id)
+        container_id = (actor.get("Attributes") or {}).get("container")
+        if container_id and action in ("connect", "disconnect"):
+            deltas += await _container_deltas("update", container_id)
+        return deltas
+    return []
+
+
+# Registered after the inventory, so events reach it once the inventory is updated
+feed = ChangeFeed(watcher, _resolve_event)
+
+
+async def _snapshots(resources: List[FeedResource]) -> List[Delta]:
+    loaders: Dict[FeedResource, Callable[[], Awaitable[Page[Any]]]] = {
+        "containers": lambda: get_containers(all=True),
+        "images": get_images,
+        "volumes": get_volumes,
+        "networks": get_networks,
+    }
+    pages = await gather(*(loaders[resource]() for resource in resources))
+    return [
+        Delta(type="snapshot", resource=resource, items=page.items)
+        for resource, page in zip(resources, pages)
+    ]
+
+
+async def subscribe_changes(resources: List[FeedResource]) -> AsyncIterator[Delta]:
+    """
+    A snapshot of each of `resources`, then their deltas as they happen. The
+    snapshots are sent again whenever the feed lost track of some changes.
+    """
+    async with feed.subscription() as queue:
+        # Subscribed first, so nothing happening during the snapshot is lost
+        for delta in await _snapshots(resources):
+            yield delta
+
+        while True:
+            delta = await queue.get()
+            if delta is None:
+                for delta in await _snapshots(resources):
+                    yield delta
+            elif delta.resource in resources:
+                yield delta
+
+
+"""
+ALERTS
+"""
+
+alerts = AlertEngine(inventory, container_stats, watcher)
+
+
+def start_alerts():
+    alerts.start(get_alert_rules())
+
+
+def get_alerts() -> List[Alert]:
+    return alerts.alerts()
+
+
+def create_alert_rule(rule: APIAlertRule) -> DBAlertRule:
+    created = new_alert_rule(rule)
+    alerts.set_rules(get_alert_rules())
+    return created
+
+
+def remove_alert_rule(id: str):
+    delete_alert_rule(id)
+    alerts.set_rules(get_alert_rules())
+
+
+async def subscribe_alerts() -> AsyncIterator[AlertMessage]:
+    """
+    Every alert, then each one as it fires or resolves. Every alert is sent
+    again whenever the subscriber fell behind.
+    """
+    async with alerts.subscription() as queue:
+        yield AlertMessage(type="snapshot", alerts=alerts.alerts())
+        while True:
+            alert = await queue.get()
+            if alert is None:
+                yield AlertMessage(type="snapshot", alerts=alerts.alerts())
+            else:
+                yield AlertMessage(type="alert", alert=alert)
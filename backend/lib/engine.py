@@ -0,0 +1,392 @@
+import json
+import os
+import ssl
+import struct
+import time
+from asyncio import IncompleteReadError, Queue, get_running_loop, to_thread
+from threading import Event, Thread
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Mapping, cast
+
+import aiohttp
+import requests
+from docker import APIClient
+from docker.constants import DEFAULT_UNIX_SOCKET, STREAM_HEADER_SIZE_BYTES
+from docker.errors import APIError, ImageNotFound, NotFound
+from docker.tls import TLSConfig
+from docker.utils import convert_filters, kwargs_from_env
+
+from lib.enums import Operation
+from lib.prometheus import DOCKER_LATENCY
+from lib.scheduler import DockerScheduler
+
+Params = Mapping[str, Any] | None
+
+# For calls the daemon may legitimately hold for long (streams, waits, ...)
+NO_TIMEOUT = aiohttp.ClientTimeout(total=None)
+
+
+def _ssl_context(tls: TLSConfig) -> ssl.SSLContext:
+    """Same certificates and verification as docker-py with that TLS config."""
+    verify = bool(tls.verify)
+    context = ssl.create_default_context(cafile=tls.ca_cert if verify else None)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if tls.cert:
+        context.load_cert_chain(*tls.cert)
+    return context
+
+
+class AsyncDockerClient:
+    """
+    Minimal asyncio client for the Docker Engine API.
+
+    Requests go straight over the daemon socket (unix, or tcp with the TLS
+    settings of `DOCKER_TLS_VERIFY` / `DOCKER_CERT_PATH` like docker-py) through
+    a pooled, keep-alive `aiohttp` session, so they are awaited on the event
+    loop instead of occupying an executor thread like docker-py calls do. Errors
+    are raised as docker-py exceptions (`NotFound`, `ImageNotFound`, `APIError`)
+    so callers handle both clients the same way.
+
+    Other hosts (ssh, ...) go through the docker-py `api` client instead:
+    requests in a thread, streams in a thread of their own each.
+
+    Plain requests take a `scheduler` slot, a read for GET and a mutation for
+    everything else unless told otherwise. Streams are long-lived and do not.
+
+    The session is created on first use, inside the running loop.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        scheduler: DockerScheduler,
+        host: str | None = None,
+        pool_size: int = 64,
+        timeout: float = 60,
+        api: APIClient | None = None,
+    ):
+        self.version = version
+        self.scheduler = scheduler
+        self.host = host or os.getenv("DOCKER_HOST") or DEFAULT_UNIX_SOCKET
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self._session: aiohttp.ClientSession | None = None
+        self._socket: str | None = None
+        self._ssl: ssl.SSLContext | None = None
+        self._api: APIClient | None = None
+        scheme, _, address = self.host.rpartition("://")
+        if scheme in ("unix", "http+unix"):
+            self._socket = "/" + address.lstrip("/")
+            self._base_url = "http://docker"
+        elif scheme in ("", "tcp", "http", "https"):
+            # Like docker.from_env, TLS settings only apply to the DOCKER_HOST
+            tls = None if host else kwargs_from_env().get("tls")
+            if tls is not None:
+                self._ssl = _ssl_context(tls)
+            secure = tls is not None or scheme == "https"
+            self._base_url = ("https://" if secure else "http://") + address
+        elif api is not None:
+            self._api = api
+            self._base_url = api.base_url
+        else:
+            raise ValueError(f"unsupported Docker host without a fallback: {self.host}")
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = (
+                aiohttp.UnixConnector(path=self._socket, limit=self.pool_size)
+                if self._socket
+                else aiohttp.TCPConnector(
+                    limit=self.pool_size,
+                    **({"ssl": self._ssl} if self._ssl is not None else {}),
+                )
+            )
+            self._session = aiohttp.ClientSession(
+                base_url=self._base_url,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _url(self, path: str) -> str:
+        return f"/v{self.version}{path}"
+
+    @staticmethod
+    def _params(params: Params) -> Dict[str, str]:
+        output: Dict[str, str] = {}
+        for key, value in (params or {}).items():
+            if value is None:
+                continue
+            if key == "filters" and isinstance(value, dict):
+                # Same normalization as docker-py: values become lists of strings
+                output[key] = cast(str, convert_filters(value))
+            elif isinstance(value, bool):
+                output[key] = "1" if value else "0"
+            elif isinstance(value, (dict, list)):
+                output[key] = json.dumps(value)
+            else:
+                output[key] = str(value)
+        return output
+
+    @staticmethod
+    async def _raise_for_status(response: aiohttp.ClientResponse):
+        if response.status < 400:
+            return
+
+        try:
+            explanation = str((await response.json(content_type=None))["message"])
+        except (ValueError, KeyError, TypeError):
+            explanation = await response.text()
+
+        message = f"{response.status} {response.reason}"
+        if response.status == 404:
+            if "no such image" in explanation.lower():
+                raise ImageNotFound(message, explanation=explanation)
+            raise NotFound(message, explanation=explanation)
+        raise APIError(message, explanation=explanation)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Params = None,
+        body: Any = None,
+        timeout: aiohttp.ClientTimeout | None = None,
+        operation: Operation | None = None,
+    ) -> Any:
+        """
+        Send a request and return its decoded JSON body (None when empty).
+        `timeout` overrides the client one, e.g. with `NO_TIMEOUT`.
+        """
+        operation = operation or (
+            Operation.FastRead if method == "GET" else Operation.SlowMutation
+        )
+        start = time.perf_counter()
+        try:
+            if self._api is not None:
+                async with self.scheduler.slot(operation):
+                    response = await to_thread(
+                        self._open,
+                        method,
+                        path,
+                        params,
+                        body,
+                        timeout.total if timeout else self.timeout,
+                    )
+                content = response.content
+                content_type = response.headers.get("Content-Type", "")
+            else:
+                async with self.scheduler.slot(operation), self.session().request(
+                    method,
+                    self._url(path),
+                    params=self._params(params),
+                    json=body,
+                    **({"timeout": timeout} if timeout else {}),
+                ) as response:
+                    await self._raise_for_status(response)
+                    content = await response.read()
+                    content_type = response.content_type
+
+        finally:
+            DOCKER_LATENCY.observe(
+                (method, operation.value), time.perf_counter() - start
+            )
+
+        if not content:
+            return None
+        if content_type.split(";")[0].strip() == "application/json":
+            return json.loads(content)
+        return content
+
+    async def get(self, path: str, params: Params = None, **kwargs: Any) -> Any:
+        return await self.request("GET", path, params, **kwargs)
+
+    async def post(
+        self, path: str, params: Params = None, body: Any = None, **kwargs: Any
+    ) -> Any:
+        return await self.request("POST", path, params, body, **kwargs)
+
+    async def delete(self, path: str, params: Params = None, **kwargs: Any) -> Any:
+        return await self.request("DELETE", path, params, **kwargs)
+
+    async def stream(
+        self, method: str, path: str, params: Params = None, body: Any = None
+    ) -> AsyncIterator[bytes]:
+        """Raw body chunks of a long-lived response (archive, attach, ...)."""
+        if self._api is not None:
+            async for chunk in self._threaded(
+                method, path, params, body, lambda response: response.iter_content(None)
+            ):
+                yield chunk
+            return
+
+        async with self.session().request(
+            method,
+            self._url(path),
+            params=self._params(params),
+            json=body,
+            timeout=NO_TIMEOUT,
+        ) as response:
+            await self._raise_for_status(response)
+            async for chunk in response.content.iter_any():
+                yield chunk
+
+    async def stream_json(self, path: str, params: Params = None) -> AsyncIterator[Any]:
+        """One decoded object per line of a JSON stream (events, stats, ...)."""
+        if self._api is not None:
+            api = self._api
+            async for item in self._threaded(
+                "GET",
+                path,
+                params,
+                None,
+                lambda response: api._stream_helper(response, decode=True),
+            ):
+                yield item
+            return
+
+        async with self.session().get(
+            self._url(path),
+            params=self._params(params),
+            timeout=NO_TIMEOUT,
+        ) as response:
+            await self._raise_for_status(response)
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def stream_frames(
+        self,
+        method: str,
+        path: str,
+        params: Params = None,
+        body: Any = None,
+        tty: bool = False,
+    ) -> AsyncIterator[bytes]:
+        """
+        Payloads of a multiplexed stdout/stderr stream (logs, exec, ...), one per
+        frame. With `tty` the daemon does not multiplex, chunks are yielded as-is.
+        """
+        if self._api is not None:
+            api = self._api
+            async for frame in self._threaded(
+                method,
+                path,
+                params,
+                body,
+                (lambda response: response.iter_content(None))
+                if tty
+                else api._multiplexed_response_stream_helper,
+            ):
+                yield frame
+            return
+
+        async with self.session().request(
+            method,
+            self._url(path),
+            params=self._params(params),
+            json=body,
+            timeout=NO_TIMEOUT,
+        ) as response:
+            await self._raise_for_status(response)
+            if tty:
+                async for chunk in response.content.iter_any():
+                    yield chunk
+                return
+
+            while True:
+                try:
+                    header = await response.content.readexactly(
+                        STREAM_HEADER_SIZE_BYTES
+                    )
+                except (IncompleteReadError, aiohttp.ClientPayloadError):
+                    # The daemon closed the stream
+                    return
+
+                _, length = struct.unpack(">BxxxL", header)
+                if length:
+                    yield await response.content.readexactly(length)
+
+    def _open(
+        self,
+        method: str,
+        path: str,
+        params: Params,
+        body: Any,
+        timeout: float | None,
+        stream: bool = False,
+    ) -> requests.Response:
+        """Send a request with the docker-py client, in the calling thread."""
+        api = cast(APIClient, self._api)
+        response = api.request(
+            method,
+            f"{api.base_url}{self._url(path)}",
+            params=self._params(params),
+            json=body,
+            stream=stream,
+            timeout=timeout,
+        )
+        api._raise_for_status(response)  # type: ignore
+        return response
+
+    async def _threaded(
+        self,
+        method: str,
+        path: str,
+        params: Params,
+        body: Any,
+        read: Callable[[requests.Response], Iterator[Any]],
+    ) -> AsyncIterator[Any]:
+        """
+        Items `read` from a docker-py streamed response, in a thread of its own
+        as the stream may last. The response is closed when iteration stops.
+        """
+        loop = get_running_loop()
+        items: Queue[tuple[str, Any]] = Queue()
+        responses: List[requests.Response] = []
+        closed = Event()
+
+        def push(kind: str, value: Any = None):
+            try:
+                loop.call_soon_threadsafe(items.put_nowait, (kind, value))
+            except RuntimeError:
+                # The loop is gone
+                closed.set()
+
+        def run():
+            try:
+                response = self._open(method, path, params, body, None, stream=True)
+                responses.append(response)
+                for item in read(response):
+                    if closed.is_set():
+                        break
+                    push("item", item)
+
+            except Exception as error:
+                if not closed.is_set():
+                    push("error", error)
+
+            finally:
+                push("end")
+
+        Thread(target=run, name="docker-stream", daemon=True).start()
+        try:
+            while True:
+                kind, value = await items.get()
+                if kind == "end":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+
+        finally:
+            closed.set()
+            for response in responses:
+                response.close()
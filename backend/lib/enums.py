@@ -70,3 +70,26 @@ default_permission = [
     Permission.LsVolume,
     Permission.CatVolume,
 ]
+
+
+class Operation(Enum):
+    FastRead = "fast_read"
+    SlowRead = "slow_read"
+    SlowMutation = "slow_mutation"
+    Helper = "helper"
+
+
+class ContainerAction(Enum):
+    Start = "start"
+    Stop = "stop"
+    Restart = "restart"
+    Kill = "kill"
+    Remove = "remove"
+
+
+class AlertMetric(Enum):
+    CpuPercent = "cpu_percent"
+    MemoryPercent = "memory_percent"
+    MemoryUsage = "memory_usage"
+    # Starts within the rule duration
+    Restarts = "restarts"
@@ -7,3 +7,41 @@ SIGNATURE = os.getenv(
     "SIGNATURE", hashlib.sha256(uuid4().__str__().encode()).hexdigest()
 )
 USE_HASH = os.getenv("USE_HASH", "true").lower() == "true"
+INVENTORY_MAX_AGE = float(os.getenv("INVENTORY_MAX_AGE", "300"))
+DOCKER_FAST_READ_LIMIT = int(os.getenv("DOCKER_FAST_READ_LIMIT", "32"))
+DOCKER_SLOW_READ_LIMIT = int(os.getenv("DOCKER_SLOW_READ_LIMIT", "16"))
+DOCKER_SLOW_MUTATION_LIMIT = int(os.getenv("DOCKER_SLOW_MUTATION_LIMIT", "8"))
+DOCKER_HELPER_LIMIT = int(os.getenv("DOCKER_HELPER_LIMIT", "2"))
+DOCKER_THREADS = int(os.getenv("DOCKER_THREADS", "8"))
+HOST_SAMPLE_INTERVAL = float(os.getenv("HOST_SAMPLE_INTERVAL", "2"))
+METRICS_RESOLUTION = int(os.getenv("METRICS_RESOLUTION", "1"))
+METRICS_RETENTION = int(os.getenv("METRICS_RETENTION", "600"))
+# Comma separated "step:retention" pairs in seconds, from the finest
+METRICS_TIERS = [
+    (int(step), int(retention))
+    for step, _, retention in (
+        pair.partition(":")
+        for pair in os.getenv(
+            "METRICS_TIERS", "10:21600,60:86400,3600:604800"
+        ).split(",")
+        if pair.strip()
+    )
+]
+# Empty to keep the resource history in memory only
+METRICS_DIR = os.getenv("METRICS_DIR", "data/metrics")
+# Empty to always use the Docker stats API
+CGROUP_ROOT = os.getenv("CGROUP_ROOT", "/sys/fs/cgroup")
+PROC_ROOT = os.getenv("PROC_ROOT", "/proc")
+# Static bearer token for Prometheus scrapes, user tokens are accepted either way
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+LOG_HISTORY = int(os.getenv("LOG_HISTORY", "1000"))
+BULK_PARALLELISM = int(os.getenv("BULK_PARALLELISM", "8"))
+# Comma separated "operation=seconds" pairs, e.g. "images=2,resources=1"
+SINGLE_FLIGHT_TTL = {
+    operation.strip(): float(ttl)
+    for operation, _, ttl in (
+        pair.partition("=")
+        for pair in os.getenv("SINGLE_FLIGHT_TTL", "").split(",")
+        if pair.strip()
+    )
+}
@@ -25,6 +25,9 @@ class CommandNotFound(NotFound):
 class NetworkNotFound(NotFound):
     ...
 
+class AlertRuleNotFound(NotFound):
+    ...
+
 
 
 class MissingError(Exception):
@@ -63,6 +66,12 @@ class InvalidRoleHex(Invalid):
 class InvalidPath(Invalid):
     ...
 
+class InvalidCursor(Invalid):
+    ...
+
+class InvalidSortKey(Invalid):
+    ...
+
 
 
 class NotAllowed(Exception):
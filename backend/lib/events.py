@@ -0,0 +1,87 @@
+import time
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List
+
+from docker import DockerClient
+from docker.types.daemon import CancellableStream
+
+DockerEvent = Dict[str, Any]
+EventListener = Callable[[DockerEvent], None]
+
+
+class DockerEventWatcher:
+    """
+    Follow the Docker daemon events stream in a background thread and dispatch
+    every event to the listeners registered for its type (container, image, ...).
+
+    Listeners registered with `on_connect` are called each time the stream is
+    (re)opened, so caches can resync whatever happened while it was down.
+    """
+
+    def __init__(self, client: DockerClient, retry_delay: float = 1.0):
+        self.client = client
+        self.retry_delay = retry_delay
+
+        self._listeners: Dict[str, List[EventListener]] = {}
+        self._connect_listeners: List[Callable[[], None]] = []
+        self._lock = Lock()
+        self._stop = Event()
+        self._connected = Event()
+        self._stream: CancellableStream | None = None
+        self._thread: Thread | None = None
+
+    def on(self, type: str, listener: EventListener):
+        with self._lock:
+            self._listeners.setdefault(type, []).append(listener)
+
+    def on_connect(self, listener: Callable[[], None]):
+        with self._lock:
+            self._connect_listeners.append(listener)
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="docker-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._connected.clear()
+        if self._stream:
+            self._stream.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._stream = self.client.events(decode=True)
+                self._connected.set()
+
+                for listener in list(self._connect_listeners):
+                    listener()
+
+                for event in self._stream:
+                    self._dispatch(event)
+
+            except Exception:
+                pass
+
+            finally:
+                self._connected.clear()
+
+            if not self._stop.is_set():
+                time.sleep(self.retry_delay)
+
+    def _dispatch(self, event: DockerEvent):
+        for listener in list(self._listeners.get(event.get("Type", ""), [])):
+            try:
+                listener(event)
+
+            except Exception:
+                # A broken listener must not kill the stream for everyone else
+                continue
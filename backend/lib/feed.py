@@ -0,0 +1,124 @@
+from asyncio import (
+    AbstractEventLoop,
+    Queue,
+    QueueEmpty,
+    QueueFull,
+    Task,
+    create_task,
+    get_running_loop,
+)
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Literal, Set
+
+from pydantic import BaseModel
+
+from lib.events import DockerEvent, DockerEventWatcher
+
+FeedResource = Literal["containers", "images", "volumes", "networks"]
+
+
+class Delta(BaseModel):
+    # "add" and "update" both carry the whole item and can be applied as upserts
+    type: Literal["snapshot", "add", "update", "remove"]
+    resource: FeedResource
+    # Set for add, update and remove
+    id: str | None = None
+    item: Any = None
+    # Set for snapshot
+    items: List[Any] | None = None
+
+
+# Resolves one Docker event into the deltas it causes
+DeltaResolver = Callable[[DockerEvent], Awaitable[List[Delta]]]
+
+
+class ChangeFeed:
+    """
+    Fan the shared Docker events subscription out to any number of asyncio
+    subscribers as resource deltas.
+
+    Each event is resolved once, by a single task, whatever the number of
+    subscribers, and only while there is at least one. A subscriber that falls
+    `buffer` deltas behind, or any subscriber after the events stream
+    reconnected, gets `None` instead: it should reload a snapshot.
+    """
+
+    def __init__(
+        self, watcher: DockerEventWatcher, resolve: DeltaResolver, buffer: int = 1024
+    ):
+        self.resolve = resolve
+        self.buffer = buffer
+
+        self._loop: AbstractEventLoop | None = None
+        self._events: Queue[DockerEvent] | None = None
+        self._task: Task[None] | None = None
+        self._subscribers: Set[Queue[Delta | None]] = set()
+
+        for type in ("container", "image", "volume", "network"):
+            watcher.on(type, self._enqueue)
+        watcher.on_connect(self._reset)
+
+    def start(self):
+        self._loop = get_running_loop()
+        self._events = Queue()
+        self._task = create_task(self._run(), name="change-feed")
+
+    async def stop(self):
+        self._loop = None
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    @asynccontextmanager
+    async def subscription(self) -> AsyncIterator["Queue[Delta | None]"]:
+        queue: Queue[Delta | None] = Queue(maxsize=self.buffer)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+
+        finally:
+            self._subscribers.discard(queue)
+
+    def _enqueue(self, event: DockerEvent):
+        # Called from the watcher thread
+        loop, events = self._loop, self._events
+        if loop is not None and events is not None and self._subscribers:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def _reset(self):
+        # Called from the watcher thread, events may have been missed
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._broadcast, None)
+
+    async def _run(self):
+        assert self._events is not None
+        while True:
+            event = await self._events.get()
+            if not self._subscribers:
+                continue
+
+            try:
+                deltas = await self.resolve(event)
+
+            except Exception:
+                # A missed delta must not stop the feed, tell subscribers to reload
+                self._broadcast(None)
+                continue
+
+            for delta in deltas:
+                self._broadcast(delta)
+
+    def _broadcast(self, delta: Delta | None):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(delta)
+
+            except QueueFull:
+                # Too far behind, whatever is queued is superseded by a reload
+                while True:
+                    try:
+                        queue.get_nowait()
+                    except QueueEmpty:
+                        break
+                queue.put_nowait(None)
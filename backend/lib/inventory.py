@@ -0,0 +1,452 @@
+import time
+from asyncio import AbstractEventLoop, gather, get_running_loop
+from threading import Lock
+from typing import Any, Dict, List, Set, cast
+
+from docker import DockerClient
+from docker.errors import NotFound
+from docker.models.containers import Container
+
+from lib.engine import AsyncDockerClient
+from lib.events import DockerEvent, DockerEventWatcher
+from lib.singleflight import SingleFlight
+
+# Container events that do not change anything we keep in memory
+IGNORED_ACTIONS = (
+    "exec_",
+    "attach",
+    "resize",
+    "top",
+    "export",
+    "archive-path",
+    "extract-to-dir",
+    "copy",
+    "commit",
+)
+
+# Container states that `docker ps` (without --all) shows
+RUNNING = ("running", "paused", "restarting")
+
+
+def container_name(container: Container) -> str:
+    """Name of a container, whether its attrs come from a summary or an inspect."""
+    if container.attrs.get("Name"):
+        return container.attrs["Name"].lstrip("/")
+    names = cast(List[str], container.attrs.get("Names") or [])
+    return names[0].lstrip("/") if len(names) else ""
+
+
+def container_labels(container: Container) -> Dict[str, str]:
+    """Labels of a container, `container.labels` only works on inspected ones."""
+    if "Labels" in container.attrs:
+        return container.attrs["Labels"] or {}
+    return (container.attrs.get("Config") or {}).get("Labels") or {}
+
+
+class ContainerInventory:
+    """
+    In-memory copy of every container known by the daemon.
+
+    The inventory is loaded once from the container summaries (one daemon call,
+    no per-container inspect), then kept up to date with the Docker events
+    stream: each container event refreshes (or drops) only the container it is
+    about. Full inspect attributes are fetched lazily, only for the containers
+    somebody asks the raw view of, and cached until the next event for them.
+
+    Reads are served from memory, a full resync only happens when the snapshot
+    is older than `max_age` seconds while the events stream is down, or when
+    explicitly requested.
+    """
+
+    def __init__(
+        self,
+        client: DockerClient,
+        engine: AsyncDockerClient,
+        watcher: DockerEventWatcher,
+        flights: SingleFlight,
+        max_age: float,
+    ):
+        # docker-py serves the events thread, the asyncio client the request path
+        self.client = client
+        self.engine = engine
+        self.watcher = watcher
+        self.flights = flights
+        self.max_age = max_age
+
+        self._lock = Lock()
+        self._containers: Dict[str, Container] = {}
+        self._inspected: Dict[str, Dict[str, Any]] = {}
+        self._names: Dict[str, str] = {}
+        # "key" and "key=value" -> IDs of the containers having that label
+        self._labels: Dict[str, Set[str]] = {}
+        # Container ID -> inventory version of its last change
+        self._versions: Dict[str, int] = {}
+        self._synced_at: float | None = None
+        self._version = 0
+
+        watcher.on("container", self._apply)
+        watcher.on("network", self._apply_network)
+        watcher.on_connect(self.resync)
+
+    @property
+    def version(self) -> int:
+        """Incremented on every change, usable as a cheap collection version."""
+        return self._version
+
+    def container_version(self, id: str) -> int | None:
+        """Inventory version of the last change of a container, by its full ID."""
+        return self._versions.get(id)
+
+    @property
+    def stale(self) -> bool:
+        if self._synced_at is None:
+            return True
+        if self.watcher.connected:
+            return False
+        return time.monotonic() - self._synced_at > self.max_age
+
+    def resync(self):
+        self._replace(
+            self.client.containers.list(all=True, sparse=True)  # type: ignore
+        )
+
+    async def resync_async(self):
+        summaries = cast(
+            List[Dict[str, Any]],
+            await self.flights.do(
+                "containers",
+                None,
+                lambda: self.engine.get("/containers/json", {"all": True}),
+            ),
+        )
+        self._replace(list(map(self.client.containers.prepare_model, summaries)))
+
+    def _replace(self, summaries: List[Container]):
+        containers = {
+            container.id or container.short_id: container for container in summaries
+        }
+        with self._lock:
+            self._containers = containers
+            self._inspected = {}
+            self._names = {
+                container_name(container): id
+                for id, container in containers.items()
+                if container_name(container)
+            }
+            self._labels = {}
+            for id, container in containers.items():
+                self._index_labels(id, container)
+            self._synced_at = time.monotonic()
+            self._version += 1
+            self._versions = {id: self._version for id in containers}
+
+    async def ensure_fresh(self, refresh: bool = False):
+        if refresh or self.stale:
+            await self.resync_async()
+
+    async def list(
+        self, all: bool = True, refresh: bool = False, labels: List[str] = []
+    ) -> List[Container]:
+        """
+        Return containers built from the list summaries, sorted by ID.
+
+        `labels` ("key" or "key=value") are all required and resolved through the
+        label index. Containers `attrs` are the summary ones (`Names`, `State` as
+        a string, ...), use `inspect` or `inspect_all` for the full attributes.
+        """
+        await self.ensure_fresh(refresh)
+        with self._lock:
+            if labels:
+                ids = set.intersection(
+                    *(self._labels.get(label, set()) for label in labels)
+                )
+                containers = [self._containers[id] for id in ids]
+            else:
+                containers = list(self._containers.values())
+
+        if not all:
+            containers = [
+                container for container in containers if container.status in RUNNING
+            ]
+
+        return sorted(
+            containers, key=lambda container: container.id or container.short_id
+        )
+
+    def snapshot(self) -> List[Container]:
+        """Containers as currently known, without any freshness check."""
+        with self._lock:
+            return list(self._containers.values())
+
+    def label_values(self, key: str) -> Dict[str, str]:
+        """Container ID -> value of its `key` label, through the label index."""
+        with self._lock:
+            return {
+                id: container_labels(self._containers[id])[key]
+                for id in self._labels.get(key, ())
+                if id in self._containers
+            }
+
+    def peek(self, id: str) -> Container | None:
+        """Container by full ID as currently known, without any freshness check."""
+        with self._lock:
+            return self._containers.get(id)
+
+    async def get(self, id: str, refresh: bool = False) -> Container:
+        """
+        Resolve a container by ID, Short ID or Name, like `client.containers.get`.
+
+        Falls back to the daemon on a miss, so a container that the events stream
+        has not reported yet is still found.
+
+        Raises:
+            docker.errors.NotFound
+        """
+        await self.ensure_fresh(refresh)
+        container = self._lookup(id)
+        if container is not None:
+            return container
+
+        await self._fetch(id)
+        container = self._lookup(id)
+        if container is None:
+            raise NotFound(f"No such container: {id}")
+        return container
+
+    async def network_members(self, refresh: bool = False) -> Dict[str, List[str]]:
+        """
+        Network ID -> names of the containers attached to it, built from the
+        `NetworkSettings.Networks` of every container summary. Like the network
+        inspect `Containers` map, only containers with a live endpoint count.
+        """
+        members: Dict[str, List[str]] = {}
+        for container in await self.list(all=False, refresh=refresh):
+            networks = cast(
+                Dict[str, Dict[str, Any]],
+                (container.attrs.get("NetworkSettings") or {}).get("Networks") or {},
+            )
+            for network in networks.values():
+                members.setdefault(network.get("NetworkID") or "", []).append(
+                    container_name(container) or container.short_id
+                )
+        return members
+
+    async def inspect(self, id: str, refresh: bool = False) -> Dict[str, Any]:
+        container = await self.get(id, refresh=refresh)
+        return (await self.inspect_all([container]))[0]
+
+    async def inspect_all(self, containers: List[Container]) -> List[Dict[str, Any]]:
+        """Full inspect attributes, only asking the daemon for uncached ones."""
+        with self._lock:
+            missing = [
+                container
+                for container in containers
+                if (container.id or container.short_id) not in self._inspected
+            ]
+        await gather(*(self._inspect(container) for container in missing))
+
+        with self._lock:
+            return [
+                self._inspected.get(container.id or container.short_id)
+                or container.attrs
+                for container in containers
+            ]
+
+    async def _inspect(self, container: Container):
+        id = container.id or container.short_id
+        try:
+            attrs = cast(
+                Dict[str, Any], await self.engine.get(f"/containers/{id}/json")
+            )
+
+        except NotFound:
+            return
+
+        with self._lock:
+            # Skip it if an event replaced the container meanwhile
+            if self._containers.get(id) is container:
+                self._inspected[id] = attrs
+
+    async def _fetch(self, id: str):
+        """Look a container up on the daemon (by ID, Short ID or Name) and store it."""
+        attrs = cast(Dict[str, Any], await self.engine.get(f"/containers/{id}/json"))
+        summaries = cast(
+            List[Dict[str, Any]],
+            await self.engine.get(
+                "/containers/json", {"all": True, "filters": {"id": [attrs["Id"]]}}
+            ),
+        )
+        for summary in summaries:
+            if summary["Id"] == attrs["Id"]:
+                self._store(self.client.containers.prepare_model(summary))
+
+    def _refresh(self, id: str):
+        summaries = self.client.containers.list(  # type: ignore
+            all=True, sparse=True, filters={"id": id}
+        )
+        container = next((c for c in summaries if c.id == id), None)
+        if container is None:
+            self._drop(id)
+        else:
+            self._store(container)
+
+    def _lookup(self, id: str) -> Container | None:
+        with self._lock:
+            if id in self._containers:
+                return self._containers[id]
+
+            if id.lstrip("/") in self._names:
+                return self._containers.get(self._names[id.lstrip("/")])
+
+            matches = [
+                container
+                for container_id, container in self._containers.items()
+                if container_id.startswith(id)
+            ]
+            return matches[0] if len(matches) == 1 else None
+
+    def _store(self, container: Container):
+        id = container.id or container.short_id
+        with self._lock:
+            previous = self._containers.get(id)
+            if previous is not None:
+                self._names.pop(container_name(previous), None)
+
+            if previous is not None:
+                self._unindex_labels(id, previous)
+
+            self._containers[id] = container
+            self._inspected.pop(id, None)
+            if container_name(container):
+                self._names[container_name(container)] = id
+            self._index_labels(id, container)
+            self._version += 1
+            self._versions[id] = self._version
+
+    def _drop(self, id: str):
+        with self._lock:
+            container = self._containers.pop(id, None)
+            self._inspected.pop(id, None)
+            if container is None:
+                return
+
+            self._names.pop(container_name(container), None)
+            self._unindex_labels(id, container)
+            self._version += 1
+            self._versions.pop(id, None)
+
+    def _index_labels(self, id: str, container: Container):
+        for key, value in container_labels(container).items():
+            self._labels.setdefault(key, set()).add(id)
+            self._labels.setdefault(f"{key}={value}", set()).add(id)
+
+    def _unindex_labels(self, id: str, container: Container):
+        for key, value in container_labels(container).items():
+            for label in (key, f"{key}={value}"):
+                ids = self._labels.get(label)
+                if ids is None:
+                    continue
+
+                ids.discard(id)
+                if not ids:
+                    del self._labels[label]
+
+    def _apply(self, event: DockerEvent):
+        action: str = event.get("Action", "")
+        id: str = event.get("Actor", {}).get("ID", "") or event.get("id", "")
+        if not id or action.startswith(IGNORED_ACTIONS):
+            return
+
+        if action == "destroy":
+            self._drop(id)
+            return
+
+        self._refresh(id)
+
+    def _apply_network(self, event: DockerEvent):
+        # Connecting or disconnecting only changes the container's summary
+        container_id: str = (
+            event.get("Actor", {}).get("Attributes", {}).get("container", "")
+        )
+        if container_id and event.get("Action") in ("connect", "disconnect"):
+            self._refresh(container_id)
+
+
+class ImageTagIndex:
+    """
+    Image ID -> tags map built from a single image listing.
+
+    Shared by every container listing until an image event (pull, tag, untag,
+    delete, ...) or a reconnection of the events stream invalidates it.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncDockerClient,
+        watcher: DockerEventWatcher,
+        flights: SingleFlight,
+        max_age: float,
+    ):
+        self.engine = engine
+        self.watcher = watcher
+        self.flights = flights
+        self.max_age = max_age
+
+        self._loop: AbstractEventLoop | None = None
+        self._tags: Dict[str, List[str]] | None = None
+        self._built_at = 0.0
+        self._version = 0
+        self._built_version = -1
+
+        watcher.on("image", self._invalidate)
+        watcher.on_connect(self._invalidate)
+
+    @property
+    def version(self) -> int:
+        """Incremented on every image event, usable as a cheap image list version."""
+        return self._version
+
+    @property
+    def stale(self) -> bool:
+        if self._tags is None or self._built_version != self._version:
+            return True
+        if self.watcher.connected:
+            return False
+        return time.monotonic() - self._built_at > self.max_age
+
+    def invalidate(self):
+        self._version += 1
+        self.flights.forget("image_tags")
+
+    def _invalidate(self, _: DockerEvent | None = None):
+        # Called from the watcher thread, the index belongs to the loop
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self.invalidate()
+        else:
+            loop.call_soon_threadsafe(self.invalidate)
+
+    async def _rebuild(self):
+        version = self._version
+        # The image summaries already carry RepoTags, unlike
+        # `client.images.list` which inspects every image again
+        images = cast(
+            List[Dict[str, Any]],
+            await self.flights.do(
+                "image_tags", None, lambda: self.engine.get("/images/json")
+            ),
+        )
+        self._tags = {
+            image["Id"]: [
+                tag for tag in image.get("RepoTags") or [] if tag != "<none>:<none>"
+            ]
+            for image in images
+        }
+        self._built_at = time.monotonic()
+        self._built_version = version
+
+    async def get(self) -> Dict[str, List[str]]:
+        self._loop = get_running_loop()
+        if self.stale:
+            await self._rebuild()
+        return self._tags or {}
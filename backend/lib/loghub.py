@@ -0,0 +1,176 @@
+import struct
+import time
+from asyncio import Queue, QueueEmpty, QueueFull, Task, create_task, wait_for
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Literal, Set, Tuple
+
+from lib.engine import AsyncDockerClient
+
+
+class _LogStream:
+    def __init__(self, history: int):
+        self.recent: Deque[str] = deque(maxlen=history)
+        self.subscribers: Set[Queue[str | None]] = set()
+        # The subscriber that opened the stream, until it leaves
+        self.opener: Queue[str | None] | None = None
+        self.task: Task[None] | None = None
+
+
+class LogHub:
+    """
+    Keep one follow stream of logs per container, whatever the number of
+    viewers, and fan each line out to all of them.
+
+    The stream is opened by the first subscriber, with its `tail` (all the
+    logs without), and closed when the last one leaves. The last `history`
+    lines are kept: a later subscriber first gets its `tail` of them (all of
+    them without), then the live lines.
+
+    The first subscriber paces the stream while it is there, as a stream of its
+    own would, so a long backlog reaches it whole. Any other subscriber that
+    falls `buffer` lines behind is ended rather than slowing the others down:
+    its queue gets `None`, like every subscriber when the stream ends.
+    """
+
+    def __init__(
+        self, engine: AsyncDockerClient, history: int = 1000, buffer: int = 1024
+    ):
+        self.engine = engine
+        self.history = history
+        self.buffer = buffer
+
+        self._streams: Dict[str, _LogStream] = {}
+
+    async def stop(self):
+        for stream in list(self._streams.values()):
+            if stream.task:
+                stream.task.cancel()
+        self._streams = {}
+
+    @asynccontextmanager
+    async def subscription(
+        self, id: str, tty: bool = False, tail: int | None = None
+    ) -> AsyncIterator["Queue[str | None]"]:
+        """Lines of the container `id` (full ID), `None` once they ended."""
+        queue: Queue[str | None] = Queue(maxsize=self.buffer + self.history)
+        stream = self._streams.get(id)
+        if stream is None:
+            stream = self._streams[id] = _LogStream(self.history)
+            stream.opener = queue
+            stream.task = create_task(
+                self._follow(id, tty, tail or "all", stream),
+                name=f"logs-{id[:12]}",
+            )
+
+        # No await in between: no line is missed or sent twice
+        backlog = list(stream.recent)
+        for line in backlog[-tail:] if tail else backlog:
+            queue.put_nowait(line)
+        stream.subscribers.add(queue)
+        try:
+            yield queue
+
+        finally:
+            stream.subscribers.discard(queue)
+            if stream.opener is queue:
+                stream.opener = None
+                # Unblock the stream if it waits for room in this queue
+                while not queue.empty():
+                    queue.get_nowait()
+            if not stream.subscribers and self._streams.get(id) is stream:
+                del self._streams[id]
+                if stream.task:
+                    stream.task.cancel()
+
+    async def _follow(
+        self, id: str, tty: bool, tail: int | Literal["all"], stream: _LogStream
+    ):
+        try:
+            async for frame in self.engine.stream_frames(
+                "GET",
+                f"/containers/{id}/logs",
+                {
+                    "follow": True,
+                    "stdout": True,
+                    "stderr": True,
+                    "tail": tail,
+                },
+                tty=tty,
+            ):
+                await self._broadcast(stream, frame.decode("utf-8", errors="replace"))
+
+        except Exception as e:
+            await self._broadcast(stream, f"Error streaming logs: {str(e)}")
+
+        finally:
+            # Later subscribers open a new stream
+            if self._streams.get(id) is stream:
+                del self._streams[id]
+            for queue in list(stream.subscribers):
+                self._end(queue)
+
+    async def _broadcast(self, stream: _LogStream, line: str):
+        stream.recent.append(line)
+        for queue in list(stream.subscribers):
+            if queue is stream.opener:
+                await queue.put(line)
+                continue
+            try:
+                queue.put_nowait(line)
+
+            except QueueFull:
+                stream.subscribers.discard(queue)
+                self._end(queue)
+
+    @staticmethod
+    def _end(queue: "Queue[str | None]"):
+        try:
+            queue.put_nowait(None)
+
+        except QueueFull:
+            # Too far behind, what is queued is dropped for the end marker
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+async def read_batch(
+    queue: "Queue[str | None]", wait: float, window: float = 0, max_bytes: int = 0
+) -> Tuple[List[str], bool]:
+    """
+    Lines of a subscription queue: the first one within `wait` seconds, then
+    those coming within `window` seconds after it, until about `max_bytes`
+    (no limit with 0). Also whether the stream ended. Raises TimeoutError when
+    no line came within `wait`.
+    """
+    line = await wait_for(queue.get(), timeout=wait)
+    if line is None:
+        return [], True
+
+    lines, size = [line], len(line)
+    deadline = time.monotonic() + window
+    while not max_bytes or size < max_bytes:
+        try:
+            line = queue.get_nowait()
+        except QueueEmpty:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                line = await wait_for(queue.get(), timeout=remaining)
+            except TimeoutError:
+                break
+
+        if line is None:
+            return lines, True
+        lines.append(line)
+        size += len(line)
+
+    return lines, False
+
+
+def encode_lines(lines: List[str]) -> bytes:
+    """Binary batch: each line as a big-endian uint32 byte length, then UTF-8."""
+    encoded = [line.encode("utf-8") for line in lines]
+    return b"".join(struct.pack(">I", len(line)) + line for line in encoded)
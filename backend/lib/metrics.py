@@ -0,0 +1,505 @@
+import os
+import time
+import warnings
+import zlib
+from asyncio import AbstractEventLoop, Task, create_task, get_running_loop, sleep
+from typing import Dict, Iterator, List, Literal, Set, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from lib.sampler import HostSampler
+from lib.stats import ContainerStatsCollector
+
+HOST = "host"
+HOST_FIELDS = ("cpu_percent", "memory_usage")
+CONTAINER_FIELDS = (
+    "cpu_percent",
+    "memory_usage",
+    "network_rx",
+    "network_tx",
+    "block_read",
+    "block_write",
+)
+
+
+Aggregate = Literal["min", "max", "avg", "last"]
+AGGREGATES: Tuple[Aggregate, ...] = ("min", "max", "avg", "last")
+
+# Series reduced at once by `MetricsStore.usage`
+USAGE_CHUNK = 256
+# Series file header: magic, then a fingerprint of the layout
+MAGIC = b"SDDMETR2"
+# float32 would lose whole kilobytes of the cumulative byte counters
+DTYPE = np.float64
+HEADER_SIZE = 16
+
+
+def fields_of(id: str) -> Tuple[str, ...]:
+    return HOST_FIELDS if id == HOST else CONTAINER_FIELDS
+
+
+class MetricsHistory(BaseModel):
+    id: str
+    # Epoch seconds of the first point, then one point every `step` seconds
+    start: int
+    step: int
+    timestamps: List[int]
+    # Field -> aggregate -> one value per timestamp, None where nothing was
+    # recorded
+    series: Dict[str, Dict[Aggregate, List[float | None]]]
+
+
+class MetricSeries:
+    """
+    Fixed-size ring of samples on a shared clock of `capacity` slots: slot `n`
+    lives at row `n % capacity`, and a row only counts while it still holds the
+    slot it was written for. A row has `width` values per field (1 for raw
+    samples, one per aggregate for rollups), float64, missing ones NaN.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        width: int,
+        fields: Tuple[str, ...],
+        slots: np.ndarray | None = None,
+        values: np.ndarray | None = None,
+    ):
+        self.fields = fields
+        self.capacity = capacity
+        # Given arrays are views on a mapped file, used as they are
+        self.slots = (
+            slots if slots is not None else np.full(capacity, -1, dtype=np.int64)
+        )
+        self.values = (
+            values
+            if values is not None
+            else np.full((capacity, width, len(fields)), np.nan, dtype=DTYPE)
+        )
+
+    def put(self, slot: int, values: np.ndarray | List[List[float]]):
+        row = slot % self.capacity
+        self.values[row] = values
+        self.slots[row] = slot
+
+    def read(self, first: int, last: int) -> np.ndarray:
+        """Rows of slots `first` to `last` (included), NaN for missing ones."""
+        wanted = np.arange(first, last + 1, dtype=np.int64)
+        rows = wanted % self.capacity
+        output = self.values[rows]
+        output[self.slots[rows] != wanted] = np.nan
+        return output
+
+
+class MetricTier:
+    def __init__(self, step: int, retention: int, width: int):
+        self.step = step
+        self.width = width
+        self.capacity = max(retention // step, 1)
+        self.series: Dict[str, MetricSeries] = {}
+
+
+def rollup(rows: np.ndarray) -> np.ndarray:
+    """
+    Aggregate `rows` of shape (groups, rows, width, fields), raw samples or
+    rollups, into (groups, aggregates, fields) in one go. Rows are either fully
+    recorded or fully missing, a group without any row gives NaN.
+    """
+    rollups = rows.shape[2] == len(AGGREGATES)
+
+    def source(aggregate: Aggregate) -> np.ndarray:
+        return rows[:, :, AGGREGATES.index(aggregate) if rollups else 0]
+
+    output = np.full(
+        (rows.shape[0], len(AGGREGATES), rows.shape[3]), np.nan, dtype=DTYPE
+    )
+    with warnings.catch_warnings():
+        # All-NaN groups, they stay NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        output[:, 0] = np.nanmin(source("min"), axis=1)
+        output[:, 1] = np.nanmax(source("max"), axis=1)
+        output[:, 2] = np.nanmean(source("avg"), axis=1)
+
+    recorded = ~np.isnan(rows[:, :, 0, 0])
+    last = rows.shape[1] - 1 - np.argmax(recorded[:, ::-1], axis=1)
+    output[:, 3] = source("last")[np.arange(rows.shape[0]), last]
+    return output
+
+
+def _rates(values: np.ndarray, recorded: np.ndarray, step: int) -> np.ndarray:
+    """
+    Growth per second of counters `values` (series, rows, fields) over their
+    `recorded` rows, summed over the fields, NaN with fewer than two rows. A
+    row below the previous recorded one counts from 0 (counters reset).
+    """
+    rows = np.arange(values.shape[1])
+    # Previous recorded row of each row, -1 for none
+    latest = np.maximum.accumulate(np.where(recorded, rows, -1), axis=1)
+    previous = np.concatenate(
+        [np.full((values.shape[0], 1), -1), latest[:, :-1]], axis=1
+    )
+    before = np.take_along_axis(values, np.maximum(previous, 0)[:, :, None], axis=1)
+    growth = values - before
+    growth = np.where(growth < 0, values, growth)
+    counted = (recorded & (previous >= 0))[:, :, None]
+    total = np.where(counted, growth, 0.0).sum(axis=(1, 2))
+
+    first = np.argmax(recorded, axis=1)
+    last = values.shape[1] - 1 - np.argmax(recorded[:, ::-1], axis=1)
+    elapsed = (last - first) * step
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(elapsed > 0, total / elapsed, np.nan)
+
+
+class MetricsStore:
+    """
+    In-process history of host and container usage.
+
+    Raw samples are recorded every `resolution` seconds and kept for
+    `retention` seconds. Each of `tiers` ((step, retention) pairs, every step a
+    multiple of the previous one) keeps min/max/avg/last per bucket, rolled up
+    from the tier below for all series at once whenever a bucket closes.
+
+    Every series is a preallocated `MetricSeries`, so memory only depends on
+    the number of series, whatever the activity: per field, 8 bytes per raw row
+    and 32 per rollup row, plus an 8 bytes slot per row.
+
+    With a `directory`, the arrays of each series (all tiers) live in one
+    fixed-layout file mapped in memory: samples are written straight to it,
+    history is read straight from it, and a restart only maps the files again.
+    A file with another layout (tiers changed, ...) is started over.
+    """
+
+    def __init__(
+        self,
+        host: HostSampler,
+        containers: ContainerStatsCollector,
+        resolution: int,
+        retention: int,
+        tiers: List[Tuple[int, int]],
+        directory: str | None = None,
+    ):
+        self.host = host
+        self.containers = containers
+        self.resolution = resolution
+        self.directory = directory
+        self.tiers = [MetricTier(resolution, retention, 1)]
+        for step, tier_retention in tiers:
+            if step % self.tiers[-1].step:
+                raise ValueError(
+                    f"metrics tier step {step} is not a multiple of "
+                    + str(self.tiers[-1].step)
+                )
+            self.tiers.append(MetricTier(step, tier_retention, len(AGGREGATES)))
+
+        self._loop: AbstractEventLoop | None = None
+        # Last closed bucket of each tier
+        self._closed = [-1] * len(self.tiers)
+        self._files: Dict[str, np.memmap] = {}
+        self._task: Task[None] | None = None
+
+    def start(self, keep: Set[str] | None = None):
+        """
+        Map the series files left by a previous run, except those whose ID is
+        not in `keep` (removed containers), which are deleted. Then start
+        recording.
+        """
+        if self._task and not self._task.done():
+            return
+        self._loop = get_running_loop()
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            for name in os.listdir(self.directory):
+                id, extension = os.path.splitext(name)
+                if extension != ".bin":
+                    continue
+                if keep is not None and id not in keep:
+                    os.remove(os.path.join(self.directory, name))
+                else:
+                    self._ensure(id, fields_of(id))
+
+        self._task = create_task(self._run(), name="metrics-recorder")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for file in list(self._files.values()):
+            file.flush()
+
+    def forget(self, id: str):
+        """
+        Drop the series of `id` and delete its file. On the loop only, like
+        everything reading the series or their mapped files.
+        """
+        for tier in self.tiers:
+            tier.series.pop(id, None)
+        if self._files.pop(id, None) is not None and self.directory:
+            try:
+                os.remove(os.path.join(self.directory, f"{id}.bin"))
+            except FileNotFoundError:
+                pass
+
+    def forget_threadsafe(self, id: str):
+        """`forget` from another thread (Docker events), run on the loop."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            # Not recording, nothing iterates the series
+            self.forget(id)
+        else:
+            loop.call_soon_threadsafe(self.forget, id)
+
+    def record(self, id: str, fields: Tuple[str, ...], at: float, values: List[float]):
+        self._ensure(id, fields)
+        self.tiers[0].series[id].put(int(at // self.resolution), [values])
+
+    def _ensure(self, id: str, fields: Tuple[str, ...]):
+        """Create the series of `id` in every tier, mapped to its file if any."""
+        if id in self.tiers[0].series:
+            return
+
+        arrays = self._map(id, fields) if self.directory else None
+        for index, tier in enumerate(self.tiers):
+            tier.series[id] = MetricSeries(
+                tier.capacity,
+                tier.width,
+                fields,
+                *(arrays[index] if arrays else (None, None)),
+            )
+
+    def _map(
+        self, id: str, fields: Tuple[str, ...]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Map the file of a series and return (slots, values) views for each
+        tier. Layout: header, then per tier int64 slots and float64 values.
+        """
+        assert self.directory is not None
+        layout: List[Tuple[int, int, Tuple[int, ...]]] = []
+        offset = HEADER_SIZE
+        for tier in self.tiers:
+            shape = (tier.capacity, tier.width, len(fields))
+            layout.append((offset, offset + tier.capacity * 8, shape))
+            offset += tier.capacity * 8 + int(np.prod(shape)) * 8
+            offset += -offset % 8
+        size = offset
+        fingerprint = zlib.crc32(
+            repr(([(t.step, t.capacity, t.width) for t in self.tiers], fields)).encode()
+        ).to_bytes(8, "little")
+
+        path = os.path.join(self.directory, f"{id}.bin")
+        fresh = True
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            with open(path, "rb") as file:
+                fresh = file.read(HEADER_SIZE) != MAGIC + fingerprint
+        if fresh:
+            with open(path, "wb") as file:
+                file.truncate(size)
+
+        buffer = np.memmap(path, dtype=np.uint8, mode="r+", shape=(size,))
+        self._files[id] = buffer
+        arrays = [
+            (
+                np.ndarray((shape[0],), np.int64, buffer, slots_offset),
+                np.ndarray(shape, DTYPE, buffer, values_offset),
+            )
+            for slots_offset, values_offset, shape in layout
+        ]
+        if fresh:
+            for slots, values in arrays:
+                slots.fill(-1)
+                values.fill(np.nan)
+            buffer[:HEADER_SIZE] = np.frombuffer(MAGIC + fingerprint, dtype=np.uint8)
+        return arrays
+
+    def close_buckets(self, at: float):
+        """
+        Roll up every bucket that ended by `at` and was not yet, finest tier
+        first. The first call only rolls up the latest one: earlier buckets
+        were closed by the previous run, if any. After a pause, buckets whose
+        rows are no longer kept by the tier below are skipped.
+        """
+        for index in range(1, len(self.tiers)):
+            tier, lower = self.tiers[index], self.tiers[index - 1]
+            bucket = int(at // tier.step) - 1
+            if self._closed[index] < 0:
+                first = bucket
+            else:
+                kept = int((at - lower.capacity * lower.step) // tier.step)
+                first = max(self._closed[index] + 1, kept)
+            for pending in range(first, bucket + 1):
+                self._close(index, pending)
+            self._closed[index] = max(self._closed[index], bucket)
+
+    def _close(self, index: int, bucket: int):
+        tier, lower = self.tiers[index], self.tiers[index - 1]
+        per_bucket = tier.step // lower.step
+        first = bucket * per_bucket
+
+        # Series with the same fields (every container, the host) go together
+        groups: Dict[Tuple[str, ...], List[str]] = {}
+        for id, series in list(lower.series.items()):
+            groups.setdefault(series.fields, []).append(id)
+
+        for fields, ids in groups.items():
+            rows = np.stack(
+                [lower.series[id].read(first, first + per_bucket - 1) for id in ids]
+            )
+            for id, values in zip(ids, rollup(rows)):
+                # Forgotten meanwhile by a destroy event
+                series = tier.series.get(id)
+                if series is not None and not np.isnan(values[0, 0]):
+                    series.put(bucket, values)
+
+    @property
+    def span(self) -> int:
+        """Seconds of history kept by the coarsest tier."""
+        return self.tiers[-1].capacity * self.tiers[-1].step
+
+    def step_covering(self, seconds: float) -> int:
+        """Step of the finest tier keeping at least `seconds` of history."""
+        for tier in self.tiers:
+            if tier.capacity * tier.step >= seconds:
+                return tier.step
+        return self.tiers[-1].step
+
+    def tier_for(self, id: str, step: int) -> MetricTier | None:
+        """
+        Coarsest tier with a series for `id` whose step is not above `step`, or
+        the finest one with such a series.
+        """
+        tiers = [tier for tier in self.tiers if id in tier.series]
+        fitting = [tier for tier in tiers if tier.step <= step]
+        if fitting:
+            return fitting[-1]
+        return tiers[0] if tiers else None
+
+    def usage(
+        self, since: float, until: float, fields: Tuple[str, ...], counters: bool
+    ) -> Iterator[Tuple[str, float]]:
+        """
+        Usage of each container over `since` to `until`, from the finest tier
+        covering it: the average of `fields` summed, or with `counters` what
+        they grew by per second between the first and last rows recorded, a
+        counter going down (the container restarted) growing from 0 again.
+        Host and containers without enough rows recorded then are left out.
+
+        Series are reduced `USAGE_CHUNK` at a time, only the wanted columns of
+        one chunk are held at once.
+        """
+        step = self.step_covering(until - since)
+        tier = next(tier for tier in self.tiers if tier.step == step)
+        first = max(
+            int(since // tier.step), int(until // tier.step) - tier.capacity + 1
+        )
+        last = max(int(until // tier.step), first)
+        columns = [CONTAINER_FIELDS.index(field) for field in fields]
+        # Raw rows have a single value, rollups one per aggregate
+        aggregate = (
+            AGGREGATES.index("last" if counters else "avg") if tier.width > 1 else 0
+        )
+        ids = [
+            id
+            for id, series in list(tier.series.items())
+            if series.fields == CONTAINER_FIELDS
+        ]
+
+        for start in range(0, len(ids), USAGE_CHUNK):
+            chunk = ids[start : start + USAGE_CHUNK]
+            # (series, rows, fields), NaN rows where nothing was recorded
+            values = np.stack(
+                [
+                    tier.series[id].read(first, last)[:, aggregate][:, columns]
+                    for id in chunk
+                ]
+            )
+            recorded = ~np.isnan(values[:, :, 0])
+            if counters:
+                usage = _rates(values, recorded, tier.step)
+                enough = recorded.sum(axis=1) >= 2
+            else:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    usage = np.nanmean(values.sum(axis=2), axis=1)
+                enough = recorded.any(axis=1)
+
+            for id, value, kept in zip(chunk, usage.tolist(), enough.tolist()):
+                if kept:
+                    yield id, value
+
+    def history(
+        self, id: str, since: float, until: float, step: int
+    ) -> MetricsHistory | None:
+        """
+        Series of `id` from `since` to `until`, from the coarsest tier that can
+        serve `step` seconds (rounded up to a multiple of that tier's step, at
+        most `span`). None for an unknown `id`.
+        """
+        # A point reads `step` worth of rows, more than everything kept is moot
+        step = min(step, self.span)
+        tier = self.tier_for(id, step)
+        if tier is None:
+            return None
+        series = tier.series[id]
+
+        per_step = max(-(-step // tier.step), 1)
+        step = per_step * tier.step
+        # Older slots were overwritten already
+        oldest = int(until // tier.step) - tier.capacity + 1
+        first = max(int(since // step) * per_step, oldest)
+        first -= first % per_step
+        last = int(until // step) * per_step + per_step - 1
+        if last < first:
+            last = first + per_step - 1
+
+        rows = series.read(first, last)
+        aggregated = rollup(
+            rows.reshape(-1, per_step, tier.width, len(series.fields))
+        )
+
+        # Converted in bulk, numpy scalars are slow one by one. NaN != NaN
+        columns = np.round(aggregated, 4).transpose(2, 1, 0).tolist()
+        start = first * tier.step
+        return MetricsHistory(
+            id=id,
+            start=start,
+            step=step,
+            timestamps=list(range(start, start + len(aggregated) * step, step)),
+            series={
+                field: {
+                    aggregate: [
+                        None if value != value else value
+                        for value in columns[field_index][index]
+                    ]
+                    for index, aggregate in enumerate(AGGREGATES)
+                }
+                for field_index, field in enumerate(series.fields)
+            },
+        )
+
+    def _sample(self):
+        now = time.time()
+        sample = self.host.latest()
+        self.record(
+            HOST, HOST_FIELDS, now, [sample.cpu_percent, float(sample.memory_used)]
+        )
+        for id, stats in self.containers.all().items():
+            self.record(
+                id,
+                CONTAINER_FIELDS,
+                now,
+                [float(getattr(stats, field)) for field in CONTAINER_FIELDS],
+            )
+        self.close_buckets(now)
+
+    async def _run(self):
+        while True:
+            try:
+                self._sample()
+            except Exception:
+                # A bad sample must not stop the recording for good
+                pass
+            # Stay on the slot boundaries, whatever the time spent sampling
+            await sleep(self.resolution - time.time() % self.resolution)
@@ -0,0 +1,108 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+Labels = Mapping[str, str]
+Sample = Tuple[Labels, float]
+
+# Seconds, suited to both quick API calls and slow Docker mutations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items())
+        + "}"
+    )
+
+
+def _number(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(name: str, help: str, type: str, samples: Iterable[Sample]) -> List[str]:
+    """Lines of one metric family in the Prometheus text format."""
+    return [
+        f"# HELP {name} {help}",
+        f"# TYPE {name} {type}",
+        *(f"{name}{_labels(labels)} {_number(value)}" for labels, value in samples),
+    ]
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed `buckets`, one per combination of
+    `labels` values. `observe` is cheap and thread-safe, rendering only reads
+    the counters.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...],
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+
+        self._lock = Lock()
+        # Label values -> (count per bucket, then +Inf), sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, values: Tuple[str, ...], seconds: float):
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][bisect_left(self.buckets, seconds)] += 1
+            series[1][0] += seconds
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {
+                values: (list(counts), total[0])
+                for values, (counts, total) in self._series.items()
+            }
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total) in sorted(series.items()):
+            labels = dict(zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket"
+                    + _labels({**labels, "le": _number(bound)})
+                    + f" {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "sdd_http_request_duration_seconds",
+    "Latency of the backend HTTP requests.",
+    ("method", "route", "status"),
+)
+DOCKER_LATENCY = Histogram(
+    "sdd_docker_request_duration_seconds",
+    "Latency of the Docker Engine API calls, queueing included.",
+    ("method", "operation"),
+)
@@ -0,0 +1,121 @@
+import base64
+import json
+from typing import Any, Callable, Dict, Generic, List, TypeVar
+
+from pydantic import BaseModel, ConfigDict
+
+from lib.errors import InvalidCursor, InvalidSortKey
+
+T = TypeVar("T")
+SortValue = str | int | float
+SortKeys = Dict[str, Callable[[T], SortValue]]
+
+
+class ListQuery(BaseModel):
+    # Sort key, prefixed with "-" for a descending order
+    sort: str | None = None
+    cursor: str | None = None
+    limit: int | None = None
+    # Name prefix
+    name: str | None = None
+    # "key" or "key=value", all of them must match
+    label: List[str] = []
+    # Only used for containers
+    status: List[str] = []
+    image: str | None = None
+
+    def docker_filters(self, name: bool = False) -> Dict[str, Any]:
+        """
+        Filters that the Docker API can evaluate itself. Its `name` filter is a
+        substring match, so it only narrows the result, the prefix is still
+        checked afterward.
+        """
+        filters: Dict[str, Any] = {}
+        if self.label:
+            filters["label"] = self.label
+        if name and self.name:
+            filters["name"] = self.name
+        return filters
+
+
+class Page(BaseModel, Generic[T]):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    items: List[T]
+    total: int
+    next_cursor: str | None = None
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Total-Count": str(self.total),
+            **({"X-Next-Cursor": self.next_cursor} if self.next_cursor else {}),
+        }
+
+
+def _encode_cursor(sort: str, key: tuple[SortValue, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, *key]).encode()).decode()
+
+
+def _decode_cursor(sort: str, cursor: str) -> tuple[SortValue, str]:
+    try:
+        cursor_sort, value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+    except (ValueError, TypeError):
+        raise InvalidCursor()
+
+    if cursor_sort != sort:
+        raise InvalidCursor()
+    return value, id
+
+
+def paginate(
+    items: List[T],
+    query: ListQuery,
+    sort_keys: SortKeys[T],
+    default_sort: str,
+    id: Callable[[T], str],
+) -> Page[T]:
+    """
+    Sort `items` and cut the page that follows `query.cursor`.
+
+    Items are ordered by (sort key, id) so the order is total, and the cursor is
+    the last returned pair: the next page starts right after it even if items
+    were added or removed in between.
+
+    Raises:
+        InvalidSortKey: `query.sort` is not in `sort_keys`
+        InvalidCursor: `query.cursor` is malformed or made for another sort
+    """
+    sort = query.sort or default_sort
+    descending = sort.startswith("-")
+    sort_name = sort.removeprefix("-")
+    if sort_name not in sort_keys:
+        raise InvalidSortKey()
+
+    sort_key = sort_keys[sort_name]
+
+    def key(item: T) -> tuple[SortValue, str]:
+        return sort_key(item), id(item)
+
+    ordered = sorted(items, key=key, reverse=descending)
+    total = len(ordered)
+
+    if query.cursor:
+        after = _decode_cursor(sort, query.cursor)
+        try:
+            ordered = [
+                item
+                for item in ordered
+                if (key(item) < after if descending else key(item) > after)
+            ]
+
+        except TypeError:
+            raise InvalidCursor()
+
+    if query.limit is None or len(ordered) <= query.limit:
+        return Page[T](items=ordered, total=total)
+
+    page = ordered[: query.limit]
+    return Page[T](
+        items=page, total=total, next_cursor=_encode_cursor(sort, key(page[-1]))
+    )
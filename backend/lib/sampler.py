@@ -0,0 +1,66 @@
+import time
+from asyncio import Task, create_task, sleep
+
+import psutil
+from pydantic import BaseModel
+
+
+class HostSample(BaseModel):
+    # time.time() of the sample
+    sampled_at: float
+    cpu_percent: float
+    cpu_count: int
+    memory_used: int
+    memory_total: int
+
+
+class HostSampler:
+    """
+    Sample host CPU and memory usage every `interval` seconds in a background
+    task, so readers get the latest sample at once instead of each blocking
+    on `psutil.cpu_percent(interval=...)`.
+
+    CPU usage is measured over the time elapsed since the previous sample.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+
+        self._sample: HostSample | None = None
+        self._task: Task[None] | None = None
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        # The first non-blocking call only sets the baseline
+        psutil.cpu_percent(interval=None)
+        self._task = create_task(self._run(), name="host-sampler")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def latest(self) -> HostSample:
+        """
+        Latest sample. Before the first one, the current memory with 0% CPU:
+        measuring CPU then would reset psutil's baseline under the sampler.
+        """
+        return self._sample or self._take(cpu=False)
+
+    def _take(self, cpu: bool = True) -> HostSample:
+        memory = psutil.virtual_memory()
+        return HostSample(
+            sampled_at=time.time(),
+            cpu_percent=psutil.cpu_percent(interval=None) if cpu else 0.0,
+            cpu_count=psutil.cpu_count() or 1,
+            memory_used=memory.used,
+            memory_total=memory.total,
+        )
+
+    async def _run(self):
+        # A short first window, so a usable sample is there soon after startup
+        await sleep(min(self.interval, 0.5))
+        while True:
+            self._sample = self._take()
+            await sleep(self.interval)
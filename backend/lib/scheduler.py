@@ -0,0 +1,123 @@
+import time
+from asyncio import Semaphore, get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, TypeVar
+
+from pydantic import BaseModel
+
+from lib.enums import Operation
+from lib.prometheus import DOCKER_LATENCY
+
+T = TypeVar("T")
+
+# Operation class of the slot held by the current task, nested calls reuse it
+_current: ContextVar[Operation | None] = ContextVar("docker_operation", default=None)
+
+
+class OperationStats(BaseModel):
+    limit: int
+    in_flight: int
+    queued: int
+    completed: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+    wait_seconds_avg: float
+
+
+class _OperationQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = Semaphore(limit)
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stats(self) -> OperationStats:
+        return OperationStats(
+            limit=self.limit,
+            in_flight=self.in_flight,
+            queued=self.queued,
+            completed=self.completed,
+            wait_seconds_total=round(self.wait_total, 6),
+            wait_seconds_max=round(self.wait_max, 6),
+            wait_seconds_avg=round(self.wait_total / self.completed, 6)
+            if self.completed
+            else 0.0,
+        )
+
+
+class DockerScheduler:
+    """
+    Bound how many Docker calls of each operation class run at once, so a burst
+    of slow calls (stops, stats, helper containers) cannot starve quick reads.
+
+    Async calls take a slot with `slot`. Blocking docker-py calls go through
+    `run`, which also takes a slot and then uses a dedicated thread pool instead
+    of asyncio's default executor. A call made while its task already holds a
+    slot runs under that slot, so nested calls neither wait twice nor deadlock.
+    """
+
+    def __init__(self, limits: Dict[Operation, int], threads: int):
+        self._queues = {
+            operation: _OperationQueue(limit) for operation, limit in limits.items()
+        }
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="docker-io"
+        )
+
+    @asynccontextmanager
+    async def slot(self, operation: Operation) -> AsyncIterator[None]:
+        if _current.get() is not None:
+            yield
+            return
+
+        queue = self._queues[operation]
+        queue.queued += 1
+        start = time.perf_counter()
+        try:
+            await queue.semaphore.acquire()
+        finally:
+            queue.queued -= 1
+
+        waited = time.perf_counter() - start
+        queue.in_flight += 1
+        token = _current.set(operation)
+        try:
+            yield
+
+        finally:
+            _current.reset(token)
+            queue.in_flight -= 1
+            queue.completed += 1
+            queue.wait_total += waited
+            queue.wait_max = max(queue.wait_max, waited)
+            queue.semaphore.release()
+
+    async def run(
+        self, operation: Operation, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        start = time.perf_counter()
+        try:
+            async with self.slot(operation):
+                return await get_running_loop().run_in_executor(
+                    self._executor, partial(func, *args, **kwargs)
+                )
+
+        finally:
+            # docker-py calls, no HTTP method to tell them apart
+            DOCKER_LATENCY.observe(
+                ("SDK", operation.value), time.perf_counter() - start
+            )
+
+    def stats(self) -> Dict[str, OperationStats]:
+        return {
+            operation.value: queue.stats() for operation, queue in self._queues.items()
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,89 @@
+import time
+from asyncio import (
+    AbstractEventLoop,
+    Task,
+    create_task,
+    current_task,
+    get_running_loop,
+    shield,
+)
+from typing import Any, Awaitable, Callable, Dict, Hashable, Mapping, Tuple, TypeVar
+
+T = TypeVar("T")
+FlightKey = Tuple[str, Hashable]
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent reads: callers asking for the same operation
+    and key while a call is in flight await that call and share its result,
+    instead of each sending the same query to the daemon.
+
+    With a TTL for its operation (`ttls`, in seconds), a result is also served
+    for that long after the call ends. `forget` drops an operation's in-flight
+    call and cached results, e.g. when a Docker event makes them outdated;
+    `forget_threadsafe` does it from another thread, on the loop of the calls.
+
+    Results are shared between callers, they must not be mutated.
+    """
+
+    def __init__(self, ttls: Mapping[str, float] = {}):
+        self.ttls = ttls
+
+        self._loop: AbstractEventLoop | None = None
+        self._flights: Dict[FlightKey, Task[Any]] = {}
+        self._results: Dict[FlightKey, Tuple[float, Any]] = {}
+
+    async def do(
+        self, operation: str, key: Hashable, func: Callable[[], Awaitable[T]]
+    ) -> T:
+        self._loop = get_running_loop()
+        flight_key = (operation, key)
+        cached = self._results.get(flight_key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        task = self._flights.get(flight_key)
+        if task is None:
+            task = create_task(self._run(flight_key, func))
+            # Nobody may be left to retrieve it if every caller got cancelled
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self._flights[flight_key] = task
+
+        # A cancelled caller must not cancel the call for the other ones
+        return await shield(task)
+
+    def forget(self, operation: str):
+        for flights in (self._flights, self._results):
+            for flight_key in [key for key in list(flights) if key[0] == operation]:
+                flights.pop(flight_key, None)
+
+    def forget_threadsafe(self, operation: str):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            # No call was ever made, or none can run anymore
+            self.forget(operation)
+        else:
+            loop.call_soon_threadsafe(self.forget, operation)
+
+    async def _run(self, flight_key: FlightKey, func: Callable[[], Awaitable[T]]) -> T:
+        try:
+            result = await func()
+
+        finally:
+            # False when `forget` was called meanwhile, the result may be outdated
+            current = self._flights.get(flight_key) is current_task()
+            if current:
+                self._flights.pop(flight_key, None)
+
+        ttl = self.ttls.get(flight_key[0], 0)
+        if current and ttl > 0:
+            now = time.monotonic()
+            for expired in [
+                key
+                for key, (expires, _) in list(self._results.items())
+                if expires <= now
+            ]:
+                self._results.pop(expired, None)
+            self._results[flight_key] = (now + ttl, result)
+        return result
@@ -0,0 +1,253 @@
+import logging
+import time
+from asyncio import (
+    AbstractEventLoop,
+    Task,
+    create_task,
+    current_task,
+    get_running_loop,
+    sleep,
+)
+from typing import TYPE_CHECKING, Any, Callable, Dict, List
+
+import psutil
+from docker.errors import NotFound
+from pydantic import BaseModel
+
+from lib.engine import AsyncDockerClient
+from lib.events import DockerEvent, DockerEventWatcher
+from lib.inventory import RUNNING, ContainerInventory
+
+if TYPE_CHECKING:
+    from lib.cgroup import CgroupReader
+
+logger = logging.getLogger(__name__)
+
+# Container events after which it has started or stopped running
+FOLLOW_ACTIONS = ("start", "restart", "unpause")
+UNFOLLOW_ACTIONS = ("die", "destroy")
+
+# Called on the event loop with the container ID and each new reading
+SampleListener = Callable[[str, "ContainerStats"], None]
+
+
+class ContainerStats(BaseModel):
+    # time.time() of the reading
+    read_at: float
+    cpu_percent: float
+    # Bytes
+    memory_usage: int
+    memory_limit: int
+    network_rx: int
+    network_tx: int
+    block_read: int
+    block_write: int
+
+
+def parse_stats(stats: Dict[str, Any]) -> ContainerStats:
+    """Decode a stats frame of the Docker API, missing values count as 0."""
+    memory_stats: Dict[str, Any] = stats.get("memory_stats") or {}
+    cpu_stats: Dict[str, Any] = stats.get("cpu_stats") or {}
+    precpu_stats: Dict[str, Any] = stats.get("precpu_stats") or {}
+
+    cpu_percent = 0.0
+    if (
+        "total_usage" in (cpu_stats.get("cpu_usage") or {})
+        and "total_usage" in (precpu_stats.get("cpu_usage") or {})
+        and "system_cpu_usage" in cpu_stats
+        and "system_cpu_usage" in precpu_stats
+    ):
+        cpu_delta = float(cpu_stats["cpu_usage"]["total_usage"]) - float(
+            precpu_stats["cpu_usage"]["total_usage"]
+        )
+        system_delta = float(cpu_stats["system_cpu_usage"]) - float(
+            precpu_stats["system_cpu_usage"]
+        )
+        online_cpus = float(cpu_stats.get("online_cpus") or psutil.cpu_count() or 1)
+        if system_delta > 0 and cpu_delta >= 0:
+            cpu_percent = (cpu_delta / system_delta) * online_cpus * 100.0
+
+    networks: Dict[str, Dict[str, Any]] = stats.get("networks") or {}
+    block_io: List[Dict[str, Any]] = (stats.get("blkio_stats") or {}).get(
+        "io_service_bytes_recursive"
+    ) or []
+
+    def block_bytes(op: str) -> int:
+        return sum(
+            int(entry.get("value") or 0)
+            for entry in block_io
+            if str(entry.get("op", "")).lower() == op
+        )
+
+    return ContainerStats(
+        read_at=time.time(),
+        cpu_percent=cpu_percent,
+        memory_usage=int(memory_stats.get("usage") or 0),
+        memory_limit=int(memory_stats.get("limit") or 0),
+        network_rx=sum(int(n.get("rx_bytes") or 0) for n in networks.values()),
+        network_tx=sum(int(n.get("tx_bytes") or 0) for n in networks.values()),
+        block_read=block_bytes("read"),
+        block_write=block_bytes("write"),
+    )
+
+
+class ContainerStatsCollector:
+    """
+    Keep one streaming stats request open per running container and the latest
+    decoded reading of each in memory, so usage reads never wait on the daemon.
+
+    Collectors are started and stopped by container events, and reconciled with
+    the running containers whenever the events stream (re)connects.
+
+    With `cgroups`, containers whose cgroup files are readable are polled from
+    them every `interval` seconds instead, without any daemon call.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncDockerClient,
+        inventory: ContainerInventory,
+        watcher: DockerEventWatcher,
+        cgroups: "CgroupReader | None" = None,
+        interval: float = 1.0,
+        retry_delay: float = 1.0,
+    ):
+        self.engine = engine
+        self.inventory = inventory
+        self.cgroups = cgroups if cgroups is not None and cgroups.enabled else None
+        self.interval = interval
+        self.retry_delay = retry_delay
+
+        self._loop: AbstractEventLoop | None = None
+        self._tasks: Dict[str, Task[None]] = {}
+        self._latest: Dict[str, ContainerStats] = {}
+        self._listeners: List[SampleListener] = []
+
+        watcher.on("container", self._apply)
+        watcher.on_connect(self._reconnected)
+
+    def start(self):
+        self._loop = get_running_loop()
+        create_task(self.reconcile())
+
+    async def stop(self):
+        self._loop = None
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self._tasks = {}
+        self._latest = {}
+
+    def on_sample(self, listener: SampleListener):
+        self._listeners.append(listener)
+
+    def get(self, id: str) -> ContainerStats | None:
+        """Latest reading of a container by its full ID, None if not running."""
+        return self._latest.get(id)
+
+    def all(self) -> Dict[str, ContainerStats]:
+        return dict(self._latest)
+
+    async def reconcile(self):
+        running = {
+            container.id or container.short_id
+            for container in await self.inventory.list(all=False)
+        }
+        for id in running - set(self._tasks):
+            self._follow(id)
+        for id in set(self._tasks) - running:
+            self._unfollow(id)
+
+    def _apply(self, event: DockerEvent):
+        # Called from the watcher thread
+        loop = self._loop
+        action: str = event.get("Action", "")
+        id: str = event.get("Actor", {}).get("ID", "") or event.get("id", "")
+        if loop is None or not id:
+            return
+
+        if action in FOLLOW_ACTIONS:
+            loop.call_soon_threadsafe(self._follow, id)
+        elif action in UNFOLLOW_ACTIONS:
+            loop.call_soon_threadsafe(self._unfollow, id)
+
+    def _reconnected(self):
+        # Called from the watcher thread, starts or stops may have been missed
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(lambda: create_task(self.reconcile()))
+
+    def _follow(self, id: str):
+        if id not in self._tasks:
+            self._tasks[id] = create_task(self._collect(id), name=f"stats-{id[:12]}")
+
+    def _unfollow(self, id: str):
+        task = self._tasks.pop(id, None)
+        if task is not None:
+            task.cancel()
+        self._latest.pop(id, None)
+
+    async def _collect(self, id: str):
+        try:
+            while True:
+                if self.cgroups is not None and self.cgroups.locate(id):
+                    await self._poll_cgroup(id)
+                else:
+                    await self._stream(id)
+
+                # Both also end when the container stops
+                try:
+                    container = await self.inventory.get(id)
+                except NotFound:
+                    return
+                if container.status not in RUNNING:
+                    return
+
+                await sleep(self.retry_delay)
+
+        except NotFound:
+            return
+
+        finally:
+            if self._tasks.get(id) is current_task():
+                self._tasks.pop(id, None)
+                self._latest.pop(id, None)
+            if self.cgroups is not None:
+                self.cgroups.forget(id)
+
+    async def _stream(self, id: str):
+        try:
+            async for frame in self.engine.stream_json(
+                f"/containers/{id}/stats", {"stream": True}
+            ):
+                self._update(id, parse_stats(frame))
+
+        except NotFound:
+            raise
+
+        except Exception:
+            pass
+
+    async def _poll_cgroup(self, id: str):
+        assert self.cgroups is not None
+        # Network counters are read from the container's network namespace
+        pid = (await self.inventory.inspect(id)).get("State", {}).get("Pid") or None
+        # The first reading has no CPU usage yet (0%), it is only the baseline
+        baseline = True
+        while True:
+            stats = self.cgroups.read(id, pid)
+            if stats is None:
+                return
+            if not baseline:
+                self._update(id, stats)
+            baseline = False
+            await sleep(self.interval)
+
+    def _update(self, id: str, stats: ContainerStats):
+        self._latest[id] = stats
+        for listener in self._listeners:
+            try:
+                listener(id, stats)
+
+            except Exception:
+                # A broken listener must not stop the readings for everyone else
+                logger.exception("stats listener failed on container %s", id[:12])
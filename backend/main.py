@@ -1,30 +1,63 @@
 import os
-from asyncio import to_thread
+import time
 from contextlib import asynccontextmanager
 
 from docker.errors import APIError
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from lib.db import ensure_default
-from lib.docker import client, get_images
+from lib.docker import (
+    alerts,
+    client,
+    container_stats,
+    engine,
+    feed,
+    get_images,
+    host,
+    logs,
+    metrics,
+    scheduler,
+    start_alerts,
+    start_metrics,
+    watcher,
+)
+from lib.enums import Operation
+from lib.prometheus import REQUEST_LATENCY
 from lib.response import MISSING_PERMISSION, USER_NOT_FOUND
-from routes import docker_router, role_router, user_router
+from routes import docker_router, metrics_router, role_router, user_router
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     ensure_default()
-    images = await get_images()
+    images = (await get_images()).items
     try:
         if all([image.tags[0] != "busybox" for image in images if len(image.tags)]):
-            await to_thread(client.images.pull, "busybox")
+            await scheduler.run(Operation.SlowMutation, client.images.pull, "busybox")
         if all([image.tags[0] != "javieraviles/zip" for image in images  if len(image.tags)]):
-            await to_thread(client.images.pull, "javieraviles/zip")
+            await scheduler.run(
+                Operation.SlowMutation, client.images.pull, "javieraviles/zip"
+            )
     except APIError:
         pass
     os.makedirs('temp/', exist_ok=True)
+    host.start()
+    feed.start()
+    watcher.start()
+    container_stats.start()
+    await start_metrics()
+    start_alerts()
     yield
+    alerts.stop()
+    await logs.stop()
+    await metrics.stop()
+    await container_stats.stop()
+    watcher.stop()
+    await feed.stop()
+    await host.stop()
+    await engine.close()
+    scheduler.shutdown()
 
 
 app = FastAPI(
@@ -42,9 +75,33 @@ app = FastAPI(
 )
 
 app.include_router(docker_router)
+app.include_router(metrics_router)
 app.include_router(role_router)
 app.include_router(user_router)
 
+
+@app.middleware("http")
+async def observe_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+
+    finally:
+        # The route template, so that IDs in paths do not make new series
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(
+            (
+                request.method,
+                getattr(route, "path", "unmatched"),
+                str(status),
+            ),
+            time.perf_counter() - start,
+        )
+
+
 origins = ["*"]
 app.add_middleware(
     CORSMiddleware,
@@ -52,4 +109,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag"],
 )
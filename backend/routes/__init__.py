@@ -1,9 +1,11 @@
 from .docker import router as docker_router
+from .metrics import router as metrics_router
 from .role import router as role_router
 from .user import router as user_router
 
 __all__ = [
     "docker_router",
+    "metrics_router",
     "role_router",
     "user_router",
 ]
\ No newline at end of file
@@ -1,5 +1,7 @@
+import hashlib
+import json
 import traceback
-from asyncio import to_thread
+from asyncio import create_task, sleep, to_thread
 from queue import Empty, Queue
 from typing import Annotated, Any, Awaitable, Callable, TypeVar, Union, cast
 
@@ -9,16 +11,30 @@ from fastapi import (
     Depends,
     HTTPException,
     Query,
+    Request,
     WebSocket,
     WebSocketDisconnect,
     WebSocketException,
     status,
 )
-from fastapi.responses import JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.websockets import WebSocketState
 
-from lib.db import User
+from lib.alerts import Alert
+from lib.db import (
+    APIAlertRule,
+    DBAlertRule,
+    User,
+    get_alert_rules,
+    user_has_permission,
+)
+from lib.dependency import list_query_deps
 from lib.docker import (
+    METRICS_SPAN,
+    BulkActionResult,
+    BulkContainerAction,
+    ConsumerMetric,
     ContainerPruneResponse,
     DirEntry,
     FormattedContainer,
@@ -26,15 +42,22 @@ from lib.docker import (
     FormattedNetwork,
     FormattedVolume,
     ImagePruneResponse,
+    ResourceConsumer,
+    ResourceGroup,
     ResourceUsage,
     ResourceUsages,
     VolumePruneResponse,
+    bulk_container_action,
     connect_container,
     container_cat,
     container_download,
     container_ls,
+    container_version,
+    containers_version,
+    create_alert_rule,
     disconnect_container,
     docker_logs_stream,
+    get_alerts,
     get_container,
     get_container_raw,
     get_containers,
@@ -44,40 +67,59 @@ from lib.docker import (
     get_images,
     get_network,
     get_networks,
+    get_resource_history,
     get_resource_usage,
     get_resource_usages,
     get_volume,
     get_volumes,
+    group_resource_usage,
+    images_version,
     inspect_container,
     kill_container,
+    live_resource_usage,
     prune_container,
     prune_images,
     prune_network,
     prune_volumes,
+    remove_alert_rule,
     remove_container,
     remove_image,
     remove_network,
     remove_volume,
     rename_container,
+    resolve_container_ids,
     restart_container,
+    scheduler,
     start_container,
     stop_container,
+    subscribe_alerts,
+    subscribe_changes,
+    top_consumers,
     top_container,
     volume_cat,
     volume_download,
     volume_ls,
 )
-from lib.enums import Permission
+from lib.enums import ContainerAction, Permission
+from lib.env import BULK_PARALLELISM
 from lib.errors import (
+    AlertRuleNotFound,
     CommandNotFound,
     ContainerNotFound,
     ImageNotFound,
+    InvalidCursor,
     InvalidPath,
+    InvalidSortKey,
     NetworkNotFound,
     TerminalNotFound,
     VolumeNotFound,
 )
+from lib.feed import FeedResource
+from lib.loghub import encode_lines, read_batch
+from lib.metrics import MetricsHistory
+from lib.query import ListQuery
 from lib.response import HTTP_EXECEPTION_MESSAGE, MESSAGE_OK
+from lib.scheduler import OperationStats
 from lib.security import (
     check_user_has_permission,
     get_user_from_token,
@@ -108,6 +150,74 @@ async def raise_if_api_error(
         )
 
 
+async def raise_if_invalid_query(
+    func: Callable[..., Awaitable[T]], *args: ..., **kwargs: ...
+) -> T:
+    try:
+        return await raise_if_api_error(func, *args, **kwargs)
+
+    except InvalidSortKey:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "invalid sort key"},
+        )
+
+    except InvalidCursor:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "invalid cursor"},
+        )
+
+
+# Let browsers keep the body but revalidate it on every request
+CONDITIONAL_HEADERS = {"Cache-Control": "private, no-cache"}
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+
+    return if_none_match.strip() == "*" or etag in [
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    ]
+
+
+def not_modified(request: Request, version: str | None) -> Response | None:
+    """304 response if the client already has `version`, checked before any work."""
+    if version is None or not etag_matches(request, f'"{version}"'):
+        return None
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={**CONDITIONAL_HEADERS, "ETag": f'"{version}"'},
+    )
+
+
+def conditional_response(
+    request: Request,
+    content: Any,
+    version: str | None = None,
+    headers: dict[str, str] = {},
+) -> Response:
+    """
+    JSON response tagged with `version`, or with a hash of the body when the
+    caller has no cheaper version. A client that already has it gets a 304.
+    """
+    body = json.dumps(jsonable_encoder(content)).encode()
+    etag = f'"{version or hashlib.sha1(body).hexdigest()}"'
+    if etag_matches(request, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={**CONDITIONAL_HEADERS, "ETag": etag},
+        )
+
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={**headers, **CONDITIONAL_HEADERS, "ETag": etag},
+    )
+
+
 def HTTP_NOT_FOUND_WITH_ID(message: str):
     return HTTP_EXECEPTION_MESSAGE(
         message, ({"id": {"type": "string"}}, {"id": "string"})
@@ -172,18 +282,30 @@ async def container_raise_if_invalid(
 )
 async def get_containers_api(
     user: Annotated[User, Depends(get_user_from_token)],
+    request: Request,
+    query: Annotated[ListQuery, Depends(list_query_deps)],
     show_all: bool = False,
     raw: bool = False,
+    refresh: bool = False,
+    state: Annotated[list[str] | None, Query(alias="status")] = None,
+    image: str | None = None,
 ):
+    query = query.model_copy(update={"status": state or [], "image": image})
     if raw:
         check_user_has_permission(user, [Permission.SeeContainerRaw])
-        return JSONResponse(
-            [
-                container.attrs
-                for container in await raise_if_api_error(get_containers_raw)
-            ]
+
+    version = await raise_if_api_error(containers_version, refresh=refresh)
+    if response := not_modified(request, version):
+        return response
+
+    page = (
+        await raise_if_invalid_query(get_containers_raw, refresh=False, query=query)
+        if raw
+        else await raise_if_invalid_query(
+            get_containers, show_all, refresh=False, query=query
         )
-    return await raise_if_api_error(get_containers, show_all)
+    )
+    return conditional_response(request, page.items, version, page.headers())
 
 
 @container_router.get(
@@ -193,12 +315,15 @@ async def get_containers_api(
     responses={200: {"model": FormattedContainer}},
 )
 async def get_container_api(
-    user: Annotated[User, Depends(get_user_from_token)], id: str, raw: bool = False
+    user: Annotated[User, Depends(get_user_from_token)],
+    id: str,
+    raw: bool = False,
+    refresh: bool = False,
 ):
     if raw:
         check_user_has_permission(user, [Permission.SeeContainerRaw])
     return await container_raise_if_not_found(
-        get_container if not raw else get_container_raw, id=id
+        get_container if not raw else get_container_raw, id=id, refresh=refresh
     )
 
 
@@ -208,8 +333,16 @@ async def get_container_api(
     dependencies=[Depends(token_has_permission([Permission.InspectContainer]))],
     responses={200: {"model": dict[str, Any]}},
 )
-async def inspect_container_api(id: str):
-    return await container_raise_if_not_found(inspect_container, id=id)
+async def inspect_container_api(request: Request, id: str, refresh: bool = False):
+    version = await container_raise_if_not_found(
+        container_version, id=id, refresh=refresh
+    )
+    if response := not_modified(request, version):
+        return response
+
+    return conditional_response(
+        request, await container_raise_if_not_found(inspect_container, id=id), version
+    )
 
 
 @container_router.get(
@@ -329,6 +462,45 @@ async def remove_container_api(id: str):
     return JSONResponse({"message": "ok"})
 
 
+CONTAINER_ACTION_PERMISSIONS = {
+    ContainerAction.Start: Permission.StartContainer,
+    ContainerAction.Stop: Permission.StopContainer,
+    ContainerAction.Restart: Permission.RestartContainer,
+    ContainerAction.Kill: Permission.KillContainer,
+    ContainerAction.Remove: Permission.RemoveContainer,
+}
+
+
+@container_router.post(
+    "s/bulk",
+    description="Start, stop, restart, kill or remove many containers by ID, "
+    + "Short ID or Name at once. Results come in the order of `ids`, or as "
+    + "NDJSON lines as soon as each one is done when `stream` is set (or "
+    + "`application/x-ndjson` is accepted).",
+    responses={200: {"model": list[BulkActionResult]}},
+)
+async def bulk_container_api(
+    user: Annotated[User, Depends(get_user_from_token)],
+    request: Request,
+    body: BulkContainerAction,
+    parallelism: Annotated[int | None, Query(ge=1)] = None,
+    stream: bool = False,
+):
+    check_user_has_permission(user, [CONTAINER_ACTION_PERMISSIONS[body.action]])
+
+    results = bulk_container_action(
+        body.ids, body.action, min(parallelism or BULK_PARALLELISM, BULK_PARALLELISM)
+    )
+    if stream or "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            (result.model_dump_json() + "\n" async for result in results),
+            media_type="application/x-ndjson",
+        )
+
+    by_id = {result.id: result async for result in results}
+    return [by_id[id] for id in dict.fromkeys(body.ids)]
+
+
 @container_router.delete(
     "/prune",
     description="Prune container",
@@ -345,37 +517,47 @@ async def get_container_logs_api(
     id: Annotated[str, Query()],
     token: Annotated[str, Query()],
     tail: Annotated[int | None, Query()] = None,
+    batch: Annotated[int, Query(ge=0, le=10000)] = 0,
+    batch_bytes: Annotated[int, Query(ge=1024, le=4 * 1024 * 1024)] = 64 * 1024,
+    binary: bool = False,
 ):
+    # One text message per line by default. With `batch` (ms), lines are sent
+    # together every `batch` ms or `batch_bytes`, as one text message or, with
+    # `binary`, one binary message of length-prefixed lines (see `encode_lines`)
     check_user_has_permission(get_user_from_token(token), [Permission.SeeLogs])
 
-    log_queue, log_stream = await container_raise_if_not_found(
+    subscription = await container_raise_if_not_found(
         docker_logs_stream, id, tail=tail
     )
 
     await ws.accept()
     try:
-        while ws.application_state == WebSocketState.CONNECTING:
-            ...
-
-        while ws.application_state == WebSocketState.CONNECTED:
-            try:
-                log = await to_thread(log_queue.get, timeout=1)
-            except Empty:
-                await ws.send_text("SimpleDockerDashboard_Ping")
-                continue
-
-            if log:
-                if log == "SimpleDockerDashboard_EOL":
-                    log_stream.close()
-                    break
+        async with subscription as log_queue:
+            ended = False
+            while not ended and ws.application_state == WebSocketState.CONNECTED:
+                try:
+                    lines, ended = await read_batch(
+                        log_queue, 1, batch / 1000, batch_bytes if batch else 0
+                    )
+                except TimeoutError:
+                    await ws.send_text("SimpleDockerDashboard_Ping")
+                    continue
 
-                await ws.send_text(log)
+                if not lines:
+                    continue
+                if not batch:
+                    for line in lines:
+                        if line:
+                            await ws.send_text(line)
+                elif binary:
+                    await ws.send_bytes(encode_lines(lines))
+                else:
+                    await ws.send_text("".join(lines))
 
-        log_stream.close()
         await ws.close()
 
     except (WebSocketDisconnect, WebSocketException):
-        log_stream.close()
+        pass
 
 
 @container_router.websocket("/exec")
@@ -458,6 +640,98 @@ async def get_resource(id: str | None = None):
         return await container_raise_if_not_found(get_resource_usage, id=id)
 
 
+@container_router.websocket("/resource")
+async def resource_ws_api(
+    ws: WebSocket,
+    token: Annotated[str, Query()],
+    ids: str = "all",
+    interval: Annotated[float, Query(ge=0.5, le=60)] = 2,
+):
+    # Pushes `LiveResourceUsage` every `interval` seconds for `ids` (comma
+    # separated IDs or names) or "all", `{"ids": ..., "interval": ...}` changes them
+    check_user_has_permission(get_user_from_token(token), [Permission.Resource])
+
+    async def follow(ids: str) -> list[str] | None:
+        return None if ids == "all" else await resolve_container_ids(ids.split(","))
+
+    watched: dict[str, Any] = {"ids": await follow(ids), "interval": interval}
+
+    await ws.accept()
+
+    async def send():
+        while True:
+            usage = await live_resource_usage(watched["ids"])
+            await ws.send_json(jsonable_encoder(usage))
+            await sleep(watched["interval"])
+
+    sender = create_task(send())
+    try:
+        while not sender.done():
+            try:
+                message = json.loads(await ws.receive_text())
+            except ValueError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            if isinstance(message.get("ids"), str):
+                watched["ids"] = await follow(message["ids"])
+            if isinstance(message.get("interval"), (int, float)):
+                watched["interval"] = min(max(float(message["interval"]), 0.5), 60)
+
+    except (WebSocketDisconnect, WebSocketException):
+        pass
+
+    finally:
+        sender.cancel()
+
+
+@container_router.get(
+    "/resource/history",
+    description="Get recorded resource usage of a container, or of the host without "
+    + "`id`, since `since` (epoch seconds, default one hour ago), as "
+    + "min/max/avg/last over `step` seconds (at most the history kept)",
+    dependencies=[Depends(token_has_permission([Permission.Resource]))],
+    responses={200: {"model": MetricsHistory}, **CONTAINER_NOT_FOUND},
+)
+async def get_resource_history_api(
+    id: str | None = None,
+    since: Annotated[float | None, Query(ge=0, allow_inf_nan=False)] = None,
+    step: Annotated[int | None, Query(ge=1, le=METRICS_SPAN)] = None,
+):
+    return await container_raise_if_not_found(
+        get_resource_history, id=id, since=since, step=step
+    )
+
+
+@container_router.get(
+    "/resource/groups",
+    description="Get CPU (percent) and memory (GB) of the running containers summed "
+    + "per value of the `by` label, `project` and `service` standing for the Docker "
+    + "Compose ones. Containers without that label are grouped under a null value",
+    dependencies=[Depends(token_has_permission([Permission.Resource]))],
+    responses={200: {"model": list[ResourceGroup]}},
+)
+async def get_resource_groups_api(by: str = "project"):
+    return group_resource_usage(by)
+
+
+@container_router.get(
+    "/resource/top",
+    description="Get the `limit` containers using the most CPU (percent), memory "
+    + "(bytes), network or block IO (bytes per second), averaged over the last "
+    + "`window` seconds (at most the history kept). A 0 window uses the latest "
+    + "readings, network and block IO are then bytes since start",
+    dependencies=[Depends(token_has_permission([Permission.Resource]))],
+    responses={200: {"model": list[ResourceConsumer]}},
+)
+async def get_top_consumers_api(
+    by: ConsumerMetric = "cpu",
+    limit: Annotated[int, Query(ge=1, le=1000)] = 10,
+    window: Annotated[int, Query(ge=0, le=METRICS_SPAN)] = 60,
+):
+    return top_consumers(by, limit, window)
+
+
 """
 IMAGE
 """
@@ -490,8 +764,15 @@ async def image_raise_if_not_found(
     dependencies=[Depends(token_has_permission([Permission.SeeImages]))],
     responses={200: {"model": list[FormattedImage]}},
 )
-async def get_images_api():
-    return await raise_if_api_error(get_images)
+async def get_images_api(
+    request: Request, query: Annotated[ListQuery, Depends(list_query_deps)]
+):
+    version = images_version()
+    if response := not_modified(request, version):
+        return response
+
+    page = await raise_if_invalid_query(get_images, query)
+    return conditional_response(request, page.items, version, page.headers())
 
 
 @image_router.get(
@@ -581,8 +862,11 @@ async def volume_raise_if_invalid(
     dependencies=[Depends(token_has_permission([Permission.SeeVolumes]))],
     responses={200: {"model": list[FormattedVolume]}},
 )
-async def get_volumes_api():
-    return await get_volumes()
+async def get_volumes_api(
+    request: Request, query: Annotated[ListQuery, Depends(list_query_deps)]
+):
+    page = await raise_if_invalid_query(get_volumes, query)
+    return conditional_response(request, page.items, headers=page.headers())
 
 
 @volume_router.get(
@@ -680,8 +964,11 @@ async def network_raise_if_not_found(
     dependencies=[Depends(token_has_permission([Permission.SeeNetworks]))],
     responses={200: {"model": list[FormattedNetwork]}},
 )
-async def get_networks_api():
-    return await get_networks()
+async def get_networks_api(
+    request: Request, query: Annotated[ListQuery, Depends(list_query_deps)]
+):
+    page = await raise_if_invalid_query(get_networks, query)
+    return conditional_response(request, page.items, headers=page.headers())
 
 
 @network_router.get(
@@ -764,6 +1051,172 @@ async def prune_network_api():
     return JSONResponse({"message": "ok"})
 
 
+"""
+CHANGES
+"""
+
+FEED_PERMISSIONS: dict[FeedResource, Permission] = {
+    "containers": Permission.SeeContainers,
+    "images": Permission.SeeImages,
+    "volumes": Permission.SeeVolumes,
+    "networks": Permission.SeeNetworks,
+}
+
+
+def feed_resources(token: str) -> list[FeedResource]:
+    """Resources the token owner may follow, at least one of them."""
+    user = get_user_from_token(token)
+    resources = [
+        resource
+        for resource, permission in FEED_PERMISSIONS.items()
+        if user_has_permission(user, [permission])
+    ]
+    if not resources:
+        check_user_has_permission(user, list(FEED_PERMISSIONS.values()))
+    return resources
+
+
+@router.websocket("/changes")
+async def changes_ws_api(ws: WebSocket, token: Annotated[str, Query()]):
+    resources = feed_resources(token)
+
+    await ws.accept()
+
+    async def send():
+        async for delta in subscribe_changes(resources):
+            await ws.send_json(jsonable_encoder(delta))
+
+    sender = create_task(send())
+    try:
+        # Nothing is expected from the client, this only notices it leaving
+        while not sender.done():
+            await ws.receive_text()
+
+    except (WebSocketDisconnect, WebSocketException):
+        pass
+
+    finally:
+        sender.cancel()
+
+
+@router.get(
+    "/changes",
+    description="Server-sent events: a snapshot of containers, images, volumes and "
+    + "networks (those the token allows), then add/update/remove deltas as they "
+    + "happen. A new snapshot is sent whenever some deltas were missed.",
+)
+async def changes_sse_api(token: Annotated[str, Query()]):
+    resources = feed_resources(token)
+
+    async def events():
+        async for delta in subscribe_changes(resources):
+            yield f"data: {json.dumps(jsonable_encoder(delta))}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+"""
+ALERTS
+"""
+
+ALERT_RULE_NOT_FOUND = {404: HTTP_NOT_FOUND_WITH_ID("alert rule not found")}
+
+
+@router.get(
+    "/alerts",
+    description="Get firing alerts, then the latest resolved ones, most recent first",
+    dependencies=[Depends(token_has_permission([Permission.Resource]))],
+    responses={200: {"model": list[Alert]}},
+)
+async def get_alerts_api():
+    return get_alerts()
+
+
+@router.websocket("/alerts")
+async def alerts_ws_api(ws: WebSocket, token: Annotated[str, Query()]):
+    check_user_has_permission(get_user_from_token(token), [Permission.Resource])
+
+    await ws.accept()
+
+    async def send():
+        async for message in subscribe_alerts():
+            await ws.send_json(jsonable_encoder(message))
+
+    sender = create_task(send())
+    try:
+        # Nothing is expected from the client, this only notices it leaving
+        while not sender.done():
+            await ws.receive_text()
+
+    except (WebSocketDisconnect, WebSocketException):
+        pass
+
+    finally:
+        sender.cancel()
+
+
+@router.get(
+    "/alert/rules",
+    description="Get alert rules",
+    dependencies=[Depends(token_has_permission([Permission.Resource]))],
+    responses={200: {"model": list[DBAlertRule]}},
+)
+async def get_alert_rules_api():
+    return get_alert_rules()
+
+
+@router.post(
+    "/alert/rules",
+    description="Add an alert rule: `metric` above `threshold` for `duration` "
+    + "seconds (restarts: more than `threshold` starts within `duration` seconds), "
+    + "for containers matching `container` (ID prefix or name pattern) and `label` "
+    + "(key or key=value)",
+    dependencies=[Depends(token_has_permission([Permission.Administrator]))],
+    responses={200: {"model": DBAlertRule}},
+)
+async def create_alert_rule_api(rule: APIAlertRule):
+    return create_alert_rule(rule)
+
+
+@router.delete(
+    "/alert/rules",
+    description="Delete an alert rule, its firing alerts are resolved",
+    dependencies=[Depends(token_has_permission([Permission.Administrator]))],
+    responses={200: MESSAGE_OK(), **ALERT_RULE_NOT_FOUND},
+)
+async def delete_alert_rule_api(id: str):
+    try:
+        remove_alert_rule(id)
+
+    except AlertRuleNotFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={"message": "alert rule not found", "id": id},
+        )
+
+    return JSONResponse({"message": "ok"})
+
+
+"""
+SCHEDULER
+"""
+
+
+@router.get(
+    "/scheduler",
+    description="Get limits, queue depth and wait times of Docker calls by operation "
+    + "class",
+    dependencies=[Depends(token_has_permission([Permission.Administrator]))],
+    responses={200: {"model": dict[str, OperationStats]}},
+)
+async def get_scheduler_api():
+    return scheduler.stats()
+
+
 router.include_router(container_router)
 router.include_router(image_router)
 router.include_router(volume_router)
@@ -0,0 +1,31 @@
+import hmac
+from typing import Annotated
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import Response
+
+from lib.docker import render_metrics
+from lib.enums import Permission
+from lib.env import METRICS_TOKEN
+from lib.prometheus import CONTENT_TYPE
+from lib.security import check_user_has_permission, get_user_from_token, oauth2_scheme
+
+router = APIRouter(tags=["metrics"])
+
+
+def metrics_token(token: Annotated[str, Depends(oauth2_scheme)]):
+    if METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN):
+        return
+    check_user_has_permission(get_user_from_token(token), [Permission.Resource])
+
+
+@router.get(
+    "/metrics",
+    description="Container usage, container states, and backend and Docker call "
+    + "latencies in the Prometheus text format. Bearer token: `METRICS_TOKEN` or "
+    + "a user token with the Resource permission",
+    dependencies=[Depends(metrics_token)],
+    responses={200: {"content": {CONTENT_TYPE: {}}}},
+)
+async def metrics_api():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
@@ -0,0 +1,5 @@
+import os
+
+# Before any lib module reads them: no database file, no real daemon needed
+os.environ.setdefault("DB_URL", "sqlite://")
+os.environ.setdefault("SIGNATURE", "test")
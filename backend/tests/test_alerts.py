@@ -0,0 +1,268 @@
+import asyncio
+from typing import Any, Callable, Dict, List
+
+import pytest
+from docker.models.containers import Container
+from pydantic import ValidationError
+
+from lib.alerts import Alert, AlertEngine
+from lib.db import APIAlertRule, DBAlertRule
+from lib.stats import ContainerStats
+
+WEB = "a" * 64
+DB = "b" * 64
+MB = 1024**2
+
+
+class Inventory:
+    containers = {
+        WEB: Container(attrs={"Names": ["/web"], "Labels": {"tier": "front"}}),
+        DB: Container(attrs={"Names": ["/db"], "Labels": {"tier": "back"}}),
+    }
+
+    def peek(self, id: str) -> Container | None:
+        return self.containers.get(id)
+
+
+class Collector:
+    def on_sample(self, listener: Callable[[str, ContainerStats], None]):
+        self.sample = listener
+
+
+class Watcher:
+    def on(self, type: str, listener: Callable[[Dict[str, Any]], None]):
+        self.event = listener
+
+    def on_connect(self, listener: Any):
+        pass
+
+
+class Clock:
+    def __init__(self, monkeypatch: pytest.MonkeyPatch):
+        self.now = 1000.0
+        monkeypatch.setattr("lib.alerts.time.time", lambda: self.now)
+
+
+def stats(cpu: float = 0.0, memory: int = 0, limit: int = 100 * MB) -> ContainerStats:
+    return ContainerStats(
+        read_at=0,
+        cpu_percent=cpu,
+        memory_usage=memory,
+        memory_limit=limit,
+        network_rx=0,
+        network_tx=0,
+        block_read=0,
+        block_write=0,
+    )
+
+
+def rule(metric: str, threshold: float, duration: float = 0, **scope: str):
+    return DBAlertRule(
+        id=f"{metric}-rule",
+        name=metric,
+        metric=metric,
+        threshold=threshold,
+        duration=duration,
+        **scope,
+    )
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    return Clock(monkeypatch)
+
+
+class Harness:
+    def __init__(self, rules: List[DBAlertRule]):
+        self.collector, self.watcher = Collector(), Watcher()
+        self.engine = AlertEngine(
+            Inventory(),  # type: ignore
+            self.collector,  # type: ignore
+            self.watcher,  # type: ignore
+        )
+        self.rules = rules
+        self.pushed: List[Alert | None] = []
+
+    def run(self, steps: Callable[["Harness"], Any]):
+        async def main():
+            self.engine.start(self.rules)
+            async with self.engine.subscription() as queue:
+                result = steps(self)
+                if asyncio.iscoroutine(result):
+                    await result
+                # Let the events scheduled from the watcher thread run
+                await asyncio.sleep(0)
+                while not queue.empty():
+                    self.pushed.append(queue.get_nowait())
+            self.engine.stop()
+
+        asyncio.run(main())
+
+    def event(self, action: str, id: str):
+        self.watcher.event({"Action": action, "Actor": {"ID": id}})
+
+    def states(self) -> List[tuple]:
+        return [
+            (alert.rule_name, alert.container_name, alert.state)
+            for alert in self.pushed
+            if alert is not None
+        ]
+
+
+def test_fires_after_the_duration_then_resolves(clock):
+    harness = Harness([rule("cpu_percent", 50, duration=10)])
+
+    def steps(harness: Harness):
+        harness.collector.sample(WEB, stats(cpu=80))
+        clock.now += 5
+        harness.collector.sample(WEB, stats(cpu=90))
+        assert harness.engine.alerts() == []
+        clock.now += 5
+        harness.collector.sample(WEB, stats(cpu=95))
+        [alert] = harness.engine.alerts()
+        assert (alert.value, alert.since, alert.state) == (95, 1000.0, "firing")
+        clock.now += 1
+        harness.collector.sample(WEB, stats(cpu=10))
+
+    harness.run(steps)
+    assert harness.states() == [
+        ("cpu_percent", "web", "firing"),
+        ("cpu_percent", "web", "resolved"),
+    ]
+    [resolved] = harness.engine.alerts()
+    assert resolved.resolved_at == 1011.0
+
+
+def test_a_dip_restarts_the_duration(clock):
+    harness = Harness([rule("cpu_percent", 50, duration=10)])
+
+    def steps(harness: Harness):
+        for cpu in (80, 10, 80):
+            harness.collector.sample(WEB, stats(cpu=cpu))
+            clock.now += 6
+
+    harness.run(steps)
+    assert harness.states() == []
+
+
+def test_memory_rules_and_scopes(clock):
+    harness = Harness(
+        [
+            rule("memory_usage", 50 * MB, container="we*"),
+            rule("memory_percent", 50, label="tier=back"),
+        ]
+    )
+
+    def steps(harness: Harness):
+        for id in (WEB, DB):
+            harness.collector.sample(id, stats(memory=60 * MB))
+
+    harness.run(steps)
+    assert harness.states() == [
+        ("memory_usage", "web", "firing"),
+        ("memory_percent", "db", "firing"),
+    ]
+
+
+def test_unknown_containers_are_not_evaluated(clock):
+    harness = Harness([rule("cpu_percent", 50)])
+    harness.run(lambda harness: harness.collector.sample("c" * 64, stats(cpu=99)))
+    assert harness.states() == []
+
+
+def test_die_resolves_usage_alerts_and_resets_them(clock):
+    harness = Harness([rule("cpu_percent", 50, duration=10)])
+
+    async def steps(harness: Harness):
+        harness.collector.sample(WEB, stats(cpu=80))
+        clock.now += 10
+        harness.collector.sample(WEB, stats(cpu=80))
+        harness.event("die", WEB)
+        await asyncio.sleep(0)
+        # Started again much later: the duration counts from this reading
+        clock.now += 100
+        harness.collector.sample(WEB, stats(cpu=80))
+
+    harness.run(steps)
+    assert harness.states() == [
+        ("cpu_percent", "web", "firing"),
+        ("cpu_percent", "web", "resolved"),
+    ]
+
+
+def test_restarts_fire_and_expire_on_their_own(clock):
+    harness = Harness([rule("restarts", 2, duration=0.05)])
+
+    async def steps(harness: Harness):
+        for _ in range(3):
+            harness.event("start", WEB)
+        await asyncio.sleep(0)
+        [alert] = harness.engine.alerts()
+        assert (alert.value, alert.state) == (3, "firing")
+        # Nothing reads the alerts: the resolution is pushed by the timer
+        clock.now += 1
+        await asyncio.sleep(0.1)
+
+    harness.run(steps)
+    assert harness.states() == [
+        ("restarts", "web", "firing"),
+        ("restarts", "web", "resolved"),
+    ]
+
+
+def test_removed_rules_and_containers_resolve(clock):
+    harness = Harness([rule("cpu_percent", 50), rule("memory_usage", 1)])
+
+    async def steps(harness: Harness):
+        harness.collector.sample(WEB, stats(cpu=80, memory=10))
+        harness.collector.sample(DB, stats(cpu=80, memory=10))
+        harness.engine.set_rules([rule("memory_usage", 1)])
+        harness.event("destroy", DB)
+        await asyncio.sleep(0)
+
+    harness.run(steps)
+    assert sorted(harness.states()) == sorted(
+        [
+            ("cpu_percent", "web", "firing"),
+            ("memory_usage", "web", "firing"),
+            ("cpu_percent", "db", "firing"),
+            ("memory_usage", "db", "firing"),
+            ("cpu_percent", "web", "resolved"),
+            ("cpu_percent", "db", "resolved"),
+            ("memory_usage", "db", "resolved"),
+        ]
+    )
+
+
+def test_slow_subscribers_get_none(clock):
+    harness = Harness([rule("cpu_percent", 50)])
+    harness.engine.buffer = 1
+
+    def steps(harness: Harness):
+        for cpu in (80, 10, 80):
+            harness.collector.sample(WEB, stats(cpu=cpu))
+
+    harness.run(steps)
+    assert harness.pushed == [None]
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"threshold": -1},
+        {"threshold": 1, "duration": -1},
+        {"threshold": 1, "container": " "},
+        {"threshold": 1, "label": ""},
+        {"threshold": 1, "label": "=front"},
+    ],
+)
+def test_invalid_rules(fields: Dict[str, Any]):
+    with pytest.raises(ValidationError):
+        APIAlertRule(name="rule", metric="cpu_percent", **fields)
+
+
+def test_rule_patterns_are_stripped():
+    api_rule = APIAlertRule(
+        name="rule", metric="cpu_percent", threshold=1, container=" web ", label="a "
+    )
+    assert (api_rule.container, api_rule.label) == ("web", "a")
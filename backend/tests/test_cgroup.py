@@ -0,0 +1,135 @@
+import os
+
+import psutil
+import pytest
+
+from lib.cgroup import CgroupReader
+
+ID = "f" * 64
+
+NET_DEV = """Inter-|   Receive                            |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes ...
+    lo: 500 5 0 0 0 0 0 0 500 5 0 0 0 0 0 0
+  eth0: 1000 10 0 0 0 0 0 0 2000 20 0 0 0 0 0 0
+  eth1: 30 1 0 0 0 0 0 0 40 1 0 0 0 0 0 0
+"""
+
+
+def write(path: str, content: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("lib.cgroup.time.monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def proc(tmp_path) -> str:
+    write(str(tmp_path / "proc" / "42" / "net" / "dev"), NET_DEV)
+    return str(tmp_path / "proc")
+
+
+def v2(root: str, usage_usec: int, memory_max: str = "1048576") -> str:
+    path = os.path.join(root, "system.slice", f"docker-{ID}.scope")
+    write(os.path.join(root, "cgroup.controllers"), "cpu io memory")
+    write(os.path.join(path, "cpu.stat"), f"usage_usec {usage_usec}\nuser_usec 1\n")
+    write(os.path.join(path, "memory.current"), "4096\n")
+    write(os.path.join(path, "memory.max"), memory_max + "\n")
+    write(
+        os.path.join(path, "io.stat"),
+        "8:0 rbytes=100 wbytes=200 rios=1 wios=2\n8:16 rbytes=1 wbytes=2\n",
+    )
+    return path
+
+
+def v1(root: str, usage_ns: int):
+    for controller in ("cpu,cpuacct", "memory", "blkio"):
+        os.makedirs(os.path.join(root, controller, "docker", ID))
+    path = os.path.join(root, "{}", "docker", ID)
+    write(os.path.join(path.format("cpu,cpuacct"), "cpuacct.usage"), f"{usage_ns}\n")
+    write(os.path.join(path.format("memory"), "memory.usage_in_bytes"), "8192\n")
+    # Unlimited: a huge number
+    write(
+        os.path.join(path.format("memory"), "memory.limit_in_bytes"),
+        "9223372036854771712\n",
+    )
+    write(
+        os.path.join(path.format("blkio"), "blkio.throttle.io_service_bytes"),
+        "8:0 Read 300\n8:0 Write 400\n8:0 Total 700\nTotal 700\n",
+    )
+
+
+def test_no_cgroup_filesystem(tmp_path):
+    reader = CgroupReader(str(tmp_path))
+    assert not reader.enabled
+    assert not reader.locate(ID)
+
+
+def test_v2_reading(tmp_path, proc, clock):
+    root = str(tmp_path / "cgroup")
+    v2(root, usage_usec=1_000_000)
+    reader = CgroupReader(root, proc)
+    assert reader.version == 2
+    assert not reader.locate("0" * 64)
+    assert reader.locate(ID)
+
+    first = reader.read(ID, pid=42)
+    assert first is not None
+    assert first.cpu_percent == 0.0
+    assert (first.memory_usage, first.memory_limit) == (4096, 1048576)
+    assert (first.block_read, first.block_write) == (101, 202)
+    # Loopback left out
+    assert (first.network_rx, first.network_tx) == (1030, 2040)
+
+    # Half a CPU second over two seconds
+    v2(root, usage_usec=1_500_000)
+    clock[0] += 2
+    second = reader.read(ID, pid=42)
+    assert second is not None
+    assert second.cpu_percent == pytest.approx(25.0)
+
+
+def test_v2_unlimited_memory_and_no_pid(tmp_path, clock):
+    root = str(tmp_path)
+    v2(root, usage_usec=0, memory_max="max")
+    reader = CgroupReader(root)
+    assert reader.locate(ID)
+    stats = reader.read(ID)
+    assert stats is not None
+    assert stats.memory_limit == psutil.virtual_memory().total
+    assert (stats.network_rx, stats.network_tx) == (0, 0)
+
+
+def test_v1_reading(tmp_path, clock):
+    root = str(tmp_path)
+    v1(root, usage_ns=2_000_000_000)
+    reader = CgroupReader(root)
+    assert reader.version == 1
+    assert reader.locate(ID)
+    assert reader.read(ID) is not None
+
+    v1_cpu = os.path.join(root, "cpu,cpuacct", "docker", ID, "cpuacct.usage")
+    write(v1_cpu, "3000000000\n")
+    clock[0] += 1
+    stats = reader.read(ID)
+    assert stats is not None
+    assert stats.cpu_percent == pytest.approx(100.0)
+    assert stats.memory_usage == 8192
+    assert stats.memory_limit == psutil.virtual_memory().total
+    assert (stats.block_read, stats.block_write) == (300, 400)
+
+
+def test_removed_cgroup_is_forgotten(tmp_path, clock):
+    root = str(tmp_path)
+    path = v2(root, usage_usec=0)
+    reader = CgroupReader(root)
+    assert reader.locate(ID)
+    os.remove(os.path.join(path, "cpu.stat"))
+    assert reader.read(ID) is None
+    # Located again from scratch next time
+    assert reader.read(ID) is None
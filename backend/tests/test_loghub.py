@@ -0,0 +1,157 @@
+import asyncio
+import struct
+from typing import List
+
+import pytest
+
+from lib.loghub import LogHub, encode_lines, read_batch
+
+
+def decode(batch: bytes) -> List[str]:
+    lines: List[str] = []
+    while batch:
+        (size,) = struct.unpack(">I", batch[:4])
+        lines.append(batch[4 : 4 + size].decode("utf-8"))
+        batch = batch[4 + size :]
+    return lines
+
+
+def test_encode_lines_round_trip():
+    lines = ["plain\n", "", "ünïcode ✓\n", "x" * 70000]
+    batch = encode_lines(lines)
+    # Lengths are in bytes, not characters
+    assert batch[:4] == struct.pack(">I", 6)
+    assert decode(batch) == lines
+    assert encode_lines([]) == b""
+
+
+def queue_of(*lines: str | None) -> "asyncio.Queue[str | None]":
+    queue: asyncio.Queue[str | None] = asyncio.Queue()
+    for line in lines:
+        queue.put_nowait(line)
+    return queue
+
+
+def test_read_batch_takes_what_is_queued():
+    async def main():
+        return await read_batch(queue_of("a", "b", "c"), wait=1)
+
+    assert asyncio.run(main()) == (["a", "b", "c"], False)
+
+
+def test_read_batch_stops_at_the_end():
+    async def main():
+        queue = queue_of("a", None, "never")
+        return await read_batch(queue, wait=1), await read_batch(queue_of(None), 1)
+
+    assert asyncio.run(main()) == ((["a"], True), ([], True))
+
+
+def test_read_batch_times_out_without_a_first_line():
+    async def main():
+        await read_batch(queue_of(), wait=0.01)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(main())
+
+
+def test_read_batch_waits_for_the_window():
+    async def main():
+        queue = queue_of("a")
+
+        async def later():
+            await asyncio.sleep(0.01)
+            queue.put_nowait("b")
+            await asyncio.sleep(0.2)
+            queue.put_nowait("too late")
+
+        feeder = asyncio.create_task(later())
+        batch = await read_batch(queue, wait=1, window=0.1)
+        feeder.cancel()
+        return batch
+
+    assert asyncio.run(main()) == (["a", "b"], False)
+
+
+def test_read_batch_stops_at_max_bytes():
+    async def main():
+        queue = queue_of("aaaa", "bbbb", "cccc", "dddd")
+        return await read_batch(queue, wait=1, max_bytes=8), queue.qsize()
+
+    assert asyncio.run(main()) == ((["aaaa", "bbbb"], False), 2)
+
+
+class Engine:
+    """Logs of one container: `backlog` lines at once, then those put in `live`."""
+
+    def __init__(self, backlog: int):
+        self.backlog = backlog
+        self.live: asyncio.Queue[str] = asyncio.Queue()
+        self.tails: List[int | str] = []
+
+    async def stream_frames(self, method: str, path: str, params, tty=False):
+        self.tails.append(params["tail"])
+        for index in range(self.backlog):
+            yield f"old {index}\n".encode()
+        while True:
+            yield (await self.live.get()).encode()
+
+
+async def drain(queue: "asyncio.Queue[str | None]") -> List[str | None]:
+    await asyncio.sleep(0.01)
+    lines: List[str | None] = []
+    while not queue.empty():
+        lines.append(queue.get_nowait())
+    return lines
+
+
+def test_one_stream_shared_between_viewers():
+    async def main():
+        engine = Engine(backlog=3)
+        hub = LogHub(engine, history=2)  # type: ignore
+        async with hub.subscription("x") as first:
+            first_lines = await drain(first)
+            async with hub.subscription("x") as second:
+                replayed = await drain(second)
+                engine.live.put_nowait("new\n")
+                live = await drain(first), await drain(second)
+        assert hub._streams == {}
+        return engine.tails, first_lines, replayed, live
+
+    tails, first, replayed, live = asyncio.run(main())
+    # No tail: the whole log for the first viewer, the kept lines for the next
+    assert tails == ["all"]
+    assert first == ["old 0\n", "old 1\n", "old 2\n"]
+    assert replayed == ["old 1\n", "old 2\n"]
+    assert live == (["new\n"], ["new\n"])
+
+
+def test_tails_of_each_viewer():
+    async def main():
+        engine = Engine(backlog=5)
+        hub = LogHub(engine, history=3)  # type: ignore
+        async with hub.subscription("x", tail=2) as first:
+            await drain(first)
+            async with hub.subscription("x", tail=1) as second:
+                return engine.tails, await drain(second)
+
+    assert asyncio.run(main()) == ([2], ["old 4\n"])
+
+
+def test_first_viewer_paces_the_stream_and_laggards_are_ended():
+    async def main():
+        engine = Engine(backlog=100)
+        hub = LogHub(engine, history=5, buffer=5)  # type: ignore
+        async with hub.subscription("x") as first:
+            # Joins while the backlog is still coming, never reads
+            await asyncio.sleep(0)
+            async with hub.subscription("x") as laggard:
+                received: List[str | None] = []
+                while len(received) < 100:
+                    received.append(await asyncio.wait_for(first.get(), 1))
+                    await asyncio.sleep(0)
+                return received, await drain(laggard)
+
+    received, laggard = asyncio.run(main())
+    assert received == [f"old {index}\n" for index in range(100)]
+    assert laggard == [None]
@@ -0,0 +1,248 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from lib.metrics import (
+    AGGREGATES,
+    CONTAINER_FIELDS,
+    HOST,
+    HOST_FIELDS,
+    MetricsStore,
+    rollup,
+)
+
+# On a boundary of every tier
+T0 = 1_699_999_200
+TIERS = [(10, 3600), (60, 86400)]
+
+
+def store(directory: str | None = None) -> MetricsStore:
+    # Sampling is driven by the tests, no sampler or collector needed
+    return MetricsStore(
+        None,  # type: ignore
+        None,  # type: ignore
+        resolution=1,
+        retention=600,
+        tiers=TIERS,
+        directory=directory,
+    )
+
+
+def record_host(metrics: MetricsStore, seconds: range, cpu=lambda t: float(t % 10)):
+    for t in seconds:
+        metrics.record(HOST, HOST_FIELDS, T0 + t, [cpu(t), 1000.0])
+        metrics.close_buckets(T0 + t)
+
+
+def test_rollup_of_raw_rows():
+    # 2 groups of 3 raw rows, 1 field, the second group partly missing
+    rows = np.array([[1.0, 3.0, 2.0], [np.nan, 5.0, np.nan]]).reshape(2, 3, 1, 1)
+    output = rollup(rows)
+    assert output.shape == (2, len(AGGREGATES), 1)
+    assert output[0, :, 0].tolist() == [1.0, 3.0, 2.0, 2.0]
+    assert output[1, :, 0].tolist() == [5.0, 5.0, 5.0, 5.0]
+
+
+def test_rollup_of_rollups_and_empty_groups():
+    # min, max, avg, last of two buckets, then a group without any row
+    rows = np.array(
+        [[[1.0, 4.0, 2.0, 3.0], [0.0, 9.0, 4.0, 8.0]], [[np.nan] * 4] * 2]
+    ).reshape(2, 2, 4, 1)
+    output = rollup(rows)
+    assert output[0, :, 0].tolist() == [0.0, 9.0, 3.0, 8.0]
+    assert np.isnan(output[1]).all()
+
+
+def test_step_covering_and_tier_for():
+    metrics = store()
+    assert metrics.step_covering(300) == 1
+    assert metrics.step_covering(3600) == 10
+    assert metrics.step_covering(10**9) == 60
+    assert metrics.span == 86400
+    assert metrics.tier_for(HOST, 60) is None
+    metrics.record(HOST, HOST_FIELDS, T0, [0.0, 0.0])
+    assert [metrics.tier_for(HOST, step).step for step in (1, 30, 120)] == [1, 10, 60]
+
+
+def test_tier_steps_must_nest():
+    with pytest.raises(ValueError):
+        MetricsStore(None, None, 1, 600, [(10, 3600), (25, 86400)])  # type: ignore
+
+
+def test_history_from_raw_samples():
+    metrics = store()
+    record_host(metrics, range(0, 30))
+    # From the raw tier, the 10 s one has not closed its last bucket yet
+    history = metrics.history(HOST, T0, T0 + 29, 5)
+    assert history is not None
+    assert (history.start, history.step) == (T0, 5)
+    assert history.series["cpu_percent"]["avg"] == [2.0, 7.0] * 3
+
+    record_host(metrics, range(30, 31))
+    history = metrics.history(HOST, T0, T0 + 29, 10)
+    assert history is not None
+    assert (history.start, history.step) == (T0, 10)
+    assert history.timestamps == [T0, T0 + 10, T0 + 20]
+    cpu = history.series["cpu_percent"]
+    assert cpu["min"] == [0.0, 0.0, 0.0]
+    assert cpu["max"] == [9.0, 9.0, 9.0]
+    assert cpu["avg"] == [4.5, 4.5, 4.5]
+    assert cpu["last"] == [9.0, 9.0, 9.0]
+
+
+def test_history_from_a_coarser_tier_with_gaps():
+    metrics = store()
+    record_host(metrics, range(0, 120))
+    record_host(metrics, range(180, 241))
+    history = metrics.history(HOST, T0, T0 + 240, 60)
+    assert history is not None
+    assert history.step == 60
+    # The third minute was never recorded
+    assert history.series["cpu_percent"]["avg"] == [4.5, 4.5, None, 4.5, None]
+
+
+def test_history_of_an_unknown_series():
+    assert store().history("nope", T0, T0 + 60, 10) is None
+
+
+def test_step_is_capped_at_the_span():
+    metrics = store()
+    record_host(metrics, range(0, 120))
+    history = metrics.history(HOST, T0, T0 + 120, 10**9)
+    assert history is not None
+    assert history.step == metrics.span
+
+
+def test_large_counters_keep_their_precision():
+    metrics = store()
+    base = 200e9
+    for t in range(0, 30):
+        metrics.record("c", CONTAINER_FIELDS, T0 + t, [0, 0, base + 1001 * t, 0, 0, 0])
+    history = metrics.history("c", T0, T0 + 29, 1)
+    assert history is not None
+    received = history.series["network_rx"]["last"]
+    assert [b - a for a, b in zip(received, received[1:])] == [1001.0] * 29
+
+
+def test_mapped_files_survive_a_restart(tmp_path):
+    directory = str(tmp_path)
+    metrics = store(directory)
+    record_host(metrics, range(0, 30))
+    metrics.record("gone", CONTAINER_FIELDS, T0, [0.0] * 6)
+    assert sorted(os.listdir(directory)) == ["gone.bin", "host.bin"]
+    before = metrics.history(HOST, T0, T0 + 29, 10)
+
+    restarted = store(directory)
+
+    async def start():
+        restarted.start(keep={HOST})
+        await restarted.stop()
+
+    asyncio.run(start())
+    assert os.listdir(directory) == ["host.bin"]
+    assert restarted.history(HOST, T0, T0 + 29, 10) == before
+
+
+def test_a_file_of_another_layout_is_started_over(tmp_path):
+    directory = str(tmp_path)
+    record_host(store(directory), range(0, 30))
+    other = MetricsStore(None, None, 1, 600, [(10, 7200)], directory)  # type: ignore
+    other.record(HOST, HOST_FIELDS, T0 + 100, [1.0, 1.0])
+    history = other.history(HOST, T0, T0 + 29, 1)
+    assert history is not None
+    assert set(history.series["cpu_percent"]["last"]) == {None}
+
+
+def test_forget_drops_the_series_and_its_file(tmp_path):
+    metrics = store(str(tmp_path))
+    metrics.record("c", CONTAINER_FIELDS, T0, [0.0] * 6)
+    metrics.forget("c")
+    assert metrics.history("c", T0, T0 + 10, 1) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_close_buckets_catches_up_after_a_pause():
+    metrics = store()
+    for t in range(0, 100):
+        metrics.record(HOST, HOST_FIELDS, T0 + t, [float(t), 0.0])
+        # No close between 15 and 100 s, e.g. a suspended process
+        if t < 15:
+            metrics.close_buckets(T0 + t)
+    metrics.close_buckets(T0 + 100)
+    history = metrics.history(HOST, T0, T0 + 99, 10)
+    assert history is not None
+    assert history.series["cpu_percent"]["last"] == [9.0 + 10 * i for i in range(10)]
+
+
+def test_first_close_only_rolls_up_the_latest_bucket():
+    metrics = store()
+    for t in range(0, 60):
+        metrics.record(HOST, HOST_FIELDS, T0 + t, [float(t), 0.0])
+    metrics.close_buckets(T0 + 60)
+    history = metrics.history(HOST, T0, T0 + 59, 10)
+    assert history is not None
+    assert history.series["cpu_percent"]["last"] == [None] * 5 + [59.0]
+
+
+def record_container(metrics: MetricsStore, id: str, seconds: range, row):
+    for t in seconds:
+        values = row(t)
+        if values is not None:
+            metrics.record(id, CONTAINER_FIELDS, T0 + t, values)
+        metrics.close_buckets(T0 + t)
+
+
+def usage(metrics: MetricsStore, window: float, fields, counters: bool):
+    now = T0 + 299.5
+    return dict(metrics.usage(now - window, now, fields, counters))
+
+
+@pytest.mark.parametrize("chunk", [1, 256])
+def test_usage_of_gauges(monkeypatch, chunk: int):
+    monkeypatch.setattr("lib.metrics.USAGE_CHUNK", chunk)
+    metrics = store()
+    record_host(metrics, range(0, 300))
+    record_container(metrics, "a", range(0, 300), lambda t: [50.0, 2e6, 0, 0, 0, 0])
+    record_container(metrics, "b", range(250, 300), lambda t: [10.0, 1e6, 0, 0, 0, 0])
+    # Too old for the window
+    record_container(metrics, "c", range(0, 10), lambda t: [99.0, 0, 0, 0, 0, 0])
+    assert usage(metrics, 100, ("cpu_percent",), False) == {"a": 50.0, "b": 10.0}
+    assert usage(metrics, 100, ("memory_usage",), False) == {"a": 2e6, "b": 1e6}
+
+
+@pytest.mark.parametrize("chunk", [1, 256])
+def test_usage_of_counters(monkeypatch, chunk: int):
+    monkeypatch.setattr("lib.metrics.USAGE_CHUNK", chunk)
+    metrics = store()
+    # 100 B/s received, 10 B/s sent
+    record_container(
+        metrics, "a", range(0, 300), lambda t: [0, 0, 100.0 * t, 10.0 * t, 0, 0]
+    )
+    # Started mid-window, with missing readings: still 300 B/s
+    record_container(
+        metrics,
+        "late",
+        range(250, 300),
+        lambda t: [0, 0, 5000 + 300.0 * t, 0, 0, 0] if t % 7 else None,
+    )
+    fields = ("network_rx", "network_tx")
+    assert usage(metrics, 100, fields, True) == {"a": 110.0, "late": 300.0}
+
+
+def test_usage_of_counters_across_a_restart():
+    metrics = store()
+    # Restarted at 150 s, its counters start over from 0
+    record_container(
+        metrics, "a", range(0, 300), lambda t: [0, 0, 100.0 * (t % 150), 0, 0, 0]
+    )
+    assert usage(metrics, 100, ("network_rx",), True) == {"a": 100.0}
+    assert usage(metrics, 200, ("network_rx",), True)["a"] == pytest.approx(99.5)
+
+
+def test_usage_needs_two_rows_for_a_rate():
+    metrics = store()
+    record_container(metrics, "a", range(299, 300), lambda t: [1, 0, 10, 0, 0, 0])
+    assert usage(metrics, 100, ("network_rx",), True) == {}
+    assert usage(metrics, 100, ("cpu_percent",), False) == {"a": 1.0}
@@ -0,0 +1,98 @@
+import base64
+import json
+from typing import Dict, List
+
+import pytest
+
+from lib.errors import InvalidCursor, InvalidSortKey
+from lib.query import ListQuery, SortKeys, paginate
+
+Item = Dict[str, str | int]
+
+ITEMS: List[Item] = [
+    {"id": "a", "name": "web", "size": 3},
+    {"id": "b", "name": "db", "size": 1},
+    {"id": "c", "name": "cache", "size": 3},
+    {"id": "d", "name": "api", "size": 2},
+]
+SORT_KEYS: SortKeys[Item] = {
+    "name": lambda item: item["name"],
+    "size": lambda item: item["size"],
+}
+
+
+def page(items: List[Item], **query: str | int | None):
+    return paginate(
+        items, ListQuery(**query), SORT_KEYS, "name", lambda item: str(item["id"])
+    )
+
+
+def ids(items: List[Item]) -> List[str]:
+    return [str(item["id"]) for item in items]
+
+
+def test_default_sort_without_limit():
+    result = page(ITEMS)
+    assert ids(result.items) == ["d", "c", "b", "a"]
+    assert result.total == 4
+    assert result.next_cursor is None
+
+
+def test_ties_are_ordered_by_id():
+    assert ids(page(ITEMS, sort="size").items) == ["b", "d", "a", "c"]
+    assert ids(page(ITEMS, sort="-size").items) == ["c", "a", "d", "b"]
+
+
+@pytest.mark.parametrize("sort", ["size", "-size", "name", "-name"])
+def test_cursors_walk_every_item_once(sort: str):
+    seen: List[str] = []
+    cursor = None
+    while True:
+        result = page(ITEMS, sort=sort, limit=1, cursor=cursor)
+        assert result.total == 4
+        seen += ids(result.items)
+        cursor = result.next_cursor
+        if cursor is None:
+            break
+    assert seen == ids(page(ITEMS, sort=sort).items)
+
+
+def test_cursor_survives_removed_items():
+    first = page(ITEMS, sort="size", limit=2)
+    assert ids(first.items) == ["b", "d"]
+    remaining = [item for item in ITEMS if item["id"] != "d"]
+    rest = page(remaining, sort="size", limit=2, cursor=first.next_cursor)
+    assert ids(rest.items) == ["a", "c"]
+    assert rest.headers() == {"X-Total-Count": "3"}
+
+
+def test_headers_carry_the_next_cursor():
+    result = page(ITEMS, limit=3)
+    assert result.headers() == {
+        "X-Total-Count": "4",
+        "X-Next-Cursor": result.next_cursor,
+    }
+
+
+def test_unknown_sort_key():
+    with pytest.raises(InvalidSortKey):
+        page(ITEMS, sort="-created")
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "bm90IGpzb24=", "WzEsIDJd"])
+def test_malformed_cursor(cursor: str):
+    with pytest.raises(InvalidCursor):
+        page(ITEMS, cursor=cursor)
+
+
+def test_cursor_of_another_sort():
+    cursor = page(ITEMS, sort="size", limit=1).next_cursor
+    with pytest.raises(InvalidCursor):
+        page(ITEMS, sort="-size", cursor=cursor)
+
+
+def test_cursor_with_a_value_of_another_type():
+    # A "name" cursor whose value is a number cannot be compared to the names
+    forged = base64.urlsafe_b64encode(json.dumps(["name", 1, "b"]).encode()).decode()
+    with pytest.raises(InvalidCursor):
+        page(ITEMS, sort="name", cursor=forged)
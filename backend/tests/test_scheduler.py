@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+from lib.enums import Operation
+from lib.scheduler import DockerScheduler
+
+
+def scheduler(limit: int = 1) -> DockerScheduler:
+    return DockerScheduler({operation: limit for operation in Operation}, threads=2)
+
+
+def test_slots_bound_concurrency():
+    docker = scheduler(limit=2)
+    running = peak = 0
+
+    async def call():
+        nonlocal running, peak
+        async with docker.slot(Operation.SlowRead):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    stats = docker.stats()[Operation.SlowRead.value]
+    assert (stats.completed, stats.in_flight, stats.queued) == (6, 0, 0)
+    assert stats.wait_seconds_max > 0
+
+
+def test_classes_do_not_share_slots():
+    docker = scheduler(limit=1)
+    done = asyncio.Event()
+
+    async def slow():
+        async with docker.slot(Operation.SlowMutation):
+            # Would wait forever if the classes shared a semaphore
+            await done.wait()
+
+    async def quick():
+        async with docker.slot(Operation.FastRead):
+            done.set()
+
+    async def main():
+        async with asyncio.timeout(1):
+            await asyncio.gather(slow(), quick())
+
+    asyncio.run(main())
+    assert docker.stats()[Operation.FastRead.value].completed == 1
+
+
+def test_nested_slots_reuse_the_outer_one():
+    docker = scheduler(limit=1)
+
+    async def main():
+        async with asyncio.timeout(1):
+            async with docker.slot(Operation.Helper):
+                async with docker.slot(Operation.Helper):
+                    pass
+                async with docker.slot(Operation.FastRead):
+                    pass
+                # Blocking calls too, under the slot already held
+                return await docker.run(Operation.Helper, lambda: "done")
+
+    assert asyncio.run(main()) == "done"
+    stats = docker.stats()
+    assert stats[Operation.Helper.value].completed == 1
+    assert stats[Operation.FastRead.value].completed == 0
+
+
+def test_run_uses_the_dedicated_pool():
+    docker = scheduler()
+
+    async def main():
+        return await docker.run(
+            Operation.SlowRead, lambda: threading.current_thread().name
+        )
+
+    try:
+        assert asyncio.run(main()).startswith("docker-io")
+    finally:
+        docker.shutdown()
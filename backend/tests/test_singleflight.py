@@ -0,0 +1,141 @@
+import asyncio
+import threading
+
+from lib.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_flight():
+    flights = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        call = calls
+        await asyncio.sleep(0.01)
+        return call
+
+    async def main():
+        return await asyncio.gather(
+            *(flights.do("images", None, fetch) for _ in range(5)),
+            flights.do("images", "other key", fetch),
+        )
+
+    assert asyncio.run(main()) == [1, 1, 1, 1, 1, 2]
+
+
+def test_no_cache_without_ttl():
+    flights = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def main():
+        return [await flights.do("images", None, fetch) for _ in range(2)]
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_ttl_caches_until_forgotten():
+    flights = SingleFlight({"images": 60})
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def main():
+        first = await flights.do("images", None, fetch)
+        cached = await flights.do("images", None, fetch)
+        flights.forget("images")
+        return first, cached, await flights.do("images", None, fetch)
+
+    assert asyncio.run(main()) == (1, 1, 2)
+
+
+def test_forget_during_a_flight_drops_its_result():
+    flights = SingleFlight({"images": 60})
+
+    async def main():
+        started, done = asyncio.Event(), asyncio.Event()
+
+        async def fetch():
+            started.set()
+            await done.wait()
+            return "outdated"
+
+        flight = asyncio.create_task(flights.do("images", None, fetch))
+        await started.wait()
+        flights.forget("images")
+        done.set()
+        # The caller still gets its result, it is just not kept
+        assert await flight == "outdated"
+        return await flights.do("images", None, lambda: asyncio.sleep(0, "fresh"))
+
+    assert asyncio.run(main()) == "fresh"
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "result"
+
+    async def main():
+        first = asyncio.create_task(flights.do("images", None, fetch))
+        second = asyncio.create_task(flights.do("images", None, fetch))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "result"
+
+
+def test_errors_are_shared_and_not_cached():
+    flights = SingleFlight({"images": 60})
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError(calls)
+
+    async def main():
+        results = await asyncio.gather(
+            *(flights.do("images", None, fetch) for _ in range(3)),
+            return_exceptions=True,
+        )
+        again = await asyncio.gather(
+            flights.do("images", None, fetch), return_exceptions=True
+        )
+        return results + again
+
+    assert [error.args for error in asyncio.run(main())] == [(1,), (1,), (1,), (2,)]
+
+
+def test_forget_threadsafe_runs_on_the_loop():
+    flights = SingleFlight({"images": 60})
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def main():
+        await flights.do("images", None, fetch)
+        thread = threading.Thread(target=flights.forget_threadsafe, args=("images",))
+        thread.start()
+        thread.join()
+        # Scheduled, not applied from the other thread
+        assert await flights.do("images", None, fetch) == 1
+        await asyncio.sleep(0)
+        return await flights.do("images", None, fetch)
+
+    assert asyncio.run(main()) == 2
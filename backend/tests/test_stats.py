@@ -0,0 +1,92 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Tuple
+
+from lib.cgroup import CgroupReader
+from lib.stats import ContainerStats, ContainerStatsCollector
+
+ID = "f" * 64
+
+
+class Watcher:
+    def on(self, type: str, listener: Any):
+        pass
+
+    def on_connect(self, listener: Any):
+        pass
+
+
+class Inventory:
+    async def inspect(self, id: str) -> Dict[str, Any]:
+        return {"State": {"Pid": None}}
+
+
+def cgroup(root: str):
+    path = os.path.join(root, "docker", ID)
+    os.makedirs(path, exist_ok=True)
+    for name, content in (
+        ("cpu.stat", "usage_usec 0\n"),
+        ("memory.current", "1024\n"),
+        ("memory.max", "4096\n"),
+        ("io.stat", ""),
+    ):
+        with open(os.path.join(path, name), "w") as file:
+            file.write(content)
+    with open(os.path.join(root, "cgroup.controllers"), "w") as file:
+        file.write("cpu memory io")
+
+
+def collector(root: str) -> ContainerStatsCollector:
+    return ContainerStatsCollector(
+        None,  # type: ignore
+        Inventory(),  # type: ignore
+        Watcher(),  # type: ignore
+        cgroups=CgroupReader(root),
+        interval=0.01,
+    )
+
+
+def poll(stats: ContainerStatsCollector, readings: int):
+    assert stats.cgroups is not None and stats.cgroups.locate(ID)
+    cpu = iter(range(readings))
+
+    def read_v2(path: str):
+        # Busy all along: each reading adds CPU time, then the container is gone
+        try:
+            return float(next(cpu)), 1024, 4096, 0, 0
+        except StopIteration:
+            raise FileNotFoundError(path)
+
+    stats.cgroups._read_v2 = read_v2  # type: ignore
+
+    asyncio.run(stats._poll_cgroup(ID))
+
+
+def test_first_cgroup_reading_is_only_a_baseline(tmp_path):
+    root = str(tmp_path)
+    cgroup(root)
+    stats = collector(root)
+    samples: List[Tuple[str, ContainerStats]] = []
+    stats.on_sample(lambda id, sample: samples.append((id, sample)))
+    poll(stats, readings=5)
+
+    assert len(samples) == 4
+    assert all(id == ID for id, _ in samples)
+    # No 0% reading from the missing baseline
+    assert all(sample.cpu_percent > 0 for _, sample in samples)
+    assert stats.get(ID) == samples[-1][1]
+
+
+def test_a_failing_listener_does_not_stop_the_readings(tmp_path):
+    root = str(tmp_path)
+    cgroup(root)
+    stats = collector(root)
+    samples: List[ContainerStats] = []
+
+    def broken(id: str, sample: ContainerStats):
+        raise RuntimeError("broken listener")
+
+    stats.on_sample(broken)
+    stats.on_sample(lambda id, sample: samples.append(sample))
+    poll(stats, readings=4)
+    assert len(samples) == 3